@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel>
+# Date:   2026-10-17T18:42:10+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T18:42:12+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Regrid gridded observations (CMORPH, EOBS...) to the WRF grid
+# (geo_em of a run) for comparison with the simulations, or to a regular
+# lat-lon grid (cdo griddes file). The sparse weights (mylibs.regrid) are
+# computed once for the observation grid and stored in path_out/weights,
+# so every later file or variable only costs a sparse matrix product.
+# Conservative remapping needs a lat-lon target (-g).
+# Example: ./Regrid_OBS_to_WRF.py -i "MED_CMORPH_V1.0_ADJ_8km-30min_2011*.nc" -v cmorph -n CMORPH
+#          ./Regrid_OBS_to_WRF.py -i "rr_ens_mean_0.1deg_reg_v24.0e.nc" -v rr -n EOBS -g era5_grid -m conservative
+# Dependencies: netCDF4, numpy, scipy
+#
+# Files:
+#
+#####################################################################
+"""
+import os
+import optparse as opt
+import glob
+import datetime as dt
+import numpy as np
+import netCDF4 as nc
+from tqdm import tqdm
+
+import epicc_config as cfg
+from mylibs import regrid
+
+
+### Options
+parser = opt.OptionParser()
+parser.add_option("-i", "--input", dest="input",help="input files (pattern)", metavar="OPTION")
+parser.add_option("-v", "--var", dest="var",help="variable to regrid", metavar="OPTION")
+parser.add_option("-n", "--name", dest="name",help="name of the dataset (output files and weights)", metavar="OPTION")
+parser.add_option("-w", "--wrun", dest="wrun",default=cfg.wrun_ref,help="WRF run whose geo_em grid is the target", metavar="OPTION")
+parser.add_option("-g", "--griddes", dest="griddes",default=None,help="regular lat-lon target grid (cdo griddes file) instead of the WRF grid", metavar="OPTION")
+parser.add_option("-m", "--method", dest="method",default="bilinear",help="bilinear or conservative", metavar="OPTION")
+
+(opts, args) = parser.parse_args()
+###
+
+path_in = "/vg6/dargueso-NO-BKUP/OBS_DATA/"
+path_out = "/vg6/dargueso-NO-BKUP/OBS_DATA/regrid_WRF/"
+tchunk = 48  # Records regridded at a time
+
+lat_names = ["lat", "latitude"]
+lon_names = ["lon", "longitude"]
+
+###########################################################
+###########################################################
+
+def main():
+
+    if opts.griddes is None:
+        geofile = nc.Dataset(f"{cfg.geoem_in}/geo_em.d01.{opts.wrun}.nc")
+        dst_lat = geofile.variables["XLAT_M"][0, :]
+        dst_lon = geofile.variables["XLONG_M"][0, :]
+        geofile.close()
+        target = opts.wrun
+    else:
+        dst_lat, dst_lon = regrid.read_griddes(opts.griddes)
+        target = os.path.basename(opts.griddes)
+
+    filesin = sorted(glob.glob(f"{path_in}/{opts.input}"))
+    if not os.path.exists(f"{path_out}/weights"):
+        os.makedirs(f"{path_out}/weights")
+
+    regridder = None
+    for filein in tqdm(filesin):
+        fin = nc.Dataset(filein)
+        src_lat = fin.variables[[name for name in lat_names if name in fin.variables][0]][:]
+        src_lon = fin.variables[[name for name in lon_names if name in fin.variables][0]][:]
+
+        if regridder is None:
+            regridder = regrid.cached_regridder(
+                f"{path_out}/weights/{opts.name}_{target}_{opts.method}.npz",
+                src_lat, src_lon, dst_lat, dst_lon, opts.method)
+
+        fileout = f"{path_out}/{opts.name}_{target}_{os.path.basename(filein)}"
+        regrid_file(fin, fileout, opts.var, regridder, dst_lat, dst_lon)
+        fin.close()
+
+###########################################################
+###########################################################
+
+def regrid_file(fin, fileout, varname, regridder, dst_lat, dst_lon):
+    """Regrid varname (time, lat, lon) of fin, tchunk records at a time,
+    and write it with the target coordinates"""
+
+    vin = fin.variables[varname]
+    ntimes = vin.shape[0]
+    ny, nx = regridder.dst_shape
+
+    fout = nc.Dataset(fileout, "w", format="NETCDF4")
+    fout.createDimension("time", None)
+    fout.createDimension("y", ny)
+    fout.createDimension("x", nx)
+
+    tin = fin.variables["time"]
+    tout = fout.createVariable("time", tin.dtype, ("time",))
+    tout.setncatts({att: tin.getncattr(att) for att in tin.ncattrs() if att != "_FillValue"})
+    tout[:] = tin[:]
+
+    if np.ndim(dst_lat) == 1:
+        dst_lon, dst_lat = np.meshgrid(dst_lon, dst_lat)
+    latout = fout.createVariable("lat", "f4", ("y", "x"))
+    latout.setncatts({"units": "degrees_north", "standard_name": "latitude"})
+    latout[:] = dst_lat
+    lonout = fout.createVariable("lon", "f4", ("y", "x"))
+    lonout.setncatts({"units": "degrees_east", "standard_name": "longitude"})
+    lonout[:] = dst_lon
+
+    vout = fout.createVariable(varname, "f4", ("time", "y", "x"), zlib=True, complevel=5,
+                               chunksizes=(min(tchunk, ntimes), ny, nx), fill_value=1e20)
+    vout.setncatts({att: vin.getncattr(att) for att in vin.ncattrs()
+                    if att not in ["_FillValue", "missing_value"]})
+    vout.coordinates = "lat lon"
+
+    for t0 in range(0, ntimes, tchunk):
+        t1 = min(t0 + tchunk, ntimes)
+        vout[t0:t1] = np.ma.masked_invalid(regridder.apply(vin[t0:t1]))
+
+    setattr(fout, "creation_date", dt.datetime.today().strftime("%Y-%m-%d"))
+    setattr(fout, "comments", f"{varname} of {fin.filepath()} regridded ({regridder.method})")
+    fout.close()
+
+###############################################################################
+##### __main__  scope
+###############################################################################
+
+if __name__ == "__main__":
+
+    main()
+
+###############################################################################
@@ -52,6 +52,7 @@ parser.add_argument("-e", "--end"  ,dest="edatestr",type=str,help="Ending date
 parser.add_argument("-f", "--freq", dest="freq",help="Frequency to plot from 10min to monthly\n [default: hourly]",metavar="FREQ",default='01H',choices=['10MIN','01H','DAY','MON'])
 parser.add_argument("-v", "--var", dest="var", help="Variable to plot \n [default: RAIN]",metavar="VAR",default='RAIN')
 parser.add_argument("-r", "--reg", dest="reg", help="Region to plot \n [default: EPICC]",metavar="REG",default='EPICC',choices=cfg.reg_coords.keys())
+parser.add_argument("-q", "--sketch", dest="sketch", action="store_true", help="Use the monthly quantile sketches (whole months) instead of reading the postprocessed files")
 args = parser.parse_args()
 
 varname = args.var
@@ -106,22 +107,52 @@ cart_proj,lats,lons,hgt = get_geoinfo()
 
 mbounds = map_bounds(reg)
 
-filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_????-??-50mm_BAL.nc'))
-fin_all = xr.open_mfdataset(filesin,concat_dim="time", combine="nested")
-fin = fin_all.sel(time=slice(sdate,edate)).squeeze()
-#tot_seconds = int((fin.isel(time=-1).time-fin.isel(time=0).time)*1e-9)
-if reg!='EPICC':
-    fin_reg =  fin.where((fin.lat>=cfg.reg_coords[reg][0]) &\
-                         (fin.lat<=cfg.reg_coords[reg][2]) &\
-                        (fin.lon>=cfg.reg_coords[reg][1]) &\
-                        (fin.lon<=cfg.reg_coords[reg][3]),
-                        drop=True)
+if args.sketch:
+    # Mean and maximum are exact in the sketches, which are merged for the
+    # months of the period without reading the postprocessed files.
+    # The sketches are built from all the postprocessed precipitation, not
+    # from the 50mm BAL event files, so the figures are named differently.
+    # quantile_sketch lives in WRF_processing.
+    import os
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','WRF_processing'))
+    import quantile_sketch as qs
+    sample = 'sketch'
+    samplelabel = 'All hours (monthly sketches)'
+    filesin = qs.sel_sketch_files(sorted(glob(qs.sketch_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,freq,varname,'????-??'))),sdate,edate)
+    sketch = qs.merge_sketch_files(filesin)
+    dplot0 = sketch.mean()
+    dplot1 = sketch.quantile([1.])[0]
+    if reg!='EPICC':
+        inreg = ((to_np(lats)>=cfg.reg_coords[reg][0]) &\
+                 (to_np(lats)<=cfg.reg_coords[reg][2]) &\
+                 (to_np(lons)>=cfg.reg_coords[reg][1]) &\
+                 (to_np(lons)<=cfg.reg_coords[reg][3]))
+    else:
+        inreg = np.ones(dplot0.shape,dtype=bool)
+    xmax = np.nanmax(dplot1[inreg])
+    mmax = np.nanmax(dplot0[inreg])
+
 else:
-    fin_reg = fin
+    sample = '50mm_BAL'
+    samplelabel = 'Events >50mm BAL'
+    filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_????-??-50mm_BAL.nc'))
+    fin_all = xr.open_mfdataset(filesin,concat_dim="time", combine="nested")
+    fin = fin_all.sel(time=slice(sdate,edate)).squeeze()
+    #tot_seconds = int((fin.isel(time=-1).time-fin.isel(time=0).time)*1e-9)
+    if reg!='EPICC':
+        fin_reg =  fin.where((fin.lat>=cfg.reg_coords[reg][0]) &\
+                             (fin.lat<=cfg.reg_coords[reg][2]) &\
+                            (fin.lon>=cfg.reg_coords[reg][1]) &\
+                            (fin.lon<=cfg.reg_coords[reg][3]),
+                            drop=True)
+    else:
+        fin_reg = fin
 
 
-xmax = fin_reg.RAIN.max(skipna=True).values
-mmax = fin_reg.RAIN.mean(dim='time').max(skipna=True).values
+    xmax = fin_reg.RAIN.max(skipna=True).values
+    mmax = fin_reg.RAIN.mean(dim='time').max(skipna=True).values
+    dplot0 = fin[varname].mean(dim='time')
+    dplot1 = fin[varname].max(dim='time')
 
 lmean = MaxNLocator(nbins=15).tick_values(0,mmax)
 lmax = MaxNLocator(nbins=15).tick_values(0,xmax)
@@ -151,7 +182,6 @@ axs[0].add_feature(cfeature.BORDERS,linewidth=0.5)
 axs[0].text(0.5,1.02,f'Mean', fontsize='x-large', horizontalalignment='center', transform=axs[0].transAxes)
 #axs[0].text(0.98,0.92,f'{labeltop[freq]}', fontsize='medium', horizontalalignment='right', transform=axs[0].transAxes)
 #CS = axs[0].contour(to_np(lons), to_np(lats), fin[varname].mean('time')*tot_seconds,levels=11,linewidth=0)
-dplot0= fin[varname].mean(dim='time')
 m0=axs[0].contourf(to_np(lons), to_np(lats), dplot0,levels=lmean,
              transform=ccrs.PlateCarree(),
              cmap=cmap,extend='max')
@@ -169,10 +199,10 @@ axs[1].add_feature(cfeature.COASTLINE,linewidth=0.5)
 axs[1].add_feature(cfeature.BORDERS,linewidth=0.5)
 axs[1].text(0.5,1.02,f'{freq} Maximum Rate', fontsize='x-large', horizontalalignment='center', transform=axs[1].transAxes)
 axs[1].text(0.98,0.02,f'{labeltop[freq]}', fontsize='medium', horizontalalignment='right', transform=axs[1].transAxes)
+axs[1].text(0.02,0.02,samplelabel, fontsize='medium', horizontalalignment='left', transform=axs[1].transAxes)
 #CS = axs[1].contour(to_np(lons), to_np(lats), fin[varname].max('time')*tot_seconds,levels=11,linewidth=0)
 
-dplot1 = fin[varname].max(dim='time')
-m1=axs[1].contourf(to_np(lons), to_np(lats), dplot1.where(dplot1>0.1),levels=lmax,
+m1=axs[1].contourf(to_np(lons), to_np(lats), np.where(dplot1>0.1,dplot1,np.nan),levels=lmax,
                 transform=ccrs.PlateCarree(),
                 cmap=cmap,extend='max')
 
@@ -186,4 +216,4 @@ gl1.top_labels=False
 axs[1].colorbar(m1,length=0.7, loc='b',label=units[freq])
 
 #fig.subplots_adjust(left=0.1,right=0.9,top=0.9,bottom=0.15,wspace=0.1,hspace=0.2)
-plt.savefig(f'{cfg.path_out}/WRF_General/{varname}_{freq}_{sdate.strftime("%Y-%m-%d_%H-%M")}-{edate.strftime("%Y-%m-%d_%H-%M")}_{reg}-50mm_BAL.pdf')
+plt.savefig(f'{cfg.path_out}/WRF_General/{varname}_{freq}_{sdate.strftime("%Y-%m-%d_%H-%M")}-{edate.strftime("%Y-%m-%d_%H-%M")}_{reg}-{sample}.pdf')
@@ -5,10 +5,16 @@
 # Date:   2021-06-07T16:53:49+02:00
 # Email:  d.argueso@uib.es
 # Last modified by:   daniel
-# Last modified time: 2023-04-03
+# Last modified time: 2026-10-17
 # @Project@ EPICC
 # Version: 1.0 (Beta)
-# Description:
+# Description: Monthly climate change signal (ssp585 - historical annual
+# cycle) of each CMIP6 model regridded to the ERA5 grid. The monthly files of
+# both periods are read once, in chunks of records, accumulating per-month
+# sums and counts of the valid values; the delta is computed from them and
+# bilinearly remapped in-process to the ERA5 grid (era5_grid) with sparse
+# weights (mylibs.regrid) computed once per model grid and kept on disk.
+# Models are processed in parallel.
 #
 # Dependencies: Intersection of available models created with Get_CMIP6_Monthly_PGW_NCI.py
 #
@@ -17,16 +23,13 @@
 #####################################################################
 """
 
-import time
 import numpy as np
 import netCDF4 as nc
-import subprocess as subprocess
 from glob import glob
-import pandas as pd
-import xarray as xr
 import os, argparse
 from pathlib import Path
-from tqdm.auto import tqdm
+from joblib import Parallel, delayed
+from mylibs import regrid
 
 class bcolors:
     HEADER = "\033[95m"
@@ -77,6 +80,11 @@ def parse_args():
                 ' should be stored.',
                 default = "/vg5/dargueso/BDY_DATA/CMIP6/")
 
+    # number of models processed in parallel
+    parser.add_argument('-j', '--njobs', type=int,
+                help='Number of models processed in parallel',
+                default = 8)
+
     args = parser.parse_args()
     return args
 
@@ -96,13 +104,28 @@ else:
 variables = args.var_names.split(',')
 idir = args.input_dir
 odir = args.output_dir
+njobs = args.njobs
 experiments = ["historical", "ssp585"]
 syear_exp = {"historical": 1985, "ssp585": 2070}
 eyear_exp = {"historical": 2014, "ssp585": 2099}
 
-acycle_odir = f"{odir}/annual_cycle"
 deltas_odir = f"{odir}/deltas"
 regrid_era5 = f"{odir}/regrid_ERA5"
+weights_odir = f"{regrid_era5}/weights"
+era5_grid = "era5_grid"
+
+tchunk = 120  # Monthly records read at a time
+missingval = 1e20
+
+# Quality filters: values outside these ranges are not used
+valid_values = {
+    "hus": lambda x: (x >= 0) & (x <= 100),
+    "hur": lambda x: (x >= 0) & (x <= 100),
+    "ta": lambda x: (x >= 0) & (x < 400),
+    "ua": lambda x: (x > -500) & (x < 500),
+    "va": lambda x: (x > -500) & (x < 500),
+    "zg": lambda x: (x > -1000) & (x < 60000),
+}
 
 plvs=np.asarray([100000, 92500, 85000, 70000, 60000, 50000, 40000, 30000, 25000,
     20000, 15000, 10000, 7000, 5000, 3000, 2000, 1000, 500, 100 ])
@@ -110,127 +133,155 @@ plvs=np.asarray([100000, 92500, 85000, 70000, 60000, 50000, 40000, 30000, 25000,
 def main():
 
     print(f"{bcolors.HEADER}Creating Annual cycles and delta files{bcolors.ENDC}")
-    Path(acycle_odir).mkdir(exist_ok=True, parents=True)
     Path(deltas_odir).mkdir(exist_ok=True, parents=True)
     Path(regrid_era5).mkdir(exist_ok=True, parents=True)
-  
-    
-
-    for GCM in (tqdm(models)):
-        #pbar.set_description(f"{GCM}")
-
-        for vn, varname in enumerate(variables):
-
-            for exp in experiments:
-
-                syear = syear_exp[exp]
-                eyear = eyear_exp[exp]
-
-                calculate_annual_cycle(GCM,varname,exp,syear,eyear,idir,acycle_odir)
-        
-        
-            calculate_CC_signal(GCM,varname,acycle_odir,deltas_odir)
-
-            #REGRID TO ERA5
-            delta_file = f"{deltas_odir}/{GCM}/{varname}_delta.nc"
-            regrid_file = f"{regrid_era5}/{varname}_{GCM}_delta.nc"
-            if not os.path.isfile(regrid_file):
-                try:
-                    subprocess.check_output(
-                        f"cdo -remapbil,era5_grid {delta_file} {regrid_file}",
-                        shell=True,
-                    )
-                    print(f"{bcolors.OKGREEN}Regridded delta to ERA5: {GCM} {varname}{bcolors.ENDC}")
-                except Exception:
-                    raise SystemExit(
-                        f"{bcolors.ERROR}ERROR: Could not regrid to ERA5 grid: {GCM} {varname} {bcolors.ENDC}"
-                    )
-
-
 
+    dst_lat, dst_lon = regrid.read_griddes(era5_grid)
 
+    Parallel(n_jobs=njobs)(
+        delayed(process_model)(GCM, variables, dst_lat, dst_lon) for GCM in models
+    )
 
 
 ###########################################################
 ###########################################################
-def calculate_annual_cycle(GCM, varname,exp,syear,eyear,idir,odir):
-    """For a given model, member and variable,
-    Calculate annual cycle"""
-
-
-
-    filenames_all = sorted(glob(f"{idir}/{exp}/{varname}/{GCM}/{varname}*nc"))
-    finall = xr.open_mfdataset(filenames_all, concat_dim="time", combine="nested")
-
-    if finall.time.dtype=='O':
-        finall['time']=finall['time'].astype("datetime64[ns]")
-
-    Path(f"{odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
-
-    ofname = f"{odir}/{GCM}/{varname}_{exp}.nc"
-
-    if not os.path.isfile(ofname):
-        fin_p = finall.sel(time=slice(str(syear), str(eyear)))
-
-        if varname == "hus":
-            fin_p = fin_p.where((fin_p.hus >= 0) & (fin_p.hus <= 100))
-        elif varname == "hur":
-            fin_p = fin_p.where((fin_p.hur >= 0) & (fin_p.hur <= 100))
-        elif varname == "ta":
-            fin_p = fin_p.where((fin_p.ta >= 0) & (fin_p.ta < 400))
-        elif varname == "ua":
-            fin_p = fin_p.where((fin_p.ua > -500) & (fin_p.ua < 500))
-        elif varname == "va":
-            fin_p = fin_p.where((fin_p.va > -500) & (fin_p.va < 500))
-        elif varname == "zg":
-            fin_p = fin_p.where((fin_p.zg > -1000) & (fin_p.zg < 60000))
-
-        fin_p_mm = fin_p.groupby("time.month").mean("time")
-        fin_p_mm.to_netcdf(ofname)
-        print(f"{bcolors.OKGREEN}Created annual cycle file for {GCM} {varname} {exp}{bcolors.ENDC}")
-    else:
-        print(f"{bcolors.OKCYAN}{exp} {varname} {GCM} Already processed{bcolors.ENDC}")
-
-    finall.close()
+def process_model(GCM, variables, dst_lat, dst_lon):
+    """Delta of all the variables of a model, regridded to the ERA5 grid.
+    The remapping weights of the model grid are read from weights_odir, or
+    computed for the first variable and written there, and reused for all
+    the variables on the same grid"""
+
+    regridders = {}
+    for varname in variables:
+
+        regrid_file = f"{regrid_era5}/{varname}_{GCM}_delta.nc"
+        if os.path.isfile(regrid_file):
+            print(f"{bcolors.OKCYAN}CC file {varname} {GCM} Already processed{bcolors.ENDC}")
+            continue
+
+        filenames = {exp: sorted(glob(f"{idir}/{exp}/{varname}/{GCM}/{varname}*nc")) for exp in experiments}
+        if not all(filenames.values()):
+            print(f"{bcolors.WARNING}No files for {GCM} {varname}{bcolors.ENDC}")
+            continue
+
+        delta = calculate_CC_signal(GCM, varname, filenames)
+
+        fin = nc.Dataset(filenames["historical"][0])
+        src_lat = np.asarray(fin.variables["lat"][:])
+        src_lon = np.asarray(fin.variables["lon"][:])
+        grid = (len(src_lat), len(src_lon))
+        if grid not in regridders:
+            regridders[grid] = regrid.cached_regridder(
+                f"{weights_odir}/{GCM}_{grid[0]}x{grid[1]}_bilinear.npz",
+                src_lat, src_lon, dst_lat, dst_lon, "bilinear")
+
+        Path(f"{deltas_odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
+        write_delta(f"{deltas_odir}/{GCM}/{varname}_delta.nc", fin, varname, delta, src_lat, src_lon)
+
+        #REGRID TO ERA5
+        delta = regridders[grid].apply(delta)
+        write_delta(regrid_file, fin, varname, delta, dst_lat, dst_lon)
+        fin.close()
+        print(f"{bcolors.OKGREEN}Created delta file on the ERA5 grid for {GCM} {varname}{bcolors.ENDC}")
 
 
 ###########################################################
 ###########################################################
-def calculate_CC_signal(GCM, varname,idir,odir):
+def monthly_sums(filenames, varname, syear, eyear):
+    """Per-month sums and counts of the valid values of varname in the
+    records of filenames between syear and eyear (inclusive), read tchunk
+    records at a time"""
+
+    sums = None
+    for filename in filenames:
+        fin = nc.Dataset(filename)
+        time = fin.variables["time"]
+        dates = nc.num2date(time[:], time.units, getattr(time, "calendar", "standard"))
+        years = np.array([date.year for date in dates])
+        months = np.array([date.month for date in dates]) - 1
+        sel = np.where((years >= syear) & (years <= eyear))[0]
+
+        vin = fin.variables[varname]
+        vin.set_auto_mask(False)
+        fill = getattr(vin, "_FillValue", getattr(vin, "missing_value", missingval))
+        if sums is None:
+            sums = np.zeros((12,) + vin.shape[1:], np.float64)
+            counts = np.zeros((12,) + vin.shape[1:], np.int32)
+
+        for t0 in range(0, len(sel), tchunk):
+            tsel = sel[t0 : t0 + tchunk]
+            values = vin[tsel[0] : tsel[-1] + 1][tsel - tsel[0]].astype(np.float64)
+            valid = np.isfinite(values) & (values != fill)
+            if varname in valid_values:
+                with np.errstate(invalid="ignore"):
+                    valid &= valid_values[varname](values)
+            values = np.where(valid, values, 0.0)
+            for month in np.unique(months[tsel]):
+                inmonth = months[tsel] == month
+                sums[month] += values[inmonth].sum(axis=0)
+                counts[month] += valid[inmonth].sum(axis=0)
+        fin.close()
+
+    return sums, counts
+
+
+def calculate_CC_signal(GCM, varname, filenames):
     """From present and future annual cycle
-    calculate CC signal for every month"""
+    calculate CC signal for every month (12, ...), NaN where a month has
+    no valid values in any of the periods"""
 
-    ofname = f"{odir}/{GCM}/{varname}_delta.nc"
-    Path(f"{odir}/{GCM}/").mkdir(exist_ok=True, parents=True)
+    means = {}
+    for exp in experiments:
+        sums, counts = monthly_sums(filenames[exp], varname, syear_exp[exp], eyear_exp[exp])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[exp] = np.where(counts > 0, sums / counts, np.nan)
+        print(f"{bcolors.OKGREEN}Calculated annual cycle for {GCM} {varname} {exp}{bcolors.ENDC}")
 
-    if not os.path.isfile(ofname):
+    return (means["ssp585"] - means["historical"]).astype(np.float32)
 
-        fin_p = xr.open_dataset(f"{idir}/{GCM}/{varname}_historical.nc")
-        fin_f = xr.open_dataset(f"{idir}/{GCM}/{varname}_ssp585.nc")
-        #import pdb; pdb.set_trace()  # fmt: skip
-        fin_d = fin_f - fin_p
 
-        if "plev_bnds" in fin_d.keys():
-            fin_d = fin_d.drop(("plev_bnds"))
-        if "lon_bnds" in fin_d.keys():
-            fin_d = fin_d.drop(("lon_bnds"))
-        if "lat_bnds" in fin_d.keys():
-            fin_d = fin_d.drop(("lat_bnds"))
-
-        datelist = pd.date_range(f"1990-01-01", periods=12, freq="MS")
-
-        foutclean = fin_d.rename({"month": "time"})
-        foutclean = foutclean.assign_coords({"time": datelist})
-        foutclean.to_netcdf(ofname,
-            unlimited_dims="time",
-        )
-
-
-        fin_p.close()
-        fin_f.close()
-        print(f"{bcolors.OKGREEN}Created delta file for {GCM} {varname}{bcolors.ENDC}")
-    else:
-        print(f"{bcolors.OKCYAN}CC file {varname} {GCM} Already processed{bcolors.ENDC}")
+###########################################################
+###########################################################
+def write_delta(ofname, fin, varname, delta, lat, lon):
+    """Write the monthly delta (12, [plev,] lat, lon) with the variable
+    attributes and vertical coordinate of the model file fin. Months are
+    dated on the first day of each month of 1990."""
+
+    vin = fin.variables[varname]
+    fout = nc.Dataset(ofname, "w", format="NETCDF4")
+    fout.createDimension("time", None)
+    dims = ["time"]
+    if delta.ndim == 4:
+        zname = vin.dimensions[1]
+        fout.createDimension(zname, delta.shape[1])
+        zin = fin.variables[zname]
+        zout = fout.createVariable(zname, zin.dtype, (zname,))
+        zout.setncatts({att: zin.getncattr(att) for att in zin.ncattrs() if att not in ["_FillValue", "bounds"]})
+        zout[:] = zin[:]
+        dims.append(zname)
+    fout.createDimension("lat", len(lat))
+    fout.createDimension("lon", len(lon))
+
+    tout = fout.createVariable("time", "f8", ("time",))
+    tout.units = "days since 1990-01-01 00:00:00"
+    tout.calendar = "standard"
+    tout.standard_name = "time"
+    tout[:] = [(np.datetime64(f"1990-{month:02d}-01") - np.datetime64("1990-01-01")).astype(int) for month in range(1, 13)]
+
+    latout = fout.createVariable("lat", "f8", ("lat",))
+    latout.setncatts({"units": "degrees_north", "standard_name": "latitude"})
+    latout[:] = lat
+    lonout = fout.createVariable("lon", "f8", ("lon",))
+    lonout.setncatts({"units": "degrees_east", "standard_name": "longitude"})
+    lonout[:] = lon
+
+    vout = fout.createVariable(varname, "f4", tuple(dims) + ("lat", "lon"), zlib=True, complevel=5, fill_value=missingval)
+    vout.setncatts({att: vin.getncattr(att) for att in vin.ncattrs()
+                    if att not in ["_FillValue", "missing_value", "cell_methods", "history"]})
+    vout[:] = np.ma.masked_invalid(delta)
+
+    setattr(fout, "comments", f"Monthly climate change signal ssp585 {syear_exp['ssp585']}-{eyear_exp['ssp585']} minus historical {syear_exp['historical']}-{eyear_exp['historical']}")
+    fout.close()
 
 
 
@@ -27,6 +27,7 @@ from glob import glob
 import pandas as pd
 import xarray as xr
 import os
+from mylibs import regrid
 
 ERA5_dir = "/home/dargueso/BDY_DATA/ERA5/ERA5_netcdf"
 CMIP6anom_dir = "/home/dargueso/BDY_DATA/CMIP6/"
@@ -51,10 +52,26 @@ def main():
             fin = xr.open_dataset(
                 f"{CMIP6anom_dir}/{varname}_CC_signal_ssp585_2070-2099_1985-2014.nc"
             )
-            fin.reindex(plev=fin.plev[::-1])
-            fin_pinterp = fin.interp(
-                plev=era5_plev, kwargs={"fill_value": "extrapolate"}
+            # Linear in pressure, extrapolated beyond the CMIP6 levels
+            plev_weights = regrid.linear_matrix(
+                fin.plev.values, era5_plev, outside="extrapolate"
             )
+            var = fin[varname]
+            axis = var.dims.index("plev")
+            fin_pinterp = xr.Dataset(
+                {
+                    varname: (
+                        var.dims,
+                        regrid.apply_axis(plev_weights, var.values, axis),
+                        var.attrs,
+                    )
+                },
+                coords={
+                    dim: era5_plev if dim == "plev" else fin[dim].values
+                    for dim in var.dims
+                },
+            )
+            fin_pinterp["plev"].attrs = fin.plev.attrs
             fin_pinterp.to_netcdf(
                 f"{CMIP6anom_dir}/interp_plevs/{varname}_CC_signal_ssp585_2070-2099_1985-2014_pinterp.nc",
                 unlimited_dims="time",
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+""" pgw_delta.py
+
+Pseudo-global-warming deltas from the CMIP6 monthly climate change signal.
+
+Authors: Daniel Argueso @ UIB
+
+The 12-month anomaly climatology of each variable is read once (into memory
+or into a .npy memmap) instead of re-reading two months of anomalies for
+every ERA5 time step and variable. The anomaly of a time step is linearly
+interpolated between the two closest mid-month dates; the months and
+weights of all the 6-hourly steps of a year are computed at once, and the
+deltas of a whole day (or month) of ERA5 are applied in one broadcast
+operation.
+"""
+
+import datetime as dt
+import os
+
+import netCDF4 as nc
+import numpy as np
+
+
+def calc_midmonth(year):
+    """Mid-month dates from December of the previous year to January of the
+    next year (14 dates)"""
+    midm_date = []
+
+    for month in range(1, 13):
+        minit = dt.datetime(year, month, 0o1, 00)
+        if month == 12:
+            mend = dt.datetime(year + 1, 1, 0o1, 0o1)
+        else:
+            mend = dt.datetime(year, month + 1, 0o1, 0o1)
+        tdiference = (mend - minit).total_seconds() / 2
+        midm_date = midm_date + [minit + dt.timedelta(seconds=tdiference)]
+
+    tdiference = (
+        dt.datetime(year, 1, 0o1, 0o1) - dt.datetime(year - 1, 12, 0o1, 0o1)
+    ).total_seconds() / 2
+    midm_date = [
+        dt.datetime(year - 1, 12, 0o1, 0o1) + dt.timedelta(seconds=tdiference)
+    ] + midm_date
+
+    tdiference = (
+        dt.datetime(year + 1, 2, 0o1, 0o1) - dt.datetime(year + 1, 1, 0o1, 0o1)
+    ).total_seconds() / 2
+    midm_date = midm_date + [
+        dt.datetime(year + 1, 1, 0o1, 0o1) + dt.timedelta(seconds=tdiference)
+    ]
+
+    return midm_date
+
+
+def monthly_weights(dates):
+    """Months (0-11) of the mid-month dates before (i1) and after (i2) each
+    date and the weight of i2: anomaly = a[i1] + (a[i2] - a[i1]) * w"""
+    dates = list(dates)
+    i1 = np.empty(len(dates), np.int64)
+    i2 = np.empty(len(dates), np.int64)
+    w = np.empty(len(dates), np.float32)
+
+    years = {}
+    for n, date in enumerate(dates):
+        if date.year not in years:
+            years[date.year] = np.array(calc_midmonth(date.year), "datetime64[s]")
+        midm = years[date.year]
+        date64 = np.datetime64(date, "s")
+        m = np.searchsorted(midm, date64, side="right") - 1
+        i1[n] = (m - 1) % 12
+        i2[n] = m % 12
+        w[n] = (date64 - midm[m]) / (midm[m + 1] - midm[m])
+
+    return i1, i2, w
+
+
+class PGWDelta:
+    """Monthly climate change signal of a set of variables, held in memory
+    (or memory-mapped from memmap_dir) and interpolated to any date.
+    3-D anomalies are read from {var}_CC_signal_{period}_pinterp.nc with
+    their levels reversed (as the ERA5 levels), 2-D anomalies from
+    {var}_CC_signal_{period}.nc. Missing anomalies are set to zero.
+    """
+
+    def __init__(
+        self,
+        anom_dir,
+        vars3d,
+        vars2d,
+        period="ssp585_2070-2099_1985-2014",
+        memmap_dir=None,
+        freq_hours=6,
+    ):
+        self.freq_hours = freq_hours
+        self.anom = {}
+        for var in vars3d:
+            filename = f"{anom_dir}/{var}_CC_signal_{period}_pinterp.nc"
+            self.anom[var] = self._load(filename, var, True, memmap_dir)
+        for var in vars2d:
+            filename = f"{anom_dir}/{var}_CC_signal_{period}.nc"
+            self.anom[var] = self._load(filename, var, False, memmap_dir)
+        self._year_weights = {}
+
+    @staticmethod
+    def _load(filename, var, flip_levels, memmap_dir):
+        if memmap_dir is not None:
+            npyfile = "%s/%s.npy" % (memmap_dir, os.path.basename(filename)[:-3])
+            if os.path.exists(npyfile) and os.path.getmtime(
+                npyfile
+            ) >= os.path.getmtime(filename):
+                return np.load(npyfile, mmap_mode="r")
+
+        fanom = nc.Dataset(filename)
+        anom = fanom.variables[var][:12]
+        fanom.close()
+        if flip_levels:
+            anom = anom[:, ::-1]
+        anom = np.nan_to_num(np.ma.filled(anom.astype(np.float32), 0.0))
+        anom = np.ascontiguousarray(anom)
+
+        if memmap_dir is not None:
+            os.makedirs(memmap_dir, exist_ok=True)
+            np.save(npyfile, anom)
+            return np.load(npyfile, mmap_mode="r")
+        return anom
+
+    def weights(self, dates):
+        """Months and weights of dates (see monthly_weights). Those of all the
+        freq_hours steps of a year are computed the first time the year is
+        requested"""
+        dates = list(dates)
+        i1 = np.empty(len(dates), np.int64)
+        i2 = np.empty(len(dates), np.int64)
+        w = np.empty(len(dates), np.float32)
+
+        for n, date in enumerate(dates):
+            year = date.year
+            if year not in self._year_weights:
+                nsteps = (
+                    dt.datetime(year + 1, 1, 1) - dt.datetime(year, 1, 1)
+                ).days * (24 // self.freq_hours)
+                self._year_weights[year] = monthly_weights(
+                    dt.datetime(year, 1, 1) + dt.timedelta(hours=self.freq_hours * k)
+                    for k in range(nsteps)
+                )
+            step, rest = divmod(
+                (date - dt.datetime(year, 1, 1)).total_seconds(),
+                self.freq_hours * 3600,
+            )
+            if rest == 0:
+                yi1, yi2, yw = self._year_weights[year]
+                i1[n], i2[n], w[n] = yi1[int(step)], yi2[int(step)], yw[int(step)]
+            else:
+                i1[n : n + 1], i2[n : n + 1], w[n : n + 1] = monthly_weights([date])
+
+        return i1, i2, w
+
+    def delta(self, var, dates):
+        """Anomaly of var at each date (time, ...)"""
+        i1, i2, w = self.weights(dates)
+        anom = self.anom[var]
+        a1 = anom[i1]
+        a2 = anom[i2]
+        w = w.reshape((-1,) + (1,) * (a1.ndim - 1))
+        return a1 + (a2 - a1) * w
+
+    def apply(self, var, values, dates):
+        """values (time, ...) plus the anomaly of var at their dates"""
+        return values + self.delta(var, dates)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+""" wps_intermediate.py
+
+Read and write WPS intermediate files (format version 5) with NumPy.
+
+Authors: Daniel Argueso @ UIB
+
+Each field of an intermediate file is a sequence of five Fortran unformatted
+(big-endian, 4-byte record markers) records: version, header, projection,
+wind rotation flag and the 2-D slab. Here the five records of a field, with
+their markers, are a single NumPy structured dtype, so all the fields of a
+time step are filled in one array and written with a single tofile call.
+It replaces the f2py modules outputInter (writeint) and outputInter_soil
+(writeintsoil), producing the same bytes, so no Fortran compiler is needed.
+
+Only the cylindrical equidistant projection (iproj = 0) is written, which is
+the one used for ERA5. The reader accepts any projection; the projection
+record is decoded for iproj = 0 and returned as raw bytes otherwise.
+"""
+
+import numpy as np
+
+version = 5
+
+_header_dtype = np.dtype(
+    [
+        ("hdate", "S24"),
+        ("xfcst", ">f4"),
+        ("map_source", "S32"),
+        ("field", "S9"),
+        ("units", "S25"),
+        ("desc", "S46"),
+        ("xlvl", ">f4"),
+        ("nx", ">i4"),
+        ("ny", ">i4"),
+        ("iproj", ">i4"),
+    ]
+)
+
+_latlon_dtype = np.dtype(
+    [
+        ("startloc", "S8"),
+        ("startlat", ">f4"),
+        ("startlon", ">f4"),
+        ("deltalat", ">f4"),
+        ("deltalon", ">f4"),
+        ("earth_radius", ">f4"),
+    ]
+)
+
+# Fields written by the ERA5 + CMIP6 anomalies pipeline:
+# (WPS name, units, description) and level of the 2-D fields
+era5_fields3d = [
+    ("RH", "percent", "Relative Humidity"),
+    ("TT", "K", "Temperature"),
+    ("UU", "m s-1", "U"),
+    ("VV", "m s-1", "V"),
+    ("GHT", "m", "Height"),
+]
+
+era5_fields2d = [
+    ("UU", "m s-1", "U"),
+    ("VV", "m s-1", "V"),
+    ("RH", "percent", "Relative Humidity"),
+    ("PSFC", "Pa", "Surface Pressure"),
+    ("PMSL", "Pa", "Sea-level pressure"),
+    ("TT", "K", "Temperature"),
+    ("SKINTEMP", "K", "Sea-Surface Temperature"),
+]
+
+era5_soil_fields = [
+    ("LANDSEA", "0/1 Flag", "Land/Sea flag"),
+    ("ST000007", "K", "T of 0-7 cm ground layer"),
+    ("ST007028", "K", "T of 7-28 cm ground layer"),
+    ("ST028100", "K", "T of 28-100 cm ground layer"),
+    ("ST100289", "K", "T of 100-289 cm ground layer"),
+    ("SM000007", "fraction", "Soil moisture of 0-7 cm ground layer"),
+    ("SM007028", "fraction", "Soil moisture of 7-28 cm ground layer"),
+    ("SM028100", "fraction", "Soil moisture of 28-100 cm ground layer"),
+    ("SM100289", "fraction", "Soil moisture of 100-289 cm ground layer"),
+]
+
+surface_level = 200100.0
+sealevel_level = 201300.0
+
+
+def field_dtype(nx, ny):
+    """Structured dtype of the five records (with markers) of a field on a
+    regular lat-lon grid of nx x ny points"""
+    marker = ">i4"
+    return np.dtype(
+        [
+            ("m0", marker),
+            ("version", ">i4"),
+            ("m1", marker),
+            ("m2", marker),
+            ("header", _header_dtype),
+            ("m3", marker),
+            ("m4", marker),
+            ("proj", _latlon_dtype),
+            ("m5", marker),
+            ("m6", marker),
+            ("is_wind_grid_rel", ">i4"),
+            ("m7", marker),
+            ("m8", marker),
+            ("slab", ">f4", (ny, nx)),
+            ("m9", marker),
+        ]
+    )
+
+
+def _fortran_string(value, length):
+    """Blank-padded string, as Fortran character variables"""
+    return value.encode("ascii")[:length].ljust(length)
+
+
+def write_intermediate(
+    filename,
+    fields,
+    hdate,
+    startlat,
+    startlon,
+    deltalat,
+    deltalon,
+    map_source="ERA5",
+    earth_radius=6367.470215,
+    startloc="SWCORNER",
+    is_wind_grid_rel=False,
+    xfcst=0.0,
+):
+    """Write a WPS intermediate file
+    fields: list of (name, units, desc, xlvl, slab), slab being a (ny, nx)
+    array with the first row at startlat
+    hdate: valid date, written as given (24 characters)
+    """
+    ny, nx = np.shape(fields[0][4])
+    dtype = field_dtype(nx, ny)
+    records = np.zeros(len(fields), dtype)
+
+    for name, (start, end) in [
+        ("version", ("m0", "m1")),
+        ("header", ("m2", "m3")),
+        ("proj", ("m4", "m5")),
+        ("is_wind_grid_rel", ("m6", "m7")),
+        ("slab", ("m8", "m9")),
+    ]:
+        records[start] = records[end] = dtype.fields[name][0].itemsize
+
+    records["version"] = version
+    header = records["header"]
+    header["hdate"] = _fortran_string(hdate, 24)
+    header["xfcst"] = xfcst
+    header["map_source"] = _fortran_string(map_source, 32)
+    header["nx"] = nx
+    header["ny"] = ny
+    header["iproj"] = 0
+    proj = records["proj"]
+    proj["startloc"] = _fortran_string(startloc, 8)
+    proj["startlat"] = startlat
+    proj["startlon"] = startlon
+    proj["deltalat"] = deltalat
+    proj["deltalon"] = deltalon
+    proj["earth_radius"] = earth_radius
+    records["is_wind_grid_rel"] = int(is_wind_grid_rel)
+
+    for nf, (field, units, desc, xlvl, slab) in enumerate(fields):
+        header[nf]["field"] = _fortran_string(field, 9)
+        header[nf]["units"] = _fortran_string(units, 25)
+        header[nf]["desc"] = _fortran_string(desc, 46)
+        header[nf]["xlvl"] = xlvl
+        records["slab"][nf] = slab
+
+    with open(filename, "wb") as fout:
+        records.tofile(fout)
+
+
+def read_intermediate(filename):
+    """Read a WPS intermediate file (format version 5)
+    Returns a list of dicts with the header entries (strings stripped),
+    the projection entries and the slab (ny, nx)
+    """
+    buffer = memoryview(np.fromfile(filename, np.uint8))
+    pos = 0
+
+    def record():
+        nonlocal pos
+        length = int(np.frombuffer(buffer, ">i4", 1, pos)[0])
+        data = buffer[pos + 4 : pos + 4 + length]
+        if int(np.frombuffer(buffer, ">i4", 1, pos + 4 + length)[0]) != length:
+            raise IOError("Corrupt Fortran record in %s at byte %d" % (filename, pos))
+        pos += length + 8
+        return data
+
+    fields = []
+    while pos < len(buffer):
+        fversion = int(np.frombuffer(record(), ">i4")[0])
+        if fversion != version:
+            raise IOError("%s: intermediate format %d not supported" % (filename, fversion))
+
+        header = np.frombuffer(record(), _header_dtype)[0]
+        field = {
+            name: header[name].decode("ascii").rstrip()
+            if _header_dtype[name].kind == "S"
+            else header[name].item()
+            for name in _header_dtype.names
+        }
+
+        proj = record()
+        if field["iproj"] == 0:
+            proj = np.frombuffer(proj, _latlon_dtype)[0]
+            field["startloc"] = proj["startloc"].decode("ascii").rstrip()
+            for name in _latlon_dtype.names[1:]:
+                field[name] = proj[name].item()
+        else:
+            field["proj"] = bytes(proj)
+
+        field["is_wind_grid_rel"] = bool(np.frombuffer(record(), ">i4")[0])
+        field["slab"] = np.frombuffer(record(), ">f4").reshape(
+            field["ny"], field["nx"]
+        ).astype(np.float32)
+        fields.append(field)
+
+    return fields
+
+
+###########################################################
+###########################################################
+
+
+def writeint(
+    plvs, fields3d, fields2d, hdate, nlat, nlon, startlat, startlon, deltalon, deltalat
+):
+    """Write the ERA5:<hdate[:13]> file of the PGW pipeline (replaces
+    outputInter.writeint, same arguments)
+    fields3d: (5, nlev, nlat, nlon) in the order of era5_fields3d
+    fields2d: (7, nlat, nlon) in the order of era5_fields2d
+    """
+    fields = [
+        (name, units, desc, plvs[nl], fields3d[nf, nl])
+        for nf, (name, units, desc) in enumerate(era5_fields3d)
+        for nl in range(len(plvs))
+    ] + [
+        (
+            name,
+            units,
+            desc,
+            sealevel_level if name == "PMSL" else surface_level,
+            fields2d[nf],
+        )
+        for nf, (name, units, desc) in enumerate(era5_fields2d)
+    ]
+    filename = "./ERA5:%s" % (hdate[:13])
+    print(filename)
+    write_intermediate(
+        filename, fields, hdate, startlat, startlon, deltalat, deltalon
+    )
+
+
+def writeintsoil(
+    fieldssoil, hdate, nlat, nlon, startlat, startlon, deltalon, deltalat
+):
+    """Write the SOILERA5:<hdate[:13]> file of the soil climatology
+    (replaces outputInter_soil.writeintsoil, same arguments)
+    fieldssoil: (9, nlat, nlon) in the order of era5_soil_fields
+    """
+    fields = [
+        (name, units, desc, surface_level, fieldssoil[nf])
+        for nf, (name, units, desc) in enumerate(era5_soil_fields)
+    ]
+    filename = "./SOILERA5:%s" % (hdate[:13])
+    print(filename)
+    write_intermediate(
+        filename,
+        fields,
+        hdate,
+        startlat,
+        startlon,
+        deltalat,
+        deltalon,
+        earth_radius=6356.766,
+    )
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 """ write_intermediate_ERA5_CMIP5anom.py
-run write_intermediate_ERA5_CMIP5anom.py -s 2007 -e 2007
+run write_intermediate_ERA5_CMIP6anom.py -s 2007-01-01 -e 2007-12-31 -j 8
+run write_intermediate_ERA5_CMIP6anom.py -s 2010 -e 2020 -m soilclim
 
 Authors: Daniel Argueso- Alejandro Di Luca @ CCRC, UNSW. Sydney (Australia)
 email: a.diluca@unsw.edu.au
@@ -52,6 +53,16 @@ Modified July 7 2021
  - Adapted to CMIP6 and ERA5 (Daniel Argüeso)
  - Part of the EPICC project
 
+Modified October 17 2026
+ - Days are independent (each writes its own ERA5:YYYY-MM-DD_HH files) and
+   are processed in parallel for any date range (Daniel). -e YYYY is still
+   an exclusive end (-s 2010 -e 2020 processes 2010-2019)
+ - Soil climatology files (SOILERA5) are written by the same code path
+   (-m soilclim), which replaces the loop of
+   write_intermediate_ERA5_CMIP6anom_SOILCLIM.py. Existing files are only
+   overwritten with -o (the _SOILCLIM wrapper always passes it)
+ - Figures are an optional pass over the written files (-f)
+
 
 
 """
@@ -59,121 +70,24 @@ Modified July 7 2021
 import netCDF4 as nc
 import numpy as np
 from constants import const
-import glob as glob
 from optparse import OptionParser
-import calendar
-import outputInter as f90
+import wps_intermediate as wpsi
+from pgw_delta import PGWDelta
 import datetime as dt
-import sys
+import matplotlib
+
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-import wrf_variables as fs
-import copy as cp
-import pdb
 import os
+from joblib import Parallel, delayed
 
 
-def checkfile(file_out, overwrite):
-    """Checks if the output file exist and whether it should be written or not"""
-
-    # ***********************************************************
-    # BEFORE READING AND PROCESSING THE VARIABLE OF INTEREST CHECK
-    # IF THE FILE ALREADY EXISTS
-    # If it does then go to the next one...
-    fileexist = os.path.exists(file_out)
-    filewrite = False
-    if overwrite == "False":
-        overwrite = False
-
-    print("  --> OUTPUT FILE:")
-    print("         ", file_out)
-    if fileexist == True:
-        if overwrite == False:
-            print("          +++ FILE ALREADY EXISTS +++")
-            filewrite = False
-        else:
-            print("           +++ FILE EXISTS AND WILL BE OVERWRITTEN +++")
-            filewrite = True
-    else:
-        print("         +++ FILE DOES NOT EXISTS YET +++")
-        filewrite = True
-    return filewrite
-
-
-def calc_midmonth(year):
-    midm_date = []
-
-    for month in range(1, 13):
-        minit = dt.datetime(year, month, 0o1, 00)
-        if month == 12:
-            mend = dt.datetime(year + 1, 1, 0o1, 0o1)
-        else:
-            mend = dt.datetime(year, month + 1, 0o1, 0o1)
-        tdiference = (mend - minit).total_seconds() / 2
-        midm_date = midm_date + [minit + dt.timedelta(seconds=tdiference)]
-
-    tdiference = (
-        dt.datetime(year, 1, 0o1, 0o1) - dt.datetime(year - 1, 12, 0o1, 0o1)
-    ).total_seconds() / 2
-    midm_date = [
-        dt.datetime(year - 1, 12, 0o1, 0o1) + dt.timedelta(seconds=tdiference)
-    ] + midm_date
-
-    tdiference = (
-        dt.datetime(year + 1, 2, 0o1, 0o1) - dt.datetime(year + 1, 1, 0o1, 0o1)
-    ).total_seconds() / 2
-    midm_date = midm_date + [
-        dt.datetime(year + 1, 1, 0o1, 0o1) + dt.timedelta(seconds=tdiference)
-    ]
-
-    return midm_date
-
-
-def calc_relhum(dewpt, t):
-    """Function to calculate relative humidity
-    from dew point temperature and temperature
-    """
-
-    relhum = 100.0 * (
-        np.exp((const.es_Abolton * dewpt) / (const.es_Bbolton + dewpt))
-        / np.exp((const.es_Abolton * t) / (const.es_Bbolton + t))
-    )
-    return relhum
-
-
-### Options
-parser = OptionParser()
-parser.add_option(
-    "-s",
-    "--syear",
-    type="int",
-    dest="syear",
-    help="first year to process",
-    metavar="input argument",
-)
-parser.add_option(
-    "-e",
-    "--eyear",
-    type="int",
-    dest="eyear",
-    help="last year to process",
-    metavar="input argument",
-)
-
-(opts, args) = parser.parse_args()
-###
-
-overwrite_file = False
-create_figs = False
-syear = opts.syear
-eyear = opts.eyear
-nyears = eyear - syear + 1
-smonth = 1
-emonth = 1 
-
 vars3d = ["hur", "ta", "ua", "va", "zg"]
 vars3d_codes = {"hur": "r", "ta": "t", "ua": "u", "va": "v", "zg": "z"}
 # vars3d_codes={'hur':'var157','ta':'var130','ua':'var131','va':'var132','zg':'var129'}
 vars2d = ["hurs", "tas", "uas", "vas", "ps", "psl", "ts"]
+# Order of the 2-D fields in the intermediate files (wps_intermediate.era5_fields2d)
+vars2d_out = ["uas", "vas", "hurs", "ps", "psl", "tas", "ts"]
 vars2d_codes = {
     "dew": "2d",
     "tas": "2t",
@@ -206,6 +120,8 @@ nfields2d = len(vars2d)
 CMIP6anom_dir = "/home/dargueso/BDY_DATA/CMIP6"
 ERA5_dir = "/home/dargueso/BDY_DATA/ERA5/ERA5_netcdf"
 figs_path = "/home/dargueso/BDY_DATA/CMIP6/Figs"
+# Anomalies are memory-mapped from here, shared by all the worker processes
+memmap_dir = "/home/dargueso/BDY_DATA/CMIP6/npy"
 
 plvs = [
     100000.0,
@@ -251,315 +167,371 @@ nlat = 601
 nlon = 1200
 
 
-file_ref = nc.Dataset("%s/era5_daily_sfc_20140101.nc" % (ERA5_dir), "r")
-lat = file_ref.variables["lat"][:]
-lon = file_ref.variables["lon"][:]
+varsoil = [
+    "LANDSEA",
+    "ST000007",
+    "ST007028",
+    "ST028100",
+    "ST100289",
+    "SM000007",
+    "SM007028",
+    "SM028100",
+    "SM100289",
+]
+varsoil_codes = {
+    "ST000007": "stl1",
+    "ST007028": "stl2",
+    "ST028100": "stl3",
+    "ST100289": "stl4",
+    "SM000007": "swvl1",
+    "SM007028": "swvl2",
+    "SM028100": "swvl3",
+    "SM100289": "swvl4",
+    "LANDSEA": "lsm",
+}
+soil_file = f"{ERA5_dir}/sfcclim.nc"
+soil_date = "12-22"  # Month and day of the soil climatology files (MM-DD)
+
+deltalon = 0.30
+deltalat = -0.30
+
+# Variable of each field of the intermediate files, to plot the anomalies
+wps_vars3d = dict(zip([name for name, _, _ in wpsi.era5_fields3d], vars3d))
+wps_vars2d = dict(zip([name for name, _, _ in wpsi.era5_fields2d], vars2d_out))
+
+
+def checkfile(file_out, overwrite):
+    """Checks if the output file exist and whether it should be written or not"""
+
+    # ***********************************************************
+    # BEFORE READING AND PROCESSING THE VARIABLE OF INTEREST CHECK
+    # IF THE FILE ALREADY EXISTS
+    # If it does then go to the next one...
+    fileexist = os.path.exists(file_out)
+    filewrite = False
+    if overwrite == "False":
+        overwrite = False
+
+    print("  --> OUTPUT FILE:")
+    print("         ", file_out)
+    if fileexist == True:
+        if overwrite == False:
+            print("          +++ FILE ALREADY EXISTS +++")
+            filewrite = False
+        else:
+            print("           +++ FILE EXISTS AND WILL BE OVERWRITTEN +++")
+            filewrite = True
+    else:
+        print("         +++ FILE DOES NOT EXISTS YET +++")
+        filewrite = True
+    return filewrite
+
+
+def calc_relhum(dewpt, t):
+    """Function to calculate relative humidity
+    from dew point temperature and temperature
+    """
+
+    relhum = 100.0 * (
+        np.exp((const.es_Abolton * dewpt) / (const.es_Bbolton + dewpt))
+        / np.exp((const.es_Abolton * t) / (const.es_Bbolton + t))
+    )
+    return relhum
+
+
+def parse_date(text, end=False):
+    """Date from YYYY, YYYY-MM or YYYY-MM-DD. With end, the last day of
+    the year or month"""
+    parts = [int(p) for p in text.split("-")]
+    if len(parts) == 3:
+        return dt.datetime(*parts)
+    if len(parts) == 2:
+        date = dt.datetime(parts[0], parts[1], 1)
+        if end:
+            date = (date + dt.timedelta(days=32)).replace(day=1) - dt.timedelta(days=1)
+        return date
+    return dt.datetime(parts[0], 12, 31) if end else dt.datetime(parts[0], 1, 1)
 
-olon, olat = np.meshgrid(lon, lat)
 
+###########################################################
+###########################################################
 
-year = syear
-month = smonth
-day = 1
 
-while year < eyear or (year == eyear and month < emonth):
-    midmonth = calc_midmonth(year)
+def write_era5_day(date, pgw, overwrite=False):
+    """Write the ERA5 + CMIP6 anomalies intermediate files of the 6-hourly
+    steps of a day. All the steps are processed at once for each variable.
+    Returns the files written"""
 
-    print("processing year %s month %02d day %02d" % (year, month, day))
+    print("processing year %s month %02d day %02d" % (date.year, date.month, date.day))
 
     ferapl = nc.Dataset(
-        "%s/era5_daily_pl_%s%02d%02d.nc" % (ERA5_dir, year, month, day), "r"
+        "%s/era5_daily_pl_%s.nc" % (ERA5_dir, date.strftime("%Y%m%d")), "r"
     )
     ferasfc = nc.Dataset(
-        "%s/era5_daily_sfc_%s%02d%02d.nc" % (ERA5_dir, year, month, day), "r"
+        "%s/era5_daily_sfc_%s.nc" % (ERA5_dir, date.strftime("%Y%m%d")), "r"
     )
 
-    date_init = dt.datetime(year, month, day, 00)
-    date_end = dt.datetime(year, month, day, 18)
-
     time_filepl = ferapl.variables["time"]
-    time_filesfc = ferasfc.variables["time"]
-
-    date1 = nc.date2index(date_init, time_filepl, calendar="standard", select="exact")
-    date2 = nc.date2index(date_end, time_filepl, calendar="standard", select="exact")
-    ndays = (date_end - date_init).total_seconds() / 86400.0 + 1
-    nsteps = int((date_end - date_init).total_seconds() / 86400.0 * 4.0 + 1)
-
-    vout = {}
-    print("Looping over timesteps in original ERA5 file")
+    date1 = nc.date2index(date, time_filepl, calendar="standard", select="exact")
+    date2 = nc.date2index(
+        date + dt.timedelta(hours=18), time_filepl, calendar="standard", select="exact"
+    )
 
+    # Time steps of the day whose intermediate file has to be written
+    tsel = []
+    dates = []
     for nt in range(date1, date2 + 1):
         proc_date = nc.num2date(
-            time_filepl[nt], units=time_filepl.units, calendar="standard"
+            time_filepl[nt],
+            units=time_filepl.units,
+            calendar="standard",
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
         )
-        print("processing 3Dvar time: ", proc_date)
-        Y = str(proc_date.year)
-        M = str(proc_date.month)
-        D = str(proc_date.day)
-        H = str(proc_date.hour)
-        filedate = proc_date.strftime("%Y-%m-%d_%H-%M-%S")
-
-        # CHECK IF THE FILE ALREADY EXISTS
-        file_out = (
-            "ERA5:"
-            + filedate.split("_")[0]
-            + "_"
-            + filedate.split("_")[1].split("-")[0]
+        if checkfile("ERA5:" + proc_date.strftime("%Y-%m-%d_%H"), overwrite):
+            tsel.append(nt)
+            dates.append(proc_date)
+
+    if len(tsel) == 0:
+        ferapl.close()
+        ferasfc.close()
+        return []
+
+    vout = {}
+    for var in vars3d:
+        print("Processing variable %s" % (var))
+        var_era = ferapl.variables["%s" % (vars3d_codes[var])][tsel][:, ::-1, :, :]
+
+        # Convert geopotential height from m2/s2 to m
+        if var == "zg":
+            var_era = var_era / 9.81
+
+        # Define the pseudo global warming
+        temp = pgw.apply(var, var_era, dates)
+        if var == "hur":
+            temp[temp < 0] = 0  # replace values smaller than zero by zero
+            temp[temp > 100] = 100
+        vout[var] = temp
+
+    for var in vars2d:
+        print("Processing variable %s" % (var))
+        if var == "hurs":
+            # Surface relative humidity doesn't exist in original ERA-INt, must be calculated from T2 and DEWPT
+            dew_era = ferasfc.variables[vars2d_codes["dew"]][tsel, :, :] - const.tkelvin
+            tas_era = ferasfc.variables[vars2d_codes["tas"]][tsel, :, :] - const.tkelvin
+
+            var_era = calc_relhum(dew_era, tas_era)
+
+        else:
+            var_era = ferasfc.variables["%s" % (vars2d_codes[var])][tsel, :, :]
+
+        # Define the pseudo global warming
+        vout[var] = pgw.apply(var, var_era, dates)
+
+    lat = ferasfc.variables["lat"][:]
+    lon = ferasfc.variables["lon"][:]
+    ferapl.close()
+    ferasfc.close()
+
+    ####################  Writing to WRF intermediate format  #############################
+    files = []
+    for n, proc_date in enumerate(dates):
+        fields3d = np.stack([vout[var][n] for var in vars3d]).astype("float32")
+        fields2d = np.stack([vout[var][n] for var in vars2d_out]).astype("float32")
+
+        wpsi.writeint(
+            plvs,
+            fields3d,
+            fields2d,
+            proc_date.strftime("%Y-%m-%d_%H-%M-%S"),
+            nlat,
+            nlon,
+            lat[0],
+            lon[0],
+            deltalon,
+            deltalat,
         )
-        filewrite = checkfile(file_out, overwrite_file)
-        if filewrite == True:
-            tdelta = np.asarray(
-                [
-                    (midmonth[i] - proc_date).total_seconds()
-                    for i in range(len(midmonth))
-                ]
-            )
-            tdelta_min = np.argmin(np.abs(tdelta))
-            if tdelta[tdelta_min] < 0:
-                i1 = (tdelta_min - 1) % 12
-                i2 = (tdelta_min) % 12
-                tdelta_before = np.abs(tdelta[tdelta_min])
-                tdelta_mid_month = (
-                    midmonth[tdelta_min + 1] - midmonth[tdelta_min]
-                ).total_seconds()
-            else:
-                i1 = (tdelta_min - 2) % 12
-                i2 = (tdelta_min - 1) % 12
-                tdelta_before = np.abs(tdelta[tdelta_min - 1])
-                tdelta_mid_month = (
-                    midmonth[tdelta_min] - midmonth[tdelta_min - 1]
-                ).total_seconds()
-
-            for var in vars3d:
-                print("Processing variable %s" % (var))
-
-                fanom = nc.Dataset(
-                    "%s/%s_CC_signal_ssp585_2070-2099_1985-2014_pinterp.nc"
-                    % (CMIP6anom_dir, var)
-                )
-                var_era = ferapl.variables["%s" % (vars3d_codes[var])][nt, ::-1, :, :]
-                # anom_units=getattr(fanom.variables["%s" %(var)],'units')
-                ilon, ilat = np.meshgrid(
-                    fanom.variables["lon"][:], fanom.variables["lat"][:]
-                )
-
-                # Convert geopotential height from m2/s2 to m
-                if var == "zg":
-                    var_era = var_era / 9.81
-                    var_units_era5["%s" % (vars3d_codes[var])] = "m"
-
-                if np.argmin(np.abs(tdelta)) == 0:
-                    var_anom = fanom.variables["%s" % (var)][i1, ::-1, :, :]
-
-                else:
-                    var_anom_1 = fanom.variables["%s" % (var)][i1, ::-1, :, :]
-                    var_anom_2 = fanom.variables["%s" % (var)][i2, ::-1, :, :]
-
-                    var_anom = (
-                        var_anom_1
-                        + (var_anom_2 - var_anom_1) * (tdelta_before) / tdelta_mid_month
-                    )
-
-                # Convert relative humidity to specific humidity
-                # if var == "hus":
-                #     # Read temperature and pressure
-                #     varT = ferapl.variables["%s" % (vars3d_codes["ta"])][
-                #         nt, ::-1, :, :
-                #     ]
-                #     varP = np.repeat(
-                #         np.repeat(plvs, varT.shape[1]), varT.shape[2]
-                #     )
-                #     varP = varP.reshape(
-                #         varT.shape[0], varT.shape[1], varT.shape[2]
-                #     )  # varP is in Pa
-
-                #     es = 100.0 * fs.compute_es(
-                #         varT
-                #     )  # the result of compute is in hPa
-                #     es_mod = cp.deepcopy(es)
-                #     es_mod[
-                #         30:, :, :
-                #     ] = 0  # saturation pressure equal zero in the stratosphere (levels over 20 hPa)
-                #     ws = es * const.Rd / (const.Rv * (varP - es_mod))
-                #     w = ws * var_era / 100.0
-                #     var_era = w / (w + 1)
-
-                # # Define the pseudo global warming
-                # temp = var_era + np.nan_to_num(var_anom)
-                # if var == "hus":
-                #     temp[
-                #         temp < 0
-                #     ] = 0  # replace values smaller than zero by zero
-                # vout[var] = temp
-                # fanom.close()
-                # Define the pseudo global warming
-                temp = var_era + np.nan_to_num(var_anom)
-                if var == "hur":
-                    temp[temp < 0] = 0  # replace values smaller than zero by zero
-                    temp[temp > 100] = 100
-                vout[var] = temp
-                fanom.close()
-
-                # -----------------------------------------------------------------------------------------------
-                # MAKE PLOT
-                if create_figs == True:
-                    nlev = 10
-                    file_name = {0: "era5", 1: "anom", 2: "pgw"}
-                    for ii in range(3):
-                        if ii == 0:
-                            aa = var_era[nlev, :]
-                            units = var_units_era5["%s" % (vars3d_codes[var])]
-                        if ii == 1:
-                            aa = var_anom[nlev, :]
-                            units = var_units_era5["%s" % (vars3d_codes[var])]
-                        if ii == 2:
-                            aa = vout[var][nlev, :]
-                        figname = figs_path + "%s_lev%s_%s_%s-%s-%s-%s.png" % (
-                            var,
-                            str(nlev),
-                            file_name[ii],
-                            Y,
-                            M,
-                            D,
-                            H,
-                        )
-                        plt.contourf(aa)
-                        plt.colorbar()
-                        plt.title(var + " [" + units + "]")
-                        plt.savefig(figname)
-                        plt.close()
-
-                # -----------------------------------------------------------------------------------------------
-
-            for var in vars2d:
-                print("Processing variable %s" % (var))
-                if var == "hurs":
-                    # Surface relative humidity doesn't exist in original ERA-INt, must be calculated from T2 and DEWPT
-                    dew_era = (
-                        ferasfc.variables[vars2d_codes["dew"]][nt, :, :] - const.tkelvin
-                    )
-                    tas_era = (
-                        ferasfc.variables[vars2d_codes["tas"]][nt, :, :] - const.tkelvin
-                    )
-
-                    var_era = calc_relhum(dew_era, tas_era)
-
-                else:
-                    var_era = ferasfc.variables["%s" % (vars2d_codes[var])][nt, :, :]
-
-                fanom = nc.Dataset(
-                    "%s/%s_CC_signal_ssp585_2070-2099_1985-2014.nc"
-                    % (CMIP6anom_dir, var)
-                )
-                # if hasattr(fanom.variables["%s" %(var)],'units'):
-                #     anom_units=getattr(fanom.variables["%s" %(var)],'units')
-                # else:
-                #     if var == 'hurs':
-                #       anom_units=''
-                #     else:
-                #       import pdb; pdb.set_trace()
-                ilon, ilat = np.meshgrid(
-                    fanom.variables["lon"][:], fanom.variables["lat"][:]
-                )
-
-                if np.min(np.abs(tdelta)) == 0:
-                    var_anom = fanom.variables["%s" % (var)][i1, :, :]
-                else:
-                    var_anom_1 = fanom.variables["%s" % (var)][i1, :, :]
-                    var_anom_2 = fanom.variables["%s" % (var)][i2, :, :]
-
-                    var_anom = (
-                        var_anom_1
-                        + (var_anom_2 - var_anom_1) * (tdelta_before) / tdelta_mid_month
-                    )
-
-                # var_anom = interpolate_grid(ilat,ilon,var_anom_c,olat,olon,method='nearest')
-
-                # Define the pseudo global warming
-                vout[var] = var_era + np.nan_to_num(var_anom)
-
-                # if var=='ts':
-                # import pdb; pdb.set_trace()
-                # vout[var][var_era.mask==True]=
-                # vout[var][var_era==-9.e+33]=-9.e+33
-
-                # -----------------------------------------------------------------------------------------------
-                # MAKE PLOT
-                if create_figs == True:
-                    file_name = {0: "era5", 1: "anom", 2: "pgw"}
-                    for ii in range(3):
-                        if ii == 0:
-                            aa = var_era[:]
-                            if var == "hurs":
-                                units = "%"
-                            else:
-                                units = var_units_era5["%s" % (vars2d_codes[var])]
-                        if ii == 1:
-                            aa = var_anom[:]
-                            units = anom_units
-                        if ii == 2:
-                            aa = vout[var][:]
-                        figname = figs_path + "%s_%s_%s-%s-%s-%s.png" % (
-                            var,
-                            file_name[ii],
-                            Y,
-                            M,
-                            D,
-                            H,
-                        )
-                        plt.contourf(aa)
-                        plt.colorbar()
-                        plt.title(var + " [" + units + "]")
-                        plt.savefig(figname)
-                        plt.close()
-                        # -----------------------------------------------------------------------------------------------
-
-                fanom.close()
-
-            # ###################################################################################################
-            ####################  Writing to WRF intermediate format  #############################
-            filedate = proc_date.strftime("%Y-%m-%d_%H-%M-%S")
-
-            fields3d = np.ndarray(
-                shape=(nfields3d, len(plvs), nlat, nlon), dtype="float32"
-            )  # ,order='Fortran')
-            fields2d = np.ndarray(
-                shape=(nfields2d, nlat, nlon), dtype="float32"
-            )  # ,order='Fortran')
-
-            startlat = lat[0]
-            startlon = lon[0]
-            deltalon = 0.30
-            deltalat = -0.30
-
-            fields3d[0, :, :, :] = np.float32(vout["hur"])
-            fields3d[1, :, :, :] = np.float32(vout["ta"])
-            fields3d[2, :, :, :] = np.float32(vout["ua"])
-            fields3d[3, :, :, :] = np.float32(vout["va"])
-            fields3d[4, :, :, :] = np.float32(vout["zg"])
-
-            fields2d[0, :, :] = np.float32(vout["uas"])
-            fields2d[1, :, :] = np.float32(vout["vas"])
-            fields2d[2, :, :] = np.float32(vout["hurs"])
-            fields2d[3, :, :] = np.float32(vout["ps"])
-            fields2d[4, :, :] = np.float32(vout["psl"])
-            fields2d[5, :, :] = np.float32(vout["tas"])
-            fields2d[6, :, :] = np.float32(vout["ts"])
-
-            f90.writeint(
-                plvs,
-                fields3d,
-                fields2d,
-                filedate,
-                nlat,
-                nlon,
-                startlat,
-                startlon,
-                deltalon,
-                deltalat,
+        files.append("ERA5:" + proc_date.strftime("%Y-%m-%d_%H"))
+
+    return files
+
+
+def write_soilclim(date, overwrite=False):
+    """Write the SOILERA5 intermediate file of the soil climatology
+    (soil_file) valid at date. Returns the files written"""
+
+    file_out = "SOILERA5:" + date.strftime("%Y-%m-%d_%H")
+    if not checkfile(file_out, overwrite):
+        return []
+
+    ferasfc = nc.Dataset(soil_file, "r")
+    vout = {}
+    for var in varsoil:
+        if var == "LANDSEA":
+            sst = ferasfc.variables["sst"][:, :]
+            vout[var] = np.int32(np.ma.getmask(sst))
+        else:
+            vout[var] = ferasfc.variables["%s" % (varsoil_codes[var])][:, :]
+    lat = ferasfc.variables["lat"][:]
+    lon = ferasfc.variables["lon"][:]
+    ferasfc.close()
+
+    fieldssoil = np.stack([vout[var] for var in varsoil]).astype("float32")
+
+    wpsi.writeintsoil(
+        fieldssoil,
+        date.strftime("%Y-%m-%d_%H-%M-%S"),
+        nlat,
+        nlon,
+        lat[0],
+        lon[0],
+        deltalon,
+        deltalat,
+    )
+    return [file_out]
+
+
+###########################################################
+###########################################################
+
+
+def plot_intermediate(filename, pgw=None, nlev=10):
+    """Maps of the fields of an intermediate file (surface fields and level
+    nlev of the 3-D fields). With pgw, also the anomaly and the ERA5 field
+    (intermediate field minus anomaly)"""
+    fields = wpsi.read_intermediate(filename)
+    proc_date = dt.datetime.strptime(fields[0]["hdate"], "%Y-%m-%d_%H-%M-%S")
+    prefix = filename.split(":")[0]
+
+    for field in fields:
+        is2d = field["xlvl"] in (wpsi.surface_level, wpsi.sealevel_level)
+        if not is2d and field["xlvl"] != plvs[nlev]:
+            continue
+        var = (wps_vars2d if is2d else wps_vars3d).get(field["field"])
+        panels = {"pgw": field["slab"]}
+        if pgw is not None and var in pgw.anom:
+            var_anom = pgw.delta(var, [proc_date])[0]
+            if not is2d:
+                var_anom = var_anom[nlev]
+            panels = {"era5": field["slab"] - var_anom, "anom": var_anom, **panels}
+
+        levname = "" if is2d else "_lev%s" % (nlev)
+        for name, aa in panels.items():
+            figname = "%s/%s_%s%s_%s_%s.png" % (
+                figs_path,
+                prefix,
+                field["field"],
+                levname,
+                name,
+                proc_date.strftime("%Y-%m-%d-%H"),
             )
-            # ###################################################################################################
-    end_date = dt.datetime(year, month, day) + dt.timedelta(days=1)
-    year = end_date.year
-    month = end_date.month
-    day = end_date.day
+            plt.contourf(aa)
+            plt.colorbar()
+            plt.title(field["field"] + " [" + field["units"] + "]")
+            plt.savefig(figname)
+            plt.close()
+
+
+###########################################################
+###########################################################
+
+
+def main(argv=None):
+    ### Options
+    parser = OptionParser()
+    parser.add_option(
+        "-s",
+        "--sdate",
+        dest="sdate",
+        help="first day to process (YYYY, YYYY-MM or YYYY-MM-DD)",
+        metavar="input argument",
+    )
+    parser.add_option(
+        "-e",
+        "--edate",
+        dest="edate",
+        help="last day to process (YYYY-MM or YYYY-MM-DD). A year alone is an exclusive end, as in previous versions: -e 2020 stops on 31 December 2019 (soilclim: last year written)",
+        metavar="input argument",
+    )
+    parser.add_option(
+        "-m",
+        "--mode",
+        dest="mode",
+        default="standard",
+        help="standard (ERA5 + CMIP6 anomalies) or soilclim (soil climatology on MM-DD of each year)",
+        metavar="input argument",
+    )
+    parser.add_option(
+        "-j",
+        "--njobs",
+        type="int",
+        dest="njobs",
+        default=1,
+        help="number of days processed in parallel",
+        metavar="input argument",
+    )
+    parser.add_option(
+        "-f",
+        "--figs",
+        action="store_true",
+        dest="figs",
+        default=False,
+        help="plot the written files",
+    )
+    parser.add_option(
+        "-o",
+        "--overwrite",
+        action="store_true",
+        dest="overwrite",
+        default=False,
+        help="overwrite existing files",
+    )
+
+    (opts, args) = parser.parse_args(argv)
+    ###
+
+    sdate = parse_date(opts.sdate)
+    edate = parse_date(opts.edate, end=True)
+    if opts.mode != "soilclim" and "-" not in opts.edate:
+        # Bare years are an exclusive end (the year loop stopped before
+        # 1 January of eyear); soil files were written for eyear
+        edate = dt.datetime(int(opts.edate), 1, 1) - dt.timedelta(days=1)
+
+    pgw = None
+    if opts.mode == "soilclim":
+        month, day = [int(p) for p in soil_date.split("-")]
+        dates = [
+            dt.datetime(year, month, day)
+            for year in range(sdate.year, edate.year + 1)
+            if sdate <= dt.datetime(year, month, day) <= edate
+        ]
+        task = write_soilclim
+        tasks = [delayed(task)(date, opts.overwrite) for date in dates]
+    else:
+        # Monthly anomalies of all variables, read once and memory-mapped
+        # by the workers
+        pgw = PGWDelta(CMIP6anom_dir, vars3d, vars2d, memmap_dir=memmap_dir)
+        dates = [
+            sdate + dt.timedelta(days=n) for n in range((edate - sdate).days + 1)
+        ]
+        tasks = [delayed(write_era5_day)(date, pgw, opts.overwrite) for date in dates]
+
+    files = Parallel(n_jobs=opts.njobs)(tasks)
+    files = [filename for day_files in files for filename in day_files]
+
+    if opts.figs:
+        if not os.path.exists(figs_path):
+            os.makedirs(figs_path)
+        Parallel(n_jobs=opts.njobs)(
+            delayed(plot_intermediate)(filename, pgw) for filename in files
+        )
+
+
+###############################################################################
+##### __main__  scope
+###############################################################################
+
+if __name__ == "__main__":
+    main()
+
+###############################################################################
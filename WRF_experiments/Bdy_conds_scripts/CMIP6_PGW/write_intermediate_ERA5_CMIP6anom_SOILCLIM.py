@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-""" write_intermediate_ERA5_CMIP5anom.py
-run write_intermediate_ERA5_CMIP5anom.py -s 2007 -e 2007
+""" write_intermediate_ERA5_CMIP6anom_SOILCLIM.py
+run write_intermediate_ERA5_CMIP6anom_SOILCLIM.py -s 2007 -e 2007
 
 Authors: Daniel Argueso- Alejandro Di Luca @ CCRC, UNSW. Sydney (Australia)
 email: a.diluca@unsw.edu.au
@@ -52,144 +52,19 @@ Modified July 7 2021
  - Adapted to CMIP6 and ERA5 (Daniel Argüeso)
  - Part of the EPICC project
 
+Modified October 17 2026
+ - The soil climatology files are written by write_intermediate_ERA5_CMIP6anom.py
+   in soilclim mode; this script only calls it with --mode soilclim and
+   --overwrite (existing files were always overwritten). -s/-e years are
+   inclusive, as before
+
 
 
 """
 
-import netCDF4 as nc
-import numpy as np
-import glob as glob
-from optparse import OptionParser
-import calendar
-import outputInter_soil as f90
-import datetime as dt
 import sys
-import matplotlib.pyplot as plt
-import copy as cp
-import pdb
-import os
-
-
-### Options
-parser = OptionParser()
-parser.add_option(
-    "-s",
-    "--syear",
-    type="int",
-    dest="syear",
-    help="first year to process",
-    metavar="input argument",
-)
-parser.add_option(
-    "-e",
-    "--eyear",
-    type="int",
-    dest="eyear",
-    help="last year to process",
-    metavar="input argument",
-)
-
-(opts, args) = parser.parse_args()
-###
-
-overwrite_file = True
-create_figs = False
-syear = opts.syear
-eyear = opts.eyear
-nyears = eyear - syear + 1
-month_i = 1
-month_f = 12
-
-varsoil = [
-    "LANDSEA",
-    "ST000007",
-    "ST007028",
-    "ST028100",
-    "ST100289",
-    "SM000007",
-    "SM007028",
-    "SM028100",
-    "SM100289",
-]
-varsoil_codes = {
-    "ST000007": "stl1",
-    "ST007028": "stl2",
-    "ST028100": "stl3",
-    "ST100289": "stl4",
-    "SM000007": "swvl1",
-    "SM007028": "swvl2",
-    "SM028100": "swvl3",
-    "SM100289": "swvl4",
-    "LANDSEA": "lsm",
-}
-var_units_era5 = {
-    "LANDSEA": "0/1 Flag",
-    "ST000007": "K",
-    "ST007028": "K",
-    "ST028100": "K",
-    "ST100289": "K",
-    "SM000007": "1",
-    "SM007028": "1",
-    "SM028100": "1",
-    "SM100289": "1",
-}
-
-nfieldssoil = len(varsoil)
-
-
-CMIP6anom_dir = "/home/dargueso/BDY_DATA/ERA5_CMIP6anom/"
-ERA5_dir = "/home/dargueso/BDY_DATA/ERA5/ERA5_netcdf"
-figs_path = "/home/dargueso/BDY_DATA/ERA5_CMIP6anom/Figs"
-
-nlat = 601
-nlon = 1200
-
-
-file_ref = nc.Dataset(f"{ERA5_dir}/sfcclim.nc", "r")
-lat = file_ref.variables["lat"][:]
-lon = file_ref.variables["lon"][:]
-
-olon, olat = np.meshgrid(lon, lat)
-
-
-for y in range(nyears):
-    year = y + syear
-    ferasfc = nc.Dataset(f"{ERA5_dir}/sfcclim.nc", "r")
-    Y = str(year)
-    M = "12"
-    D = "22"
-    filedate = f"{Y}-{M}-{D}_00-00-00"
-
-    vout = {}
-
-    for var in varsoil:
-        print("Processing variable %s" % (var))
-
-        if var == "LANDSEA":
-            sst = ferasfc.variables["sst"][:, :]
-            vout[var] = np.int32(np.ma.getmask(sst))
-        else:
-            vout[var] = ferasfc.variables["%s" % (varsoil_codes[var])][:, :]
-
-    fieldssoil = np.ndarray(
-        shape=(nfieldssoil, nlat, nlon), dtype="float32"
-    )  # ,order='Fortran')
-
-    startlat = lat[0]
-    startlon = lon[0]
-    deltalon = 0.30
-    deltalat = -0.30
-
-    fieldssoil[0, :, :] = np.float32(vout["LANDSEA"])
-    fieldssoil[1, :, :] = np.float32(vout["ST000007"])
-    fieldssoil[2, :, :] = np.float32(vout["ST007028"])
-    fieldssoil[3, :, :] = np.float32(vout["ST028100"])
-    fieldssoil[4, :, :] = np.float32(vout["ST100289"])
-    fieldssoil[5, :, :] = np.float32(vout["SM000007"])
-    fieldssoil[6, :, :] = np.float32(vout["SM007028"])
-    fieldssoil[7, :, :] = np.float32(vout["SM028100"])
-    fieldssoil[8, :, :] = np.float32(vout["SM100289"])
-
-    f90.writeintsoil(
-        fieldssoil, filedate, nlat, nlon, startlat, startlon, deltalon, deltalat
-    )
+
+import write_intermediate_ERA5_CMIP6anom as wi
+
+if __name__ == "__main__":
+    wi.main(["--mode", "soilclim", "--overwrite"] + sys.argv[1:])
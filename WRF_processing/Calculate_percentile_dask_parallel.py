@@ -36,6 +36,7 @@ qtiles = numpy.asarray(cfg.qtiles)
 
 # for year in $(seq -w 2011 2020); do ncrcat -v RAIN UIB_10MIN_RAIN_${year}-??.nc merged/UIB_10MIN_RAIN_${year}.nc; done
 # for file in $(ls UIB_01H_RAIN_*.nc);do ncks --cnk_dmn y,10 --cnk_dmn x,10 ${file} chunked/${file}; done
+# (not needed for files postprocessed with nc_layout = "timeseries" in EPICC_post_config.py)
 def main():
 
     # Check initial time
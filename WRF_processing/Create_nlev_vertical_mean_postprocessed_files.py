@@ -9,23 +9,26 @@
 #
 # @Project@
 # Version: x.0 (Beta)
-# Description:
+# Description: Pressure-weighted vertical mean (or integral) of pressure-level
+# files between two pressure levels. Only the levels in the layer are read,
+# in chunks of records, and only the reduced field is written. Files are
+# processed in parallel.
 #
-# Dependencies:
+# Dependencies: netCDF4, numpy, joblib
 #
 # Files:
 #
 #####################################################################
 """
 
-
-
-
-
 from glob import glob
-import xarray as xr
+import netCDF4 as nc
+import numpy as np
 import os
+import datetime as dt
 
+from joblib import Parallel, delayed
+from constants import const as const
 
 
 wruns=['EPICC_2km_ERA5_HVC_GWD','EPICC_2km_ERA5_CMIP6anom_HVC_GWD']
@@ -36,22 +39,124 @@ path_out = "/vg6/dargueso-NO-BKUP/postprocessed/unified/EPICC"
 patt_in="UIB_03H_PLEVS"
 
 var='WA'
-
-for n,wrun in enumerate(wruns):
-    fullpathin = "%s/%s/" %(path_in,wrun)
-    fullpathout = "%s/%s/" %(path_out,wrun)
-
-    if not os.path.exists(fullpathout):
-        os.makedirs(fullpathout)
-
-
-    filesin = sorted(glob(f'{fullpathin}/{patt_in}_{var}*'))
-    for file in filesin:
-        print(file)
-    
-        fin=xr.open_dataset(file)
-        fin.coords['lev']=fin.levels
-
-        finavg=fin.sel(lev=slice(900,600)).mean('lev').squeeze()
-        fileout = file.replace(patt_in,'UIB_VAVG_900-600hPA_03H')
-        fin.to_netcdf(fileout)
+pbot = 900  # Bottom of the layer [hPa]
+ptop = 600  # Top of the layer [hPa]
+mode = 'mean'  # 'mean' (dp-weighted average) or 'integral' (sum of var*dp/g)
+tchunk = 248  # Records read at a time
+njobs = 8
+
+patt_modes = {'mean':'VAVG','integral':'VINT'}
+
+###########################################################
+###########################################################
+
+def main():
+
+    for n,wrun in enumerate(wruns):
+        fullpathin = "%s/%s/" %(path_in,wrun)
+        fullpathout = "%s/%s/" %(path_out,wrun)
+
+        if not os.path.exists(fullpathout):
+            os.makedirs(fullpathout)
+
+        filesin = sorted(glob(f'{fullpathin}/{patt_in}_{var}*'))
+        patt_out = f'UIB_{patt_modes[mode]}_{pbot}-{ptop}hPA_03H'
+        fileouts = [os.path.join(fullpathout,os.path.basename(file).replace(patt_in,patt_out)) for file in filesin]
+
+        Parallel(n_jobs=njobs)(delayed(vertical_reduce_file)(filein,fileout,var,pbot,ptop,mode,tchunk) for filein,fileout in zip(filesin,fileouts))
+
+###########################################################
+###########################################################
+
+def layer_weights(levels,pbot,ptop):
+    """Levels within [ptop,pbot] and their pressure thickness [hPa]
+    Each level represents the layer between the midpoints with its
+    neighbours, bounded by pbot and ptop.
+    Returns the index slice of the levels to read (contiguous range),
+    the positions of the selected levels within that slice and dp"""
+
+    levels = np.asarray(levels,np.float64)
+    sel = np.where((levels <= pbot) & (levels >= ptop))[0]
+    if len(sel) == 0:
+        raise ValueError(f'No levels between {pbot} and {ptop} hPa')
+
+    order = sel[np.argsort(-levels[sel])]
+    plev = levels[order]
+    edges = np.concatenate(([pbot],0.5*(plev[1:] + plev[:-1]),[ptop]))
+    dp = edges[:-1] - edges[1:]
+
+    ks = slice(sel.min(),sel.max()+1)
+    return ks, order - ks.start, dp
+
+def vertical_reduce(values,dp,mode='mean'):
+    """Pressure-weighted mean or integral over axis 1 of values
+    (time, lev, y, x), masked below ground. Integrals are sum(var*dp)/g
+    (dp in Pa). Returns a masked array where no level is valid."""
+
+    values = np.ma.masked_invalid(values)
+    valid = ~np.ma.getmaskarray(values)
+    wdp = np.where(valid,dp[None,:,None,None],0.)
+    total = np.sum(values.filled(0.)*wdp,axis=1)
+    weight = np.sum(wdp,axis=1)
+
+    if mode == 'mean':
+        with np.errstate(invalid='ignore',divide='ignore'):
+            reduced = total/weight
+    elif mode == 'integral':
+        reduced = total*100./const.g
+    else:
+        raise ValueError(f'Unknown mode {mode}')
+
+    return np.ma.masked_where(weight == 0,reduced)
+
+def vertical_reduce_file(filein,fileout,varname,pbot,ptop,mode='mean',tchunk=248):
+    """Reduce the levels of a pressure-level file between pbot and ptop,
+    reading tchunk records at a time, and write only the reduced field"""
+
+    print(filein)
+    fin = nc.Dataset(filein)
+    vin = fin.variables[varname]
+    ks, korder, dp = layer_weights(fin.variables['levels'][:],pbot,ptop)
+    ntimes, nlev, ny, nx = vin.shape
+
+    fout = nc.Dataset(fileout,'w',format='NETCDF4')
+    fout.createDimension('time',None)
+    fout.createDimension('y',ny)
+    fout.createDimension('x',nx)
+    if 'bnds' in fin.dimensions:
+        fout.createDimension('bnds',2)
+
+    for cname in ['time','time_bnds','lat','lon']:
+        if cname in fin.variables:
+            cin = fin.variables[cname]
+            cout = fout.createVariable(cname,cin.dtype,cin.dimensions,zlib=True,complevel=5,fill_value=const.missingval)
+            cout.setncatts({att: cin.getncattr(att) for att in cin.ncattrs() if att != '_FillValue'})
+            cout[:] = cin[:]
+
+    vout = fout.createVariable(varname,'f',('time','y','x'),zlib=True,complevel=5,
+                               chunksizes=(min(tchunk,ntimes),ny,nx),fill_value=const.missingval)
+    atts = {att: vin.getncattr(att) for att in vin.ncattrs() if att != '_FillValue'}
+    if mode == 'integral' and 'units' in atts:
+        atts['units'] = f"{atts['units']} kg m-2"
+    atts['cell_methods'] = f'lev: {mode} (pressure weighted) {pbot}-{ptop} hPa'
+    vout.setncatts(atts)
+
+    for t0 in range(0,ntimes,tchunk):
+        t1 = min(t0 + tchunk,ntimes)
+        values = vin[t0:t1,ks][:,korder]
+        vout[t0:t1] = vertical_reduce(values,dp,mode)
+
+    setattr(fout,'creation_date',dt.datetime.today().strftime('%Y-%m-%d'))
+    setattr(fout,'comments',f'Vertical {mode} of {filein} between {pbot} and {ptop} hPa')
+    fout.close()
+    fin.close()
+
+###############################################################################
+##### __main__  scope
+###############################################################################
+
+if __name__ == "__main__":
+
+    main()
+
+###############################################################################
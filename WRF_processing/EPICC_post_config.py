@@ -33,6 +33,17 @@ nproc_y = 48
 
 plevs = [850]  # [1000] #[850]
 variables = ["RV"] #["PSL"]  # ["RV"] # ["PVO"] #["Z"]
+multivar = True  # Compute all variables of a day from a single read of the input files
+njobs = 10  # Worker processes shared by all tasks of the postprocessing drivers
+incremental = True  # Skip outputs that are up to date according to the manifest
+manifest_file = path_proc + "/EPICC_postprocess_manifest.sqlite"  # Needs a filesystem with working POSIX locks (see manifest.py)
+
+# Output file layout (compute_vars.create_netcdf)
+nc_layout = "map"  # "map": one chunk per field; "timeseries": all times of nc_tile x nc_tile columns (daily postprocessed and UIB_<freq> files)
+nc_tile = 50  # y/x chunk size for the timeseries layout
+nc_complevel = 5  # zlib level; 0 writes uncompressed (fast mode)
+nc_shuffle = True
+nc_lsd = None  # least_significant_digit for lossy quantization (e.g. 2); None keeps full precision. Needs nc_complevel > 0
 
 #### Requested output variables (DO NOT CHANGE THIS LINE) ####
 
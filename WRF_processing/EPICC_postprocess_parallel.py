@@ -19,7 +19,6 @@
 #####################################################################
 """
 import netCDF4 as nc
-import xarray as xr
 import tempfile
 import numpy as np
 from glob import glob
@@ -31,10 +30,10 @@ import re
 from dateutil.relativedelta import relativedelta
 import sys
 
-from joblib import Parallel, delayed
-
 import compute_vars as cvars
-from wrf_utils import wrftime2date, sel_wrfout_files
+from wrf_utils import wrftime2date, sel_wrfout_files, merge_wrf3hrly_inputs
+from manifest import Manifest
+from task_graph import run_task_graph
 
 import EPICC_post_config as cfg
 
@@ -46,46 +45,42 @@ def main():
     ctime_i = checkpoint(0)
     ctime = checkpoint(0)
 
-    for wrun in cfg.wruns:
-        init_date = dt.datetime(cfg.syear, cfg.smonth, 1)
-        year = init_date.year
-        month = init_date.month
-        day = init_date.day
-
-        while year < cfg.eyear or (year == cfg.eyear and month < cfg.emonth):
-            start_date = dt.datetime(year, month, day)
-            end_date = dt.datetime(year, month, day) + relativedelta(years=1)
-            if end_date > dt.datetime(cfg.eyear, cfg.emonth, 1):
-                end_date = dt.datetime(
-                    cfg.eyear,
-                    cfg.emonth,
-                    calendar.monthrange(int(cfg.eyear), cfg.emonth)[1],
-                ) + dt.timedelta(days=1)
-
-            fullpathout = cfg.path_proc + "/" + wrun
-            if not os.path.exists(fullpathout):
-                os.makedirs(fullpathout)
-
-            # datenow=dt.datetime.now().strftime("%Y-%m-%d_%H:%M")
+    # Whole period at once: there is no barrier between runs, variables or years
+    d1 = dt.datetime(cfg.syear, cfg.smonth, 1)
+    d2 = dt.datetime(
+        cfg.eyear, cfg.emonth, calendar.monthrange(int(cfg.eyear), cfg.emonth)[1]
+    ) + dt.timedelta(days=1)
+    total_days = (d2 - d1).days
+    date_list = [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
 
+    tasks = []
+    for wrun in cfg.wruns:
+        fullpathout = cfg.path_proc + "/" + wrun
+        if not os.path.exists(fullpathout):
+            os.makedirs(fullpathout)
+
+        if cfg.multivar:
+            # One task per day computing all variables from a single read
+            # (all tasks cost the same, so they run in date order)
+            cost = sum(cvars.var_cost(varn) for varn in cfg.variables)
+            tasks += [
+                (cost, postproc_vars_byday, (wrun, cfg.variables, date))
+                for date in date_list
+            ]
+        else:
             for varn in cfg.variables:
-                d1 = dt.datetime(year, month, 1)
-                d2 = dt.datetime(end_date.year, end_date.month, end_date.day)
-                # total_hours = (d2 - d1).days * 24 + (d2 - d1).seconds // 3600
-                total_days = (d2 - d1).days
-                date_list = [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
-                #import pdb; pdb.set_trace()
-                Parallel(n_jobs=10)(
-                        delayed(postproc_var_byday)(wrun, varn, date) for date in date_list
-                        )
+                tasks += [
+                    (cvars.var_cost(varn), postproc_var_byday, (wrun, varn, date))
+                    for date in date_list
+                ]
 
-            ctime = checkpoint(ctime_i)
+    # The manifest table is created here, so workers only open connections
+    if cfg.incremental:
+        Manifest(cfg.manifest_file).create()
 
-            year = end_date.year
-            month = end_date.month
-            day = end_date.day
+    run_task_graph(tasks, cfg.njobs)
 
-            # sys.stdout.close()
+    ctime = checkpoint(ctime_i)
 
 
 ###########################################################
@@ -93,6 +88,19 @@ def main():
 
 
 def postproc_var_byday(wrun, varn, date):
+    """Postprocess a single variable for a given day"""
+    postproc_vars_byday(wrun, [varn], date)
+
+
+###########################################################
+###########################################################
+
+
+def postproc_vars_byday(wrun, varnames, date):
+    """Postprocess a list of variables for a given day.
+    Each input file is opened (and merged with wrfout/geo_em for wrf3hrly)
+    only once and all variables are computed from the same ncfile object.
+    """
     patt = cfg.patt
     dom = cfg.dom
     fullpathin = cfg.path_wrfo + "/" + wrun + "/out"
@@ -109,58 +117,40 @@ def postproc_var_byday(wrun, varn, date):
 
     sdate = "%s-%s-%s" % (y, str(m).rjust(2, "0"), str(d).rjust(2, "0"))
     filesin = sorted(glob(f"{fullpathin}/{patt}_{dom}_{sdate}*"))
+    print(filesin)
+    if len(filesin) == 0:
+        print(f"No input files for {sdate}")
+        return
+
+    fileouts = {
+        varn: "%s/%s_%s_%s.nc" % (fullpathout, cfg.institution, varn, str(sdate))
+        for varn in varnames
+    }
 
-    x = []
+    # Skip variables whose outputs are up to date with their inputs
+    manifest = None
+    if cfg.incremental:
+        inputs = wrf_input_files(filesin)
+        manifest = Manifest(cfg.manifest_file)
+        varnames = [
+            varn
+            for varn in varnames
+            if not manifest.is_current(fileouts[varn], inputs, cvars.var_version(varn))
+        ]
+        if len(varnames) == 0:
+            print(f"Outputs up to date for {sdate}")
+            return
+
+    x = {varn: [] for varn in varnames}
+    atts = {}
     t = []
 
-    
-    if len(filesin) == 1:
-        print(filesin)
-        ncfile = nc.Dataset(filesin[0])
-        if patt == "wrf3hrly":
-            filein_wrf3d = filesin[0]
-            filein_wrf2d = filein_wrf3d.replace("wrf3hrly", "wrfout")
-            fwrfgeo = xr.open_dataset(f"{cfg.path_geo}/{cfg.geofile_ref}")
-            filein_aux = f"aux_{sdate}.nc"
-            #import pdb; pdb.set_trace()
-            os.system(f"ncks -d Time,0,23,3 {filein_wrf2d} {filein_aux}")
-            fwrf2d = nc.Dataset(filein_aux)
-            for varname in fwrf2d.variables.keys():
-                if varname not in ncfile.variables.keys():
-                    ncfile.variables[varname] = fwrf2d.variables[varname]
-            for varname in fwrfgeo.variables.keys():
-                if varname not in ncfile.variables.keys():
-                    ncfile.variables[varname] = fwrfgeo.variables[varname]
-        
-        #import pdb; pdb.set_trace()
-        varout, atts = cvars.compute_WRFvar(ncfile, varn)
-        otimes = wrftime2date(filesin[0].split())[:]
-        if patt == "wrf3hrly":
-            fwrf2d.close()
-            fwrfgeo.close()
-            os.remove(filein_aux)
+    for filename in filesin:
+        tFragment = wrftime2date(filename.split())[:]
+        ncfile, auxfiles = open_wrf_input(filename)
 
-    else:
-        print(filesin)
-        for n, filename in enumerate(filesin):
-            tFragment = wrftime2date(filename.split())[:]
-            ncfile = nc.Dataset(filesin[n])
-            if patt == "wrf3hrly":
-                filein_wrf3d = filesin[n]
-                filein_wrf2d = filein_wrf3d.replace("wrf3hrly", "wrfout")
-                fwrfgeo = nc.Dataset(f"{cfg.path_geo}/{cfg.geofile_ref}")
-                filein_aux = f"aux_{sdate}.nc"
-                os.system(f"ncks -d Time,0,23,3 {filein_wrf2d} {filein_aux}")
-                fwrf2d = nc.Dataset(filein_aux)
-
-                for varname in fwrf2d.variables.keys():
-                    if varname not in ncfile.variables.keys():
-                        ncfile.variables[varname] = fwrf2d.variables[varname]
-                for varname in fwrfgeo.variables.keys():
-                    if varname not in ncfile.variables.keys():
-                        ncfile.variables[varname] = fwrfgeo.variables[varname]
-
-            xFragment, atts = cvars.compute_WRFvar(ncfile, varn)
+        for varn in varnames:
+            xFragment, atts[varn] = cvars.compute_WRFvar(ncfile, varn)
 
             if len(tFragment) == 1:
                 if len(xFragment.shape) == 3:
@@ -168,42 +158,83 @@ def postproc_var_byday(wrun, varn, date):
                 if len(xFragment.shape) == 2:
                     xFragment = np.expand_dims(xFragment, axis=0)
 
-            ncfile.close()
-            if patt == "wrf3hrly":
-                fwrf2d.close()
-                fwrfgeo.close()
-                os.remove(filein_aux)
-            x.append(xFragment)
-            t.append(tFragment)
+            x[varn].append(xFragment)
+
+        close_wrf_input(ncfile, auxfiles)
+        t.append(tFragment)
 
-        varout = np.concatenate(x, axis=0)
-        otimes = np.concatenate(t, axis=0)
+    otimes = np.concatenate(t, axis=0)
 
     ###########################################################
     ###########################################################
 
     # ## Creating netcdf files
-    fileout = "%s/%s_%s_%s.nc" % (fullpathout, cfg.institution, varn, str(sdate))
     ref_file = nc.Dataset(file_refname)
     lat = ref_file.variables["XLAT"][0, :]
     lon = ref_file.variables["XLONG"][0, :]
+    ref_file.close()
 
-    varinfo = {
-        "values": varout,
-        "varname": varn,
-        "atts": atts,
-        "lat": lat,
-        "lon": lon,
-        "times": otimes,
-    }
+    for varn in varnames:
+        fileout = fileouts[varn]
 
-    cvars.create_netcdf(varinfo, fileout)
+        varinfo = {
+            "values": np.concatenate(x[varn], axis=0),
+            "varname": varn,
+            "atts": atts[varn],
+            "lat": lat,
+            "lon": lon,
+            "times": otimes,
+        }
+
+        cvars.create_netcdf(varinfo, fileout)
+        if manifest is not None:
+            manifest.record(fileout, inputs, cvars.var_version(varn))
 
     # edate = dt.datetime(y,m,d) + dt.timedelta(days=1)
     print(otimes[-1].strftime("%Y-%m-%d"))
     ctime = checkpoint(ctime_var)
 
 
+###########################################################
+###########################################################
+
+
+def wrf_input_files(filesin):
+    """All files read to postprocess filesin (wrfout and geo_em files are
+    also read for wrf3hrly inputs)"""
+    inputs = list(filesin)
+    if cfg.patt == "wrf3hrly":
+        inputs += [filename.replace("wrf3hrly", "wrfout") for filename in filesin]
+        inputs.append(f"{cfg.path_geo}/{cfg.geofile_ref}")
+    return inputs
+
+
+def open_wrf_input(filename):
+    """Open a WRF output file for postprocessing.
+    For wrf3hrly files, the 3-hourly records of the corresponding wrfout and
+    the geo_em fields are attached to the ncfile variables (read lazily).
+    Returns the ncfile and a list of auxiliary files to close afterwards
+    """
+    ncfile = nc.Dataset(filename)
+    auxfiles = []
+
+    if cfg.patt == "wrf3hrly":
+        fwrf2d = nc.Dataset(filename.replace("wrf3hrly", "wrfout"))
+        fwrfgeo = nc.Dataset(f"{cfg.path_geo}/{cfg.geofile_ref}")
+        merge_wrf3hrly_inputs(ncfile, fwrf2d, fwrfgeo)
+        auxfiles = [fwrf2d, fwrfgeo]
+
+    return ncfile, auxfiles
+
+
+def close_wrf_input(ncfile, auxfiles):
+    """Close a WRF output file opened with open_wrf_input"""
+    cvars.release_diag_context(ncfile)
+    ncfile.close()
+    for auxfile in auxfiles:
+        auxfile.close()
+
+
 ###########################################################
 ###########################################################
 def checkpoint(ctime):
@@ -24,159 +24,228 @@ from glob import glob
 import datetime as dt
 import calendar
 import os
-from optparse import OptionParser
-import re
-from dateutil.relativedelta import relativedelta
-import sys
-
-from joblib import Parallel, delayed
 
 import compute_vars as cvars
-from wrf_utils import wrftime2date,sel_wrfout_files
+from wrf_utils import wrftime2date, merge_wrf3hrly_inputs, wrf_patch_bounds, PatchFile
+from manifest import Manifest
+from task_graph import run_task_graph
 
 import EPICC_post_config as cfg
 
 
 def main():
-
-    """ POSTPROCESS REQUESTES VARIABLES FROM WRF OUTPUTS"""
+    """POSTPROCESS REQUESTED VARIABLES FROM WRF OUTPUTS SPLIT IN PROCESSOR PATCHES (io_form=102)"""
 
     # Check initial time
-    ctime_i=checkpoint(0)
-    ctime=checkpoint(0)
-
+    ctime_i = checkpoint(0)
+    ctime = checkpoint(0)
+
+    npatches = cfg.nproc_x * cfg.nproc_y
+
+    # Full-domain reference coordinates are read once; each patch takes its slice
+    ref_file = nc.Dataset(cfg.file_ref)
+    lat = ref_file.variables["XLAT"][0, :]
+    lon = ref_file.variables["XLONG"][0, :]
+    ref_file.close()
+
+    # Whole period at once: there is no barrier between runs or years
+    d1 = dt.datetime(cfg.syear, cfg.smonth, 1)
+    d2 = dt.datetime(
+        cfg.eyear, cfg.emonth, calendar.monthrange(int(cfg.eyear), cfg.emonth)[1]
+    ) + dt.timedelta(days=1)
+    total_days = (d2 - d1).days
+    date_list = [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
+    cost = sum(cvars.var_cost(varn) for varn in cfg.variables)
+
+    tasks = []
     for wrun in cfg.wruns:
+        fullpathout = cfg.path_proc + "/" + wrun
+        if not os.path.exists(fullpathout):
+            os.makedirs(fullpathout)
 
-        init_date = dt.datetime(cfg.syear,cfg.smonth,1)
-        year = init_date.year
-        month= init_date.month
-        day = init_date.day
-
-        while (year < cfg.eyear or (year == cfg.eyear and month < cfg.emonth)):
+        patch_refs = read_patch_refs(wrun, date_list, npatches, lat, lon)
 
-            end_date   = dt.datetime(year,month,day) + relativedelta(years=1)
-            if end_date>dt.datetime(cfg.eyear,cfg.emonth,1):
-                end_date = dt.datetime(cfg.eyear,cfg.emonth,calendar.monthrange(int(cfg.eyear), cfg.emonth)[1])+dt.timedelta(days=1)
+        # One task per (day, patch), all variables computed from a single read
+        tasks += [
+            (
+                cost,
+                postproc_patch_byday,
+                (wrun, cfg.variables, date, ntile, patch_refs[ntile]),
+            )
+            for date in date_list
+            for ntile in sorted(patch_refs)
+        ]
 
-            fullpathout = cfg.path_proc + "/" + wrun
-            if not os.path.exists(fullpathout):
-                os.makedirs(fullpathout)
+    # The manifest table is created here, so workers only open connections
+    if cfg.incremental:
+        Manifest(cfg.manifest_file).create()
 
-            for varn in cfg.variables:
-                d1 = dt.datetime(year,month,22)
-                d2 = dt.datetime(year,month,23)
-                #d2 = dt.datetime(end_date.year,end_date.month,end_date.day)
-                total_days = (d2-d1).days
-                date_list= [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
-                Parallel(n_jobs=1)(delayed(postproc_var_byday)(wrun,varn,date) for date in date_list)
+    run_task_graph(tasks, cfg.njobs)
 
-            ctime=checkpoint(ctime_i)
-
-            year  = end_date.year
-            month = end_date.month
-            day   = end_date.day
-
-            #sys.stdout.close()
+    ctime = checkpoint(ctime_i)
 
 
 ###########################################################
 ###########################################################
 
-def postproc_var_byday(wrun,varn,date):
 
-
-    patt    = cfg.patt
-    dom = cfg.dom
+def read_patch_refs(wrun, dates, npatches, lat, lon):
+    """Position, coordinates and WRF patch attributes of each patch, read
+    once from the first of dates with files for that patch. The patch
+    attributes are copied to the output files so they can be placed in the
+    full domain (mosaic.wrf_patch_placements) without a reassembly step.
+    Patches without files on any of the dates are reported and left out."""
     fullpathin = cfg.path_wrfo + "/" + wrun
-    fullpathout = cfg.path_proc + "/" + wrun
-
-    ctime_var=checkpoint(0)
-
-
-    y = date.year
-    m = date.month
-    d = date.day
-
-    sdate="%s-%s-%s" %(y,str(m).rjust(2,"0"),str(d).rjust(2,"0"))
-
-    for ntile in range(cfg.nproc_x*cfg.nproc_y):
-
-        file_refname = f"{fullpathin}/{cfg.file_ref}_{ntile:04d}"
-        filesin = sorted(glob(f'{fullpathin}/{patt}_{dom}_{sdate}*_{ntile:04d}'))
-
 
-        x=[]
-        t=[]
+    patch_refs = {}
+    for ntile in range(npatches):
+        filesin = []
+        for date in dates:
+            sdate = date.strftime("%Y-%m-%d")
+            filesin = sorted(glob(f"{fullpathin}/{cfg.patt}_{cfg.dom}_{sdate}*_{ntile:04d}"))
+            if filesin:
+                break
+        if not filesin:
+            print(f"No files for patch {ntile:04d} of {wrun} in the whole period: skipped")
+            continue
+        ncfile = nc.Dataset(filesin[0])
+        ys, xs = wrf_patch_bounds(ncfile)
+        gattrs = {
+            att: ncfile.getncattr(att)
+            for att in ncfile.ncattrs()
+            if "_PATCH_" in att or att.endswith("_GRID_DIMENSION")
+        }
+        ncfile.close()
+        patch_refs[ntile] = {
+            "ys": ys,
+            "xs": xs,
+            "lat": lat[ys, xs],
+            "lon": lon[ys, xs],
+            "gattrs": gattrs,
+        }
+    return patch_refs
 
-        if len(filesin) == 1:
-            print(filesin)
-            ncfile = nc.Dataset(filesin[0])
-            if patt == 'wrf3hrly':
-                fwrf2d = nc.Dataset(filesin[0].replace('wrf3hrly','wrfout'))
-                fwrfgeo = nc.Dataset(f'{cfg.path_geo}/{cfg.file_geo}')
-                for varname in fwrf2d.variables.keys():
-                    ncfile.variables[varname]=fwrf2d.variables[varname]
-                for varname in fwrfgeo.variables.keys():
-                    ncfile.variables[varname]=fwrfgeo.variables[varname]
 
-            varout,atts = cvars.compute_WRFvar(ncfile,varn)
-            otimes =  wrftime2date(filesin[0].split())[:]
-
-        else:
-
-            for n,filename in enumerate(filesin):
-
-                tFragment = wrftime2date(filename.split())[:]
-                ncfile = nc.Dataset(filesin[n])
-                if patt == 'wrf3hrly':
-                    fwrf2d = nc.Dataset(filesin[n].replace('wrf3hrly','wrfout'))
-                    fwrfgeo = nc.Dataset(f'{cfg.path_geo}/{cfg.file_geo}')
-                    for varname in fwrf2d.variables.keys():
-                        ncfile.variables[varname]=fwrf2d.variables[varname]
-                    for varname in fwrfgeo.variables.keys():
-                        ncfile.variables[varname]=fwrfgeo.variables[varname]
-
-                xFragment,atts = cvars.compute_WRFvar(ncfile,varn)
-
-                if len(tFragment)==1:
-                    if len(xFragment.shape) == 3:
-                        xFragment=np.expand_dims(xFragment,axis=0)
-                    if len(xFragment.shape) == 2:
-                        xFragment=np.expand_dims(xFragment,axis=0)
-
-                ncfile.close()
-                if patt == 'wrf3hrly':
-                    fwrf2d.close()
-                    fwrfgeo.close()
-                x.append(xFragment)
-                t.append(tFragment)
-
-            varout = np.concatenate(x, axis=0)
-            otimes = np.concatenate(t, axis=0)
-
-        ###########################################################
-        ###########################################################
-
-        # ## Creating netcdf files
-        fileout = f"{fullpathout}/{cfg.institution}_{varn}_{sdate}_{ntile:04d}.nc"
-        ref_file = nc.Dataset(file_refname)
-        lat=ref_file.variables['XLAT'][0,:]
-        lon=ref_file.variables['XLONG'][0,:]
-
-        varinfo = { 'values': varout,
-                    'varname': varn,
-                    'atts':atts,
-                    'lat': lat,
-                    'lon': lon,
-                    'times': otimes}
-
-        cvars.create_netcdf(varinfo,fileout)
+###########################################################
+###########################################################
 
 
+def postproc_patch_byday(wrun, varnames, date, ntile, patch_ref):
+    """Postprocess a list of variables for a given day and patch.
+    Each input file is opened only once and all variables are computed from
+    the same ncfile object."""
+    patt = cfg.patt
+    dom = cfg.dom
+    fullpathin = cfg.path_wrfo + "/" + wrun
+    fullpathout = cfg.path_proc + "/" + wrun
 
-    #edate = dt.datetime(y,m,d) + dt.timedelta(days=1)
-    print(otimes[-1].strftime("%Y-%m-%d"))
-    ctime=checkpoint(ctime_var)
+    sdate = date.strftime("%Y-%m-%d")
+    filesin = sorted(glob(f"{fullpathin}/{patt}_{dom}_{sdate}*_{ntile:04d}"))
+    if len(filesin) == 0:
+        print(f"No files for {sdate} patch {ntile:04d}")
+        return
+
+    fileouts = {
+        varn: f"{fullpathout}/{cfg.institution}_{varn}_{sdate}_{ntile:04d}.nc"
+        for varn in varnames
+    }
+
+    # Skip variables whose outputs are up to date with their inputs
+    manifest = None
+    if cfg.incremental:
+        inputs = wrf_input_files(filesin)
+        manifest = Manifest(cfg.manifest_file)
+        varnames = [
+            varn
+            for varn in varnames
+            if not manifest.is_current(fileouts[varn], inputs, cvars.var_version(varn))
+        ]
+        if len(varnames) == 0:
+            return
+
+    x = {varn: [] for varn in varnames}
+    atts = {}
+    t = []
+
+    for filename in filesin:
+        tFragment = wrftime2date(filename.split())[:]
+        ncfile, auxfiles = open_wrf_patch(filename, patch_ref)
+
+        for varn in varnames:
+            xFragment, atts[varn] = cvars.compute_WRFvar(ncfile, varn)
+
+            if len(tFragment) == 1:
+                if len(xFragment.shape) == 3:
+                    xFragment = np.expand_dims(xFragment, axis=0)
+                if len(xFragment.shape) == 2:
+                    xFragment = np.expand_dims(xFragment, axis=0)
+
+            x[varn].append(xFragment)
+
+        close_wrf_patch(ncfile, auxfiles)
+        t.append(tFragment)
+
+    otimes = np.concatenate(t, axis=0)
+
+    ###########################################################
+    ###########################################################
+
+    # ## Creating netcdf files
+    for varn in varnames:
+        fileout = fileouts[varn]
+
+        varinfo = {
+            "values": np.concatenate(x[varn], axis=0),
+            "varname": varn,
+            "atts": atts[varn],
+            "lat": patch_ref["lat"],
+            "lon": patch_ref["lon"],
+            "times": otimes,
+            "gattrs": patch_ref["gattrs"],
+        }
+
+        cvars.create_netcdf(varinfo, fileout)
+        if manifest is not None:
+            manifest.record(fileout, inputs, cvars.var_version(varn))
+
+
+def wrf_input_files(filesin):
+    """All files read to postprocess filesin (wrfout patches and geo_em
+    files are also read for wrf3hrly inputs)"""
+    inputs = list(filesin)
+    if cfg.patt == "wrf3hrly":
+        inputs += [filename.replace("wrf3hrly", "wrfout") for filename in filesin]
+        inputs.append(f"{cfg.path_geo}/{cfg.geofile_ref}")
+    return inputs
+
+
+def open_wrf_patch(filename, patch_ref):
+    """Open a WRF patch file for postprocessing.
+    For wrf3hrly files, the 3-hourly records of the corresponding wrfout
+    patch and the patch slice of the geo_em fields are attached to the
+    ncfile variables (read lazily).
+    Returns the ncfile and a list of auxiliary files to close afterwards
+    """
+    ncfile = nc.Dataset(filename)
+    auxfiles = []
+
+    if cfg.patt == "wrf3hrly":
+        fwrf2d = nc.Dataset(filename.replace("wrf3hrly", "wrfout"))
+        fwrfgeo = nc.Dataset(f"{cfg.path_geo}/{cfg.geofile_ref}")
+        merge_wrf3hrly_inputs(
+            ncfile, fwrf2d, PatchFile(fwrfgeo, patch_ref["ys"], patch_ref["xs"])
+        )
+        auxfiles = [fwrf2d, fwrfgeo]
+
+    return ncfile, auxfiles
+
+
+def close_wrf_patch(ncfile, auxfiles):
+    """Close a WRF patch file opened with open_wrf_patch"""
+    cvars.release_diag_context(ncfile)
+    ncfile.close()
+    for auxfile in auxfiles:
+        auxfile.close()
 
 
 ###########################################################
@@ -26,6 +26,7 @@ import numpy as np
 from itertools import product
 from itertools import groupby
 from joblib import Parallel, delayed
+import tile_store as tstore
 from xhistogram.xarray import histogram
 
 #####################################################################
@@ -53,12 +54,11 @@ def main():
 
     """ Calculating IFD by tiles """
 
-    lonsteps = [f'{nn:03d}' for nn in range(nlons//tile_size+1)]
-    latsteps = [f'{nn:03d}' for nn in range(nlats//tile_size+1)]
-
-    xytiles=list(product(latsteps, lonsteps))
-    filespath = f'{cfg.path_in}/{wrun}/split_files_tiles_50/{cfg.patt_in}_10MIN_RAIN_20??-??'
-    print(f'Ej: {filespath}_000y-000x.nc')
+    filespath = tstore.tile_store_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,'10MIN','RAIN',tile_size)
+    print(f'Tile store: {filespath}')
+    store = tstore.TileStore(filespath)
+    xytiles = store.tile_ids()
+    store.close()
     Parallel(n_jobs=20)(delayed(calc_IFD_resample)(filespath,xytile[0],xytile[1],RSmins,I_bins_edges,I_bins_centers) for xytile in xytiles)
 
 #####################################################################
@@ -66,8 +66,7 @@ def main():
 
 def calc_IFD_resample(filespath,ny,nx,RSmins,I_bins_edges,I_bins_centers):
     print (f'Analyzing tile y: {ny} x: {nx}')
-    filesin = sorted(glob(f'{filespath}_{ny}y-{nx}x.nc'))
-    fin = xr.open_mfdataset(filesin,concat_dim="time", combine="nested",data_vars="minimal").sel(time=slice(str(cfg.syear),str(cfg.eyear))).load()
+    fin = tstore.load_tile(filespath,'RAIN',ny,nx,str(cfg.syear),str(cfg.eyear))
     ylen = fin.sizes['y']
     xlen = fin.sizes['x']
     lons = fin.lon.squeeze()
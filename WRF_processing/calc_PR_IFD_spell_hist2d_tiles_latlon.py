@@ -13,7 +13,7 @@
 # files that have previously been tiled. The purpose is to compute 2D histograms
 # once the spells are calculated and joined.
 #
-# Dependencies:
+# Dependencies: ifd_utils, tile_store
 #
 # Files:
 #
@@ -23,9 +23,9 @@ from glob import glob
 import numpy as np
 import xarray as xr
 from itertools import product
-from itertools import groupby
 from joblib import Parallel, delayed
-from xhistogram.xarray import histogram
+import tile_store as tstore
+import ifd_utils as ifdu
 
 import epicc_config as cfg
 
@@ -54,12 +54,11 @@ def main():
     """ Calculating spells by tiles """
 
 
-    lonsteps = [f'{nn:03d}' for nn in range(nlons//tile_size+1)]
-    latsteps = [f'{nn:03d}' for nn in range(nlats//tile_size+1)]
-
-    xytiles=list(product(latsteps, lonsteps))
-    filespath = f'{cfg.path_in}/{wrun}/split_files_tiles_50/{cfg.patt_in}_10MIN_RAIN_20??-??'
-    print(f'Ej: {filespath}_000y-000x.nc')
+    filespath = tstore.tile_store_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,'10MIN','RAIN',tile_size)
+    print(f'Tile store: {filespath}')
+    store = tstore.TileStore(filespath)
+    xytiles = store.tile_ids()
+    store.close()
     Parallel(n_jobs=10)(delayed(calc_IFD_spell)(filespath,xytile[0],xytile[1]) for xytile in xytiles)
 
 ###########################################################
@@ -67,45 +66,25 @@ def main():
 
 def calc_IFD_spell(filespath,ny,nx):
     print (f'Analyzing tile y: {ny} x: {nx}')
-    filesin = sorted(glob(f'{filespath}_{ny}y-{nx}x.nc'))
-    fin = xr.open_mfdataset(filesin,concat_dim="time", combine="nested",data_vars="minimal").sel(time=slice(str(cfg.syear),str(cfg.eyear))).load()
-    ylen = fin.sizes['y']
-    xlen = fin.sizes['x']
-    lons = fin.lon.squeeze()
-    lats = fin.lat.squeeze()
-
-    spell=np.zeros((len(fin.time),len(fin.y),len(fin.x)),dtype=np.int32)
-    intensity = np.zeros((len(fin.time),len(fin.y),len(fin.x)),dtype=float)
-
-    for iy in range(ylen):
-        for ix in range(xlen):
-            #print(f'y: {iy}; x: {ix}')
-            srain = fin.RAIN.isel(y=iy,x=ix)#.where(fin.isel(y=iy,x=ix).RAIN>wet_th,0)
-            srain = srain.to_dataframe()
-            srain = srain.rename(columns = {'RAIN':'pr'})
-            #srain['pr'] = srain['pr'].where(srain['pr']>=wet_th,0)
-            srain['event_start'] = (srain['pr'].astype(bool).shift() != srain['pr'].astype(bool))#.where(srain['pr']>=wet_th, False)
-            srain['event_end'] = (srain['pr'].astype(bool).shift(-1) != srain['pr'].astype(bool))#.where(srain['pr']>=wet_th, False)
-            srain['event'] = srain['event_start'].cumsum()#.where(srain['pr']>=wet_th)
-
-            wet_event_intensity = srain.groupby('event')['pr'].sum()
-            wet_event_duration = srain.groupby('event')['pr'].count()
-            srain['event_pr'] = srain['event'].map(wet_event_intensity).where(srain['event_end'])
-            srain['event_dur'] =  srain['event'].map(wet_event_duration).where(srain['event_end'])
-
-            spell[:,iy,ix] = srain['event_dur']
-            intensity[:,iy,ix] = srain['event_pr']
-
-    fino=xr.Dataset({'spell':(['time','y','x'],spell),'intensity':(['time','y','x'],intensity),'lat':(['y','x'],fin.lat.squeeze()),'lon':(['y','x'],fin.lon.squeeze())},coords={'time':fin.time.values})
-
+    fin = tstore.load_tile(filespath,'RAIN',ny,nx,str(cfg.syear),str(cfg.eyear))
+    rain = fin.RAIN.values
 
     if save_spell_file:
+        spell, intensity = ifdu.spell_arrays(rain)
+        fino=xr.Dataset({'spell':(['time','y','x'],spell),'intensity':(['time','y','x'],intensity),'lat':(['y','x'],fin.lat.squeeze()),'lon':(['y','x'],fin.lon.squeeze())},coords={'time':fin.time.values})
         fout = f'{cfg.path_in}/{wrun}/spell_IFD_{cfg.syear}-{cfg.eyear}_{ny}y-{nx}x.nc'#_{wet_th}mm.nc'
         fino.to_netcdf(fout,mode='w',encoding={'spell':{'zlib': True,'complevel': 5},'intensity':{'zlib': True,'complevel': 5}})
 
     fin.close()
 
-    hist2d = histogram(fino.spell, fino.intensity, bins=[I_bins_spell,I_bins_intensity],dim=['time'])
+    # Spells are run-length encoded along time for whole blocks of rows and
+    # binned directly, without building per-pixel dataframes.
+    counts = ifdu.spell_hist2d(rain, I_bins_spell, I_bins_intensity)
+    hist2d = xr.DataArray(counts,
+                          name='histogram_spell_intensity',
+                          dims=['y','x','spell_bin','intensity_bin'],
+                          coords={'spell_bin':I_bins_spell[:-1]+np.diff(I_bins_spell)/2,
+                                  'intensity_bin':I_bins_centers})
     fout2d = f'{cfg.path_in}/{wrun}/hist2d_spell_IFD_{cfg.syear}-{cfg.eyear}_{ny}y-{nx}x.nc'#_{wet_th}mm.nc'
     hist2d.to_netcdf(fout2d)
 
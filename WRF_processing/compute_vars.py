@@ -28,10 +28,103 @@ import wrf_utils as wrfu
 import EPICC_post_config as cfg
 import math
 import xarray as xr
+import hashlib
+import inspect
 
 # wrf.set_cache_size(0)
 wrf.disable_xarray()
 
+# Raw WRF variables needed by each wrf-python diagnostic. They are extracted
+# once per file and handed to wrf.getvar through its cache argument.
+diag_inputs = {
+    "pressure": ["P", "PB"],
+    "tk": ["P", "PB", "T"],
+    "geopotential": ["PH", "PHB"],
+    "slp": ["P", "PB", "T", "QVAPOR", "PH", "PHB"],
+    "pw": ["P", "PB", "T", "QVAPOR", "PH", "PHB"],
+    "ua": ["U"],
+    "va": ["V"],
+    "wa": ["W"],
+    "avo": ["U", "V"],
+    "ter": ["HGT"],
+}
+
+# Manual version of the variable definitions. Bump a variable to force the
+# recomputation of its outputs when a change is not visible in its compute_
+# function (e.g. in a shared helper). See var_version.
+var_versions = {}
+
+# Relative cost of computing each variable for one day, used to order the
+# tasks of the postprocessing drivers (task_graph.run_task_graph). Variables
+# not listed are 2D fields read or derived directly (cost 1).
+var_costs = {
+    "TC": 3,
+    "WA": 3,
+    "PSL": 4,
+    "PW": 4,
+    "Z": 5,
+    "RV": 8,
+    "CAPE2D": 20,
+}
+
+_diag_contexts = {}
+
+
+###########################################################
+###########################################################
+class WRFDiagContext:
+    """Per-file cache of base fields shared by the wrf-python diagnostics.
+    Raw variables (P, PB, T, QVAPOR, ...) are read once and derived fields
+    (pressure, tk, z, destaggered winds, ...) are computed on first request,
+    so several compute_* calls on the same file reuse them.
+    """
+
+    def __init__(self, ncfile):
+        self.ncfile = ncfile
+        self.rawvars = {}
+        self.fields = {}
+
+    def variable(self, varname):
+        """Raw variable from the file, read only once"""
+        if varname not in self.rawvars:
+            self.rawvars[varname] = wrf.extract_vars(
+                self.ncfile, wrf.ALL_TIMES, [varname]
+            )[varname]
+        return self.rawvars[varname]
+
+    def getvar(self, varname, **kwargs):
+        """wrf.getvar for all times, reusing raw inputs and previous results"""
+        key = (varname,) + tuple(sorted(kwargs.items()))
+        if key not in self.fields:
+            cache = {
+                rawvar: self.variable(rawvar)
+                for rawvar in diag_inputs.get(varname, [])
+            }
+            self.fields[key] = wrf.getvar(
+                self.ncfile, varname, wrf.ALL_TIMES, cache=cache, **kwargs
+            )
+        return self.fields[key]
+
+    def z(self):
+        """Geopotential height at mass levels [m]"""
+        if "z" not in self.fields:
+            self.fields["z"] = self.getvar("geopotential") / const.g
+        return self.fields["z"]
+
+
+def get_diag_context(ncfile):
+    """Return the diagnostic context of ncfile, creating it if needed"""
+    ctx = _diag_contexts.get(id(ncfile))
+    if ctx is None or ctx.ncfile is not ncfile:
+        ctx = WRFDiagContext(ncfile)
+        _diag_contexts[id(ncfile)] = ctx
+    return ctx
+
+
+def release_diag_context(ncfile):
+    """Free the cached fields of ncfile. To be called before closing it"""
+    _diag_contexts.pop(id(ncfile), None)
+
 
 ###########################################################
 ###########################################################
@@ -56,16 +149,73 @@ def compute_WRFvar(ncfile, varname):
     return varval, varatt
 
 
+def var_cost(varname):
+    """Relative cost of computing a variable (see var_costs)"""
+    return var_costs.get(varname, 1)
+
+
+def var_version(varname):
+    """Version of the definition of a variable, used to detect outdated
+    outputs: manual version (var_versions) and hash of the source of its
+    compute_ function ("raw" for variables read directly)"""
+    compute = globals().get("compute_%s" % (varname))
+    source = inspect.getsource(compute) if compute is not None else "raw"
+    return "%s-%s" % (
+        var_versions.get(varname, 1),
+        hashlib.sha1(source.encode()).hexdigest()[:12],
+    )
+
+
 ###########################################################
 ###########################################################
+def nc_write_options(shape, layout, complevel, shuffle, lsd, tile):
+    """Encoding options (createVariable keywords) for an output variable
+    of dimensions (time, [lev,] y, x)
+    layout: "map" stores each field (one time, one level) in one chunk.
+            "timeseries" stores all times of tile x tile columns in one chunk,
+            suitable for per-pixel readers (percentiles, IFD).
+    complevel: zlib compression level. 0 writes uncompressed (fast mode).
+    lsd: least_significant_digit for lossy quantization (None to disable).
+         Only applied with compression: ignored (with a warning) if
+         complevel is 0
+    """
+    if layout == "timeseries":
+        chunks = (shape[0],) + (1,) * (len(shape) - 3)
+        chunks += (min(tile, shape[-2]), min(tile, shape[-1]))
+    else:
+        chunks = (1,) * (len(shape) - 2) + tuple(shape[-2:])
+
+    opts = {"chunksizes": chunks}
+    if complevel > 0:
+        opts.update({"zlib": True, "complevel": complevel, "shuffle": shuffle})
+        if lsd is not None:
+            opts["least_significant_digit"] = lsd
+    else:
+        opts["zlib"] = False
+        if lsd is not None:
+            print(
+                "WARNING: least_significant_digit=%s ignored with complevel=0"
+                % (lsd)
+            )
+
+    return opts
+
+
 def create_netcdf(var, filename):
     print((("\n Create output file %s") % (filename)))
 
     otimes = var["times"]
-    outfile = nc.Dataset(
-        filename, "w", format="NETCDF4_CLASSIC", zlib=True, complevel=5
-    )
+    outfile = nc.Dataset(filename, "w", format="NETCDF4_CLASSIC")
     outfile.createDimension("time", None)
+
+    writeopts = nc_write_options(
+        var["values"].shape,
+        cfg.nc_layout,
+        cfg.nc_complevel,
+        cfg.nc_shuffle,
+        cfg.nc_lsd,
+        cfg.nc_tile,
+    )
     # outfile.createDimension('bnds',2)
     if var["values"].ndim == 4:
         outfile.createDimension("y", var["values"].shape[2])
@@ -76,9 +226,8 @@ def create_netcdf(var, filename):
             var["varname"],
             "f",
             ("time", "lev", "y", "x"),
-            zlib=True,
-            complevel=5,
             fill_value=const.missingval,
+            **writeopts,
         )
 
     if var["values"].ndim == 3:
@@ -89,9 +238,8 @@ def create_netcdf(var, filename):
             var["varname"],
             "f",
             ("time", "y", "x"),
-            zlib=True,
-            complevel=5,
             fill_value=const.missingval,
+            **writeopts,
         )
 
     outtime = outfile.createVariable(
@@ -153,6 +301,8 @@ def create_netcdf(var, filename):
     setattr(outfile, "author", "Daniel Argueso @UIB")
     setattr(outfile, "contact", "d.argueso@uib.es")
     # setattr(outfile,'comments','files created from wrf outputs %s/%s' %(path_in,patt))
+    for gatt, gvalue in var.get("gattrs", {}).items():
+        setattr(outfile, gatt, gvalue)
 
     outfile.close()
 
@@ -252,7 +402,7 @@ def compute_TC(ncfile):
     It also provides variable attributes CF-Standard
     """
 
-    tc = wrf.getvar(ncfile, "tc", wrf.ALL_TIMES)
+    tc = get_diag_context(ncfile).getvar("tk") - const.tkelvin
 
     atts = {
         "standard_name": "air_temperature",
@@ -271,7 +421,7 @@ def compute_WA(ncfile):
     It also provides variable attributes CF-Standard
     """
 
-    wa = wrf.getvar(ncfile, "wa", wrf.ALL_TIMES)
+    wa = get_diag_context(ncfile).getvar("wa")
 
     atts = {
         "standard_name": "vertical_wind_speed",
@@ -356,7 +506,7 @@ def compute_PSL(ncfile):
     It also provides variable attribute CF-Standard
     """
     # Get the sea level pressure using wrf-python
-    psl = wrf.getvar(ncfile, "slp", wrf.ALL_TIMES)
+    psl = get_diag_context(ncfile).getvar("slp")
 
     atts = {
         "standard_name": "air_pressure_at_mean_sea_level",
@@ -449,7 +599,7 @@ def compute_WSPD10(ncfile):
 def compute_PW(ncfile):
     """Function to calculate precipitable water in the column"""
 
-    pw = wrf.getvar(ncfile, "pw", wrf.ALL_TIMES)
+    pw = get_diag_context(ncfile).getvar("pw")
 
     atts = {
         "standard_name": "precipitable_water",
@@ -469,12 +619,13 @@ def compute_CAPE2D(ncfile):
     http://wrf-python.readthedocs.io/en/latest/user_api/generated/wrf.cape_2d.html
     This is NOT CF-compliant in any way. cape2d contains 4 variables distributed by levels: MCAPE [J kg-1], MCIN[J kg-1], LCL[m] and LFC[m]
     """
-    pres_hpa = wrf.getvar(ncfile, "pressure", wrf.ALL_TIMES)
-    tkel = wrf.getvar(ncfile, "tk", wrf.ALL_TIMES)
-    qv = wrf.getvar(ncfile, "QVAPOR", wrf.ALL_TIMES)
-    z = wrf.getvar(ncfile, "geopotential", wrf.ALL_TIMES) / const.g
-    psfc = wrf.getvar(ncfile, "PSFC", wrf.ALL_TIMES) / 100.0  # Converto to hPA
-    terrain = wrf.getvar(ncfile, "ter", wrf.ALL_TIMES)
+    diag = get_diag_context(ncfile)
+    pres_hpa = diag.getvar("pressure")
+    tkel = diag.getvar("tk")
+    qv = diag.variable("QVAPOR")
+    z = diag.z()
+    psfc = diag.variable("PSFC") / 100.0  # Converto to hPA
+    terrain = diag.getvar("ter")
     ter_follow = True
 
     cape2d = wrf.cape_2d(
@@ -506,7 +657,7 @@ def compute_Z(ncfile):
     """Function to calculate GEOPOTENTIAL using methods described in:
     """
 
-    z = wrf.getvar(ncfile, "geopotential", wrf.ALL_TIMES) / const.g
+    z = get_diag_context(ncfile).z()
 
     atts = {
         "standard_name": "geopotential",
@@ -545,7 +696,7 @@ def compute_RV(ncfile):
     ncfile.variables['MAPFAC_V'] = np.broadcast_to(georef.variables['MAPFAC_V'][:],(ntimes,) + georef.variables['MAPFAC_V'][:].squeeze().shape)
     ncfile.variables['MAPFAC_M'] = np.broadcast_to(georef.variables['MAPFAC_M'][:],(ntimes,) + georef.variables['MAPFAC_M'][:].squeeze().shape)
 
-    avo = wrf.getvar(ncfile,"avo",wrf.ALL_TIMES)
+    avo = get_diag_context(ncfile).getvar("avo")
     #rv = avo - 2*const.omega*np.sin(wrf.getvar(ncfile, "lat", wrf.ALL_TIMES))
     #import pdb; pdb.set_trace()
     F = np.transpose(np.repeat(ncfile.variables['F'][:][..., None], nlevs, axis=3),(0, 3, 1,2))
@@ -561,6 +712,108 @@ def compute_RV(ncfile):
     return rv, atts
 
 
+###########################################################
+###########################################################
+def bracket_gather(field, k, offset, jj, ii):
+    """field (time, lev, y, x) at level k + offset of each column (time, y, x),
+    at rows jj and columns ii"""
+    tt = np.arange(field.shape[0])[:, None, None]
+    return field[tt, k + offset, jj, ii]
+
+
+def interp_Z(ncfile, k, w):
+    """Geopotential height interpolated with the brackets k, w of
+    vert_interp.level_brackets (time, level, y, x), evaluated only on the
+    model levels bracketing each column (same values as compute_Z followed
+    by the vertical interpolation)
+    """
+    geopt = ncfile.variables["PH"][:] + ncfile.variables["PHB"][:]
+    ny, nx = geopt.shape[2:]
+    jj = np.arange(ny)[:, None]
+    ii = np.arange(nx)[None, :]
+
+    z = np.empty(k.shape, np.float32)
+    for n in range(k.shape[1]):
+        kn = np.maximum(k[:, n], 0)
+        g0, g1, g2 = [bracket_gather(geopt, kn, o, jj, ii) for o in (0, 1, 2)]
+        z[:, n] = 0.5 * ((1 - w[:, n]) * (g0 + g1) + w[:, n] * (g1 + g2)) / const.g
+
+    atts = {
+        "standard_name": "geopotential",
+        "long_name": "geopotential heigh",
+        "units": "m",
+    }
+
+    return z, atts
+
+
+def interp_RV(ncfile, k, w):
+    """Relative vorticity interpolated with the brackets k, w of
+    vert_interp.level_brackets (time, level, y, x). Vorticity is evaluated
+    only on the two model levels bracketing each column, with the same
+    finite differences as wrf-python avo and the same definition as
+    compute_RV (avo - F), instead of on every model level.
+    """
+    georef = nc.Dataset(cfg.geofile_ref)
+    msfu = georef.variables["MAPFAC_U"][0, :]
+    msfv = georef.variables["MAPFAC_V"][0, :]
+    msfm = georef.variables["MAPFAC_M"][0, :]
+    georef.close()
+
+    um = ncfile.variables["U"][:] / msfu
+    vm = ncfile.variables["V"][:] / msfv
+    cor = ncfile.variables["F"][:]
+    dx = ncfile.getncattr("DX")
+    dy = ncfile.getncattr("DY")
+
+    ny, nx = msfm.shape
+    jj = np.arange(ny)[:, None]
+    ii = np.arange(nx)[None, :]
+    jp1, jm1 = np.minimum(jj + 1, ny - 1), np.maximum(jj - 1, 0)
+    ip1, im1 = np.minimum(ii + 1, nx - 1), np.maximum(ii - 1, 0)
+    mm = msfm * msfm
+    dsx = (ip1 - im1) * dx
+    dsy = (jp1 - jm1) * dy
+
+    rv = np.empty(k.shape, np.float32)
+    for n in range(k.shape[1]):
+        kn = np.maximum(k[:, n], 0)
+        rvn = []
+        for o in (0, 1):
+            dudy = (
+                0.5
+                * (
+                    bracket_gather(um, kn, o, jp1, ii)
+                    + bracket_gather(um, kn, o, jp1, ii + 1)
+                    - bracket_gather(um, kn, o, jm1, ii)
+                    - bracket_gather(um, kn, o, jm1, ii + 1)
+                )
+                / dsy
+                * mm
+            )
+            dvdx = (
+                0.5
+                * (
+                    bracket_gather(vm, kn, o, jj, ip1)
+                    + bracket_gather(vm, kn, o, jj + 1, ip1)
+                    - bracket_gather(vm, kn, o, jj, im1)
+                    - bracket_gather(vm, kn, o, jj + 1, im1)
+                )
+                / dsx
+                * mm
+            )
+            rvn.append((dvdx - dudy + cor) * 1.0e5 - cor)
+        rv[:, n] = (1 - w[:, n]) * rvn[0] + w[:, n] * rvn[1]
+
+    atts = {
+        "standard_name": "relative vorticity",
+        "long_name": "relative vorticity",
+        "units": "s-1",
+    }
+
+    return rv, atts
+
+
 # def compute_RV(ncfile):
 #     """Function to calculate Relative Vorticity
 #     """
@@ -25,12 +25,12 @@ import sys
 import datetime as dt
 import glob as glob
 import itertools
-import subprocess as subprocess
-from joblib import Parallel, delayed
-import xarray as xr
 from dateutil.relativedelta import relativedelta
 import numpy as np
+import netCDF4 as nc
 import EPICC_post_config as cfg
+from task_graph import run_task_graph
+from compute_vars import nc_write_options
 import calendar
 import pandas as pd
 
@@ -47,7 +47,12 @@ frequencies=['10MIN','01H','DAY','MON']
 path_in = cfg.path_proc
 path_out = cfg.path_unif
 patt_inst=cfg.institution
-njobs = 12
+freq_cost = {'10MIN':6,'01H':2,'03H':1}
+# Records per day of each frequency (MON: one record per month)
+freq_records = {'10MIN':144,'01H':24,'03H':8,'DAY':1}
+
+# Variables aggregated with sum instead of mean
+varnames_sum = ['RAIN']
 
 def main():
 
@@ -58,6 +63,9 @@ def main():
     datelist = datelist[:-1]
 
 
+    # One task per (variable, run, month) on a shared pool; 10-minute inputs
+    # are the most expensive to aggregate
+    tasks = []
     for varn in varnames:
         for wrun in cfg.wruns:
 
@@ -66,104 +74,192 @@ def main():
             if not os.path.exists(fullpathout):
                 os.makedirs(fullpathout)
 
+            if varn in varnames_hfreq:
+                freq_in = '10MIN'
+            elif varn in varnames_mfreq:
+                freq_in = '01H'
+            else:
+                freq_in = '03H'
 
+            tasks += [(freq_cost[freq_in],create_freq_files_from_pp,(fullpathin,fullpathout,yearmonth,patt_inst,varn,freq_in)) for yearmonth in datelist]
 
-            for freq in frequencies:
-
-                if freq == '10MIN':
-                    if varn in varnames_hfreq:
-                        patt="%s_%s"%(patt_inst,'10MIN')
-                        Parallel(n_jobs=njobs)(delayed(create_10min_files_from_pp)(fullpathin,fullpathout,yearmonth,patt_inst,varn) for yearmonth in datelist)
-
-                if freq == '01H':
-                    if varn in varnames_hfreq:
-                        patt="%s_%s"%(patt_inst,'10MIN')
-                        Parallel(n_jobs=njobs)(delayed(create_hourly_files)(fullpathout,yearmonth,patt,varn) for yearmonth in datelist)
-
-                    if varn in varnames_mfreq:
-                        patt="%s_%s"%(patt_inst,'01H')
-                        Parallel(n_jobs=njobs)(delayed(create_hourly_files_from_pp)(fullpathin,fullpathout,yearmonth,patt_inst,varn) for yearmonth in datelist)
-
-                if freq == '03H':
-
-                    if varn in varnames_lfreq:
-                        patt="%s_%s"%(patt_inst,'03H')
-                        Parallel(n_jobs=njobs)(delayed(create_3hourly_files_from_pp)(fullpathin,fullpathout,yearmonth,patt_inst,varn) for yearmonth in datelist)
-
-
-                if freq == 'DAY':
-                    patt="%s_%s"%(patt_inst,'01H')
-                    Parallel(n_jobs=njobs)(delayed(create_daily_files)(fullpathout,yearmonth,patt,varn) for yearmonth in datelist)
-
-                if freq == 'MON':
-                    patt="%s_%s"%(patt_inst,'DAY')
-                    Parallel(n_jobs=njobs)(delayed(create_monthly_files)(fullpathout,yearmonth,patt,varn) for yearmonth in datelist)
+    run_task_graph(tasks,cfg.njobs)
 
 ###########################################################
 ###########################################################
 
-def create_10min_files_from_pp(fullpathin,fullpathout,yearmonth,patt_inst,varn):
-
-    """Create 10min files from original postprocessed"""
-
-    fin = f'{fullpathin}/{patt_inst}_{varn}_{yearmonth}*'
-    fout = f'{fullpathout}/{patt_inst}_10MIN_{varn}_{yearmonth}.nc'
-    print(fin)
-    subprocess.call(f"ncrcat {fin} {fout}",shell=True)
-
-def create_hourly_files_from_pp(fullpathin,fullpathout,yearmonth,patt_inst,varn):
+def create_freq_files_from_pp(fullpathin,fullpathout,yearmonth,patt_inst,varn,freq_in):
+
+    """Create files at the input frequency and all coarser frequencies in
+    a single pass over the daily postprocessed files of a month.
+    Replaces the ncrcat + cdo hour/day/mon chain: each daily file is read
+    once and added to one aggregator per frequency. RAIN is summed, other
+    variables are averaged. Aggregated records are labelled with the start
+    of their interval.
+    """
+
+    filesin = sorted(glob.glob(f'{fullpathin}/{patt_inst}_{varn}_{yearmonth}*'))
+    print(f'{fullpathin}/{patt_inst}_{varn}_{yearmonth}*')
+    if len(filesin) == 0:
+        print(f'No input files for {varn} {yearmonth}')
+        return
+
+    how = 'sum' if varn in varnames_sum else 'mean'
+    freqs_out = [freq for freq in ['10MIN','01H','03H','DAY','MON'] if freq in frequencies or freq == freq_in]
+    freqs_out = freqs_out[freqs_out.index(freq_in):]
+
+    aggregators = []
+    fref = nc.Dataset(filesin[0])
+    year, month = [int(n) for n in yearmonth.split('-')]
+    ndays = calendar.monthrange(year,month)[1]
+    for freq in freqs_out:
+        fout = f'{fullpathout}/{patt_inst}_{freq}_{varn}_{yearmonth}.nc'
+        print("Output: ", fout)
+        # Same chunk layout and compression as the postprocessed files
+        nrec = 1 if freq == 'MON' else ndays*freq_records[freq]
+        writeopts = nc_write_options((nrec,) + fref.variables[varn].shape[1:],cfg.nc_layout,
+                                     cfg.nc_complevel,cfg.nc_shuffle,cfg.nc_lsd,cfg.nc_tile)
+        writer = FreqFileWriter(fout,fref,varn,writeopts)
+        if freq == freq_in:
+            aggregators.append(StreamAggregator(None,how,writer))
+        else:
+            aggregators.append(StreamAggregator(freq_keys[freq],how,writer))
+    fref.close()
+
+    for fin_name in filesin:
+        print("Input: ", fin_name)
+        fin = nc.Dataset(fin_name)
+        times = nc.num2date(fin.variables['time'][:],units=fin.variables['time'].units,calendar='standard',only_use_cftime_datetimes=False)
+        times = np.asarray(times,dtype='datetime64[s]')
+        values = fin.variables[varn][:]
+        fin.close()
+
+        for aggregator in aggregators:
+            aggregator.add(times,values)
+
+    for aggregator in aggregators:
+        aggregator.close()
 
-    """Create hourly files from original postprocessed"""
-
-    fin = f'{fullpathin}/{patt_inst}_{varn}_{yearmonth}*'
-    fout = f'{fullpathout}/{patt_inst}_01H_{varn}_{yearmonth}.nc'
-    print(fin)
-    subprocess.call(f"ncrcat {fin} {fout}",shell=True)
-
-def create_hourly_files(fullpathout,yearmonth,patt,varn):
-
-    """Create hourly files from 10min files"""
-
-    fin = f'{fullpathout}/{patt}_{varn}_{yearmonth}.nc'
-    fout = fin.replace("10MIN_%s" %(varn),"01H_%s" %(varn))
-    print("Input: ", fin)
-    print("Output: ", fout)
-    if varn == 'RAIN':
-        subprocess.call(f"cdo hoursum {fin} {fout}",shell=True)
-    else:
-        subprocess.call(f"cdo hourmean {fin} {fout}",shell=True)
-
-def create_3hourly_files_from_pp(fullpathin,fullpathout,yearmonth,patt_inst,varn):
-
-    """Create hourly files from original postprocessed"""
-
-    fin = f'{fullpathin}/{patt_inst}_{varn}_{yearmonth}*'
-    fout = f'{fullpathout}/{patt_inst}_03H_{varn}_{yearmonth}.nc'
-    print(fin)
-    subprocess.call(f"ncrcat {fin} {fout}",shell=True)
-
-def create_daily_files(fullpathout,yearmonth,patt,varn):
-    """Create daily files from hourly files"""
-
-    fin = f'{fullpathout}/{patt}_{varn}_{yearmonth}.nc'
-    fout = fin.replace("01H_%s" %(varn),"DAY_%s" %(varn))
-    print("Input: ", fin)
-    print("Output: ", fout)
-    if varn == 'RAIN':
-        subprocess.call(f"cdo daysum {fin} {fout}",shell=True)
-    else:
-        subprocess.call(f"cdo daymean {fin} {fout}",shell=True)
+###########################################################
+###########################################################
 
-def create_monthly_files(fullpathout,yearmonth,patt,varn):
-    """Create monthly files from daily files"""
-    fin = f'{fullpathout}/{patt}_{varn}_{yearmonth}.nc'
-    fout = fin.replace("DAY_%s" %(varn),"MON_%s" %(varn))
-    print("Input: ", fin)
-    print("Output: ", fout)
-    if varn == 'RAIN':
-        subprocess.call(f"cdo monsum {fin} {fout}",shell=True)
-    else:
-        subprocess.call(f"cdo monmean {fin} {fout}",shell=True)
+def _floor_hours(times,nhours):
+    hours = times.astype('datetime64[h]').astype(np.int64)
+    return (hours - hours % nhours).astype('datetime64[h]')
+
+freq_keys = {'01H': lambda times: times.astype('datetime64[h]'),
+             '03H': lambda times: _floor_hours(times,3),
+             'DAY': lambda times: times.astype('datetime64[D]'),
+             'MON': lambda times: times.astype('datetime64[M]')}
+
+
+class StreamAggregator:
+
+    """Aggregate consecutive records sharing the same period key (sum or mean),
+    keeping the last, possibly incomplete, period until the next chunk arrives.
+    With keyfunc=None records are passed through unchanged.
+    Missing values are ignored; periods without valid data are set missing.
+    """
+
+    def __init__(self,keyfunc,how,writer):
+        self.keyfunc = keyfunc
+        self.how = how
+        self.writer = writer
+        self.pending = None
+
+    def add(self,times,values):
+        if self.keyfunc is None:
+            self.writer.append(times,values)
+            return
+
+        valid = ~np.ma.getmaskarray(values)
+        data = np.ma.filled(values.astype(np.float64),0.)
+
+        keys = self.keyfunc(times)
+        starts = np.flatnonzero(np.r_[True,keys[1:] != keys[:-1]])
+        sums = np.add.reduceat(data,starts,axis=0)
+        counts = np.add.reduceat(valid.astype(np.int32),starts,axis=0)
+        gkeys = keys[starts]
+
+        if self.pending is not None:
+            pkey,psum,pcount = self.pending
+            if pkey == gkeys[0]:
+                sums[0] += psum
+                counts[0] += pcount
+            else:
+                self._write(np.asarray([pkey]),psum[None,...],pcount[None,...])
+
+        self._write(gkeys[:-1],sums[:-1],counts[:-1])
+        self.pending = (gkeys[-1],sums[-1],counts[-1])
+
+    def close(self):
+        if self.pending is not None:
+            pkey,psum,pcount = self.pending
+            self._write(np.asarray([pkey]),psum[None,...],pcount[None,...])
+            self.pending = None
+        self.writer.close()
+
+    def _write(self,keys,sums,counts):
+        if len(keys) == 0:
+            return
+        if self.how == 'mean':
+            sums = sums/np.maximum(counts,1)
+        self.writer.append(keys,np.ma.masked_where(counts == 0,sums))
+
+
+class FreqFileWriter:
+
+    """Append records of varn to a netCDF file with the same structure
+    (dimensions, lat/lon, attributes) as the postprocessed file fref.
+    writeopts: createVariable keywords of varn (compute_vars.nc_write_options)"""
+
+    def __init__(self,fout,fref,varn,writeopts):
+        self.outfile = nc.Dataset(fout,'w',format='NETCDF4_CLASSIC')
+        self.varn = varn
+        self.nt = 0
+
+        varref = fref.variables[varn]
+        for dimname in varref.dimensions:
+            if dimname == 'time':
+                self.outfile.createDimension('time',None)
+            else:
+                self.outfile.createDimension(dimname,len(fref.dimensions[dimname]))
+        for dimname in fref.variables['lat'].dimensions:
+            if dimname not in self.outfile.dimensions:
+                self.outfile.createDimension(dimname,len(fref.dimensions[dimname]))
+
+        self.outtime = self.outfile.createVariable('time','d','time',zlib=True,complevel=5,fill_value=varref._FillValue)
+        for att in fref.variables['time'].ncattrs():
+            if att != '_FillValue':
+                setattr(self.outtime,att,fref.variables['time'].getncattr(att))
+
+        for coord in ['lat','lon','levels']:
+            if coord in fref.variables:
+                cref = fref.variables[coord]
+                outcoord = self.outfile.createVariable(coord,'f',cref.dimensions,zlib=True,complevel=5,fill_value=cref._FillValue)
+                for att in cref.ncattrs():
+                    if att != '_FillValue':
+                        setattr(outcoord,att,cref.getncattr(att))
+                outcoord[:] = cref[:]
+
+        self.outvar = self.outfile.createVariable(varn,'f',varref.dimensions,fill_value=varref._FillValue,**writeopts)
+        for att in varref.ncattrs():
+            if att != '_FillValue':
+                setattr(self.outvar,att,varref.getncattr(att))
+
+        setattr(self.outfile,'creation_date',dt.datetime.today().strftime('%Y-%m-%d'))
+        setattr(self.outfile,'author','Daniel Argueso @UIB')
+        setattr(self.outfile,'contact','d.argueso@uib.es')
+
+    def append(self,times,values):
+        nt = len(times)
+        dates = list(np.asarray(times,dtype='datetime64[s]').astype(dt.datetime))
+        self.outtime[self.nt:self.nt+nt] = nc.date2num(dates,units=self.outtime.units,calendar='standard')
+        self.outvar[self.nt:self.nt+nt,...] = values
+        self.nt += nt
+
+    def close(self):
+        self.outfile.close()
 
 ###############################################################################
 ##### __main__  scope
@@ -26,6 +26,7 @@ import epicc_config as cfg
 import argparse
 import dateparser
 from glob import glob
+import quantile_utils as qu
 
 
 ###########################################################
@@ -61,22 +62,34 @@ def main():
     sdate=dateparser.parse(sdatestr)
     edate=dateparser.parse(edatestr)
 
-    filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_????-??.nc'))
-    fin_all = xr.open_mfdataset(filesin,concat_dim="time", combine="nested")
-    fin = fin_all.sel(time=slice(sdate,edate)).squeeze()
+    pattin = f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_????-??.nc'
+    filesin = sorted(glob(pattin))
 
+    # Streaming pass over the monthly files: only the zero counts and the
+    # non-zero (wet) values of each pixel are kept, which gives the exact
+    # quantiles without loading the whole period.
+    qstore = None
+    for filein in filesin:
+        fin = xr.open_dataset(filein)
+        fin_sel = fin[varname].sel(time=slice(sdate,edate))
+        if fin_sel.sizes['time'] > 0:
+            if qstore is None:
+                dims = [dim for dim in fin_sel.dims if dim != 'time' and fin_sel.sizes[dim] > 1]
+                qstore = qu.WetValueStore([fin_sel.sizes[dim] for dim in dims],wet_value if wet == 'wet' else None)
+            qstore.update(fin_sel.values)
+        fin.close()
+
+    if qstore is None:
+        raise FileNotFoundError(f'No records between {sdate} and {edate} in {pattin}')
+
+    qtilesp = xr.DataArray(qstore.quantile(qtiles),name=varname,dims=['quantile']+dims,coords={'quantile':qtiles})
 
     if wet == 'wet':
-        qtilesp = fin[varname].load().where(fin[varname]>wet_value).quantile(qtiles,dim=['time'])
-        qtilesp.to_netcdf(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_{sdate.year}-{eyear.year}-qtiles_wetonly.nc')
+        qtilesp.to_netcdf(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_{sdate.year}-{edate.year}-qtiles_wetonly.nc')
 
     else:
-        qtilesp = fin[varname].load().quantile(qtiles,dim=['time'])
         qtilesp.to_netcdf(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_{sdate.year}-{edate.year}-qtiles.nc')
 
-    fin_all.close()
-    qtilesp.close()
-
     # for season in ['DJF','MAM','JJA','SON']:
     #     filesin_seas = sel_files_season(filesin,season)
     #     fin_all_seas = xr.open_mfdataset(filesin_seas,concat_dim="time", combine="nested")
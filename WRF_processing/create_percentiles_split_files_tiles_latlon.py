@@ -24,6 +24,8 @@ import epicc_config as cfg
 from glob import glob
 from itertools import product
 from joblib import Parallel, delayed
+import tile_store as tstore
+import quantile_utils as qu
 
 wrf_runs = ['EPICC_2km_ERA5_HVC_GWD','EPICC_2km_ERA5_CMIP6anom_HVC_GWD']
 qtiles = np.asarray(cfg.qtiles)
@@ -38,18 +40,11 @@ def main():
     """ Calculating percentiles using a loop"""
     for wrun in wrf_runs:
 
-        filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_10MIN_RAIN_20??-??.nc'))
-        files_ref = xr.open_dataset(filesin[0])
-        nlats = files_ref.sizes['y']
-        nlons = files_ref.sizes['x']
-
-        lonsteps = [f'{nn:03d}' for nn in range(nlons//tile_size+1)]
-        latsteps = [f'{nn:03d}' for nn in range(nlats//tile_size+1)]
-
-        xytiles=list(product(latsteps, lonsteps))
-
-        filespath = f'{cfg.path_in}/{wrun}/split_files_tiles_50/{cfg.patt_in}_10MIN_RAIN_20??-??'
-        print(f'Ej: {filespath}_000y-000x.nc')
+        filespath = tstore.tile_store_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,'10MIN','RAIN',tile_size)
+        print(f'Tile store: {filespath}')
+        store = tstore.TileStore(filespath)
+        xytiles = store.tile_ids()
+        store.close()
 
 
         Parallel(n_jobs=20)(delayed(calc_percentile)(filespath,xytile[0],xytile[1],qtiles,wrun,mode) for xytile in xytiles)
@@ -62,42 +57,43 @@ def main():
 
 def calc_percentile(filespath,ny,nx,qtiles,wrun,mode='wetonly'):
   print (f'Analyzing tile y: {ny} x: {nx}')
-  filesin = sorted(glob(f'{filespath}_{ny}y-{nx}x.nc'))
-
-  if len(filesin)==1:
-    fin = xr.open_dataset(filesin[0]).load()
-  else:
-    fin = xr.open_mfdataset(filesin,concat_dim="time", combine="nested").load().sel(time=slice(str(cfg.syear),str(cfg.eyear)))
-
-  for fq in ['10MIN','01H','DAY']:
-    if fq=='10MIN':
-      fin_freq = fin
-    elif fq=='01H':
-      fin_freq = fin.resample(time=f"1H").sum('time')
-    elif fq=='DAY':
-      fin_freq = fin.resample(time=f"D").sum('time')
-
+  store = tstore.TileStore(filespath)
+  wet_th = wet_value if mode == 'wetonly' else None
+  freqs = {'10MIN':None,'01H':'1H','DAY':'D'}
+  seasons = ['DJF','MAM','JJA','SON']
+
+  # Single streaming pass over the tile, one month at a time. Exact quantiles
+  # only need the zero counts and the non-zero (wet) values of each pixel,
+  # which are kept in one store partitioned by frequency and season, so the
+  # annual and seasonal quantiles of all frequencies come from a single sort.
+  qstore = None
+  for fin in store.iter_tile('RAIN',ny,nx,str(cfg.syear),str(cfg.eyear)):
+    if qstore is None:
+      qstore = qu.WetValueStore(fin.RAIN.shape[1:],wet_th,nlabels=len(freqs)*len(seasons))
+    ns = seasons.index(str(fin.time.dt.season.values[0]))
+    for nf,rfreq in enumerate(freqs.values()):
+      if rfreq is None:
+        fin_freq = fin
+      else:
+        fin_freq = fin.resample(time=rfreq).sum('time')
+      qstore.update(fin_freq.RAIN.values,label=nf*len(seasons)+ns)
+  store.close()
 
+  for nf,fq in enumerate(freqs.keys()):
 
     #Year
-    if mode == 'wetonly':
-      ptiles = fin_freq.RAIN.where(fin_freq.RAIN>wet_value).quantile(qtiles,dim=['time'])
-    else:
-      ptiles = fin_freq.RAIN.quantile(qtiles,dim=['time'])
+    flabels = [nf*len(seasons)+ns for ns in range(len(seasons))]
+    ptiles = xr.DataArray(qstore.quantile(qtiles,flabels),name='RAIN',dims=['quantile','y','x'],coords={'quantile':qtiles})
     fout = f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{fq}_RAIN_{cfg.syear}-{cfg.eyear}_{ny}y-{nx}x_qtiles_{mode}.nc'
     ptiles.to_netcdf(fout)
 
 
     #Season
-    for ns,season in enumerate(['DJF','MAM','JJA','SON']):
-      if mode == 'wetonly':
-        ptiles = fin_freq.RAIN.where(fin_freq.RAIN>wet_value).groupby('time.season').quantile(qtiles,dim=['time']).sel(season=season)
-      else:
-        ptiles = fin_freq.RAIN.groupby('time.season').quantile(qtiles,dim=['time']).sel(season=season)
+    for ns,season in enumerate(seasons):
+      ptiles = xr.DataArray(qstore.quantile(qtiles,flabels[ns]),name='RAIN',dims=['quantile','y','x'],coords={'quantile':qtiles,'season':season})
       fout = f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{fq}_RAIN_{cfg.syear}-{cfg.eyear}_{ny}y-{nx}x_qtiles_{mode}_{season}.nc'
       ptiles.to_netcdf(fout)
 
-  fin.close()
 ###############################################################################
 ##### __main__  scope
 ###############################################################################
@@ -70,7 +70,7 @@ def main():
 
     print(f'Processing dates: {args.sdatestr} to {args.edatestr}')
 
-    Parallel(n_jobs=12)(delayed(compute_stat_cdo)(fin,stat) for fin in filesin)
+    Parallel(n_jobs=cfg.njobs)(delayed(compute_stat_cdo)(fin,stat) for fin in filesin)
 
     files_all_stat = sorted(glob(f'{cfg.path_unif}/{wrun}/{cfg.institution}_{freq}_{varname}_????-??-{stat}.nc'))
     files_stat = sel_files(files_all_stat,sdate.year,edate.year)
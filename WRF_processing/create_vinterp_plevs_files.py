@@ -36,7 +36,7 @@ from wrf_utils import wrftime2date, sel_wrfout_files
 import wrf_utils as wrfu
 import calendar
 
-from joblib import Parallel, delayed
+from task_graph import run_task_graph
 #import epicc_config as cfg
 import EPICC_post_config as cfg
 
@@ -63,41 +63,55 @@ patt = "UIB"
 patt_wrf = "wrf3hrly"
 dom = "d01"
 patt_inst = f"UIB_{cfg.plevs[0]}hPa"
+nthreads = 2  # Threads of the vertical interpolation within each day
+# Sidecar files of the interpolation brackets (tens of MB per day). All the
+# variables of a day already share the brackets in memory, so they only
+# help reruns: set e.g. path_proc + "/vinterp" to enable them
+cachepath = None
 
 ###########################################################
 ###########################################################
 
+# All the (run, day) tasks go to a single pool, with no barrier between runs
+# or years. All variables of a day share the pressure-level brackets.
+tasks = []
 for wrun in WRF_runs:
-    for syear in periods:
-        eyear = syear
-        fullpathin = path_in + "/" + wrun + "/out"
-        fullpathout = path_out + "/" + wrun  + "/"
+    fullpathin = path_in + "/" + wrun + "/out"
+    fullpathout = path_out + "/" + wrun  + "/"
 
-        if not os.path.exists(fullpathout):
-            os.makedirs(fullpathout)
+    if not os.path.exists(fullpathout):
+        os.makedirs(fullpathout)
 
+    for syear in periods:
+        eyear = syear
         # Parallel(n_jobs=numvar)(delayed(wrfu.plevs_interp)(path_in,path_out,path_geo,syear,eyear,smonth,emonth,plevs,patt,patt_wrf,dom,wrun,varn) for varn in varnames)
-        for varn in varnames:
-            d1 = dt.datetime(int(syear), smonth, 1)
-            d2 = dt.datetime(
-                int(eyear), emonth, calendar.monthrange(int(eyear), emonth)[1]
-            ) + dt.timedelta(days=1)
-            total_hours = (d2 - d1).days * 24 + (d2 - d1).seconds // 3600.0
-            total_days = (d2 - d1).days
-            date_list = [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
-
-            Parallel(n_jobs=10)(
-                delayed(wrfu.plevs_interp_byday)(
-                    fullpathin,
-                    fullpathout,
-                    cfg.geofile_ref,
-                    date,
-                    plevs,
-                    patt,
-                    patt_wrf,
-                    dom,
-                    wrun,
-                    varn,
+        d1 = dt.datetime(int(syear), smonth, 1)
+        d2 = dt.datetime(
+            int(eyear), emonth, calendar.monthrange(int(eyear), emonth)[1]
+        ) + dt.timedelta(days=1)
+        total_days = (d2 - d1).days
+        date_list = [d1 + dt.timedelta(days=x) for x in range(0, total_days)]
+
+        for date in date_list:
+            tasks.append(
+                (
+                    1,
+                    wrfu.plevs_interp_byday,
+                    (
+                        fullpathin,
+                        fullpathout,
+                        cfg.geofile_ref,
+                        date,
+                        plevs,
+                        patt,
+                        patt_wrf,
+                        dom,
+                        wrun,
+                        varnames,
+                        nthreads,
+                        cachepath,
+                    ),
                 )
-                for date in date_list
             )
+
+run_task_graph(tasks, cfg.njobs)
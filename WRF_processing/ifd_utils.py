@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T11:02:14+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T11:02:18+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Vectorized kernels for the Intensity-Frequency-Duration (IFD)
+# histograms calculated from tiles of 10-minute rainfall.
+# They work on whole (time, y, x) blocks instead of looping over pixels
+# with pandas.
+#
+# Dependencies: numpy
+#
+# Files:
+#
+#####################################################################
+"""
+
+import numpy as np
+
+
+###########################################################
+###########################################################
+
+
+def spell_runs(rain):
+    """Run-length encoding of wet and dry spells along time
+    rain: array (time, npix)
+    A spell is a run of consecutive records that are all non-zero (wet)
+    or all zero (dry), as in the former pandas shift/cumsum/groupby approach.
+    Output: pixel index, end time index, duration (number of records) and
+    total rainfall of every spell, ordered by pixel and time.
+    """
+    nt, npix = rain.shape
+    rain_t = np.ascontiguousarray(np.asarray(rain).T)
+    wet = rain_t != 0
+
+    change = np.ones((npix, nt), dtype=bool)
+    change[:, 1:] = wet[:, 1:] != wet[:, :-1]
+    starts = np.flatnonzero(change)
+
+    duration = np.diff(np.append(starts, npix * nt))
+    total = np.add.reduceat(np.nan_to_num(rain_t).ravel(), starts)
+    pixel = starts // nt
+    tend = starts % nt + duration - 1
+
+    return pixel, tend, duration, total
+
+
+def run_lengths(wet):
+    """Length of the wet spell each record belongs to (0 for dry records)
+    wet: boolean array (time, npix)
+    """
+    nt, npix = wet.shape
+    wet_t = np.ascontiguousarray(wet.T)
+
+    change = np.ones((npix, nt), dtype=bool)
+    change[:, 1:] = wet_t[:, 1:] != wet_t[:, :-1]
+    starts = np.flatnonzero(change)
+    duration = np.diff(np.append(starts, npix * nt))
+
+    runlen = np.repeat(duration, duration).reshape(npix, nt)
+    runlen[~wet_t] = 0
+
+    return runlen.T
+
+
+def bin_index(values, edges):
+    """Bin of each value following numpy.histogram conventions
+    (left-closed bins, last bin also right-closed). -1 if outside."""
+    nbins = len(edges) - 1
+    idx = np.searchsorted(edges, values, side="right") - 1
+    idx[values == edges[-1]] = nbins - 1
+    idx[(idx < 0) | (idx >= nbins)] = -1
+    return idx
+
+
+def hist2d_runs(pixel, duration, total, npix, dbins, ibins):
+    """2D (duration, intensity) histogram of spells for each pixel
+    Output: array (npix, len(dbins)-1, len(ibins)-1)
+    """
+    nd = len(dbins) - 1
+    ni = len(ibins) - 1
+    di = bin_index(duration, dbins)
+    ii = bin_index(total, ibins)
+    valid = (di >= 0) & (ii >= 0)
+
+    flat = (pixel[valid] * nd + di[valid]) * ni + ii[valid]
+    hist = np.bincount(flat, minlength=npix * nd * ni)
+
+    return hist.reshape(npix, nd, ni)
+
+
+def spell_hist2d(rain, dbins, ibins, max_elements=2**27):
+    """2D histogram of spell duration and spell total for all pixels
+    rain: array (time, y, x)
+    Rows are processed in blocks of at most max_elements values to bound
+    memory. Output: array (y, x, len(dbins)-1, len(ibins)-1)
+    """
+    nt, ny, nx = rain.shape
+    hist = np.zeros((ny, nx, len(dbins) - 1, len(ibins) - 1), dtype=np.int64)
+    rows = max(1, max_elements // (nt * nx))
+
+    for y0 in range(0, ny, rows):
+        y1 = min(y0 + rows, ny)
+        block = rain[:, y0:y1, :].reshape(nt, -1)
+        pixel, tend, duration, total = spell_runs(block)
+        hist[y0:y1] = hist2d_runs(
+            pixel, duration, total, block.shape[1], dbins, ibins
+        ).reshape(y1 - y0, nx, len(dbins) - 1, len(ibins) - 1)
+
+    return hist
+
+
+def spell_arrays(rain):
+    """Duration and total of each spell placed at its last record
+    rain: array (time, y, x)
+    Output: spell (int32, 0 where no spell ends) and intensity (NaN where
+    no spell ends), both (time, y, x)
+    """
+    nt, ny, nx = rain.shape
+    pixel, tend, duration, total = spell_runs(rain.reshape(nt, -1))
+
+    spell = np.zeros((nt, ny * nx), dtype=np.int32)
+    intensity = np.full((nt, ny * nx), np.nan)
+    spell[tend, pixel] = duration
+    intensity[tend, pixel] = total
+
+    return spell.reshape(nt, ny, nx), intensity.reshape(nt, ny, nx)
+
+
+def window_hist2d(rain, durations, ibins, in_events=False, max_elements=2**27):
+    """2D histogram of rainfall accumulated over moving windows
+    rain: array (time, y, x)
+    The totals over windows of every length in durations (number of records)
+    are differences of a single cumulative sum along time, so each pixel
+    block is summed only once. If in_events, only windows ending in a wet
+    record of a spell at least as long as the window are counted.
+    Rows are processed in blocks of at most max_elements values.
+    Output: array (len(durations), len(ibins)-1, y, x)
+    """
+    nt, ny, nx = rain.shape
+    nd = len(durations)
+    ni = len(ibins) - 1
+    hist = np.zeros((nd, ni, ny, nx), dtype=np.int64)
+    rows = max(1, max_elements // ((nt + 1) * nx))
+
+    for y0 in range(0, ny, rows):
+        y1 = min(y0 + rows, ny)
+        block = rain[:, y0:y1, :].reshape(nt, -1)
+        npix = block.shape[1]
+
+        csum = np.zeros((nt + 1, npix))
+        np.cumsum(np.nan_to_num(block), axis=0, out=csum[1:])
+        if in_events:
+            runlen = run_lengths(block != 0)
+
+        for idur, dur in enumerate(durations):
+            if dur > nt:
+                break
+            # totals[t] is the sum over records t ... t+dur-1
+            totals = csum[dur:] - csum[:-dur]
+            valid = totals >= ibins[0]
+            if in_events:
+                valid &= runlen[dur - 1 :] >= dur
+            tidx, pixel = np.nonzero(valid)
+
+            ii = bin_index(totals[tidx, pixel], ibins)
+            ok = ii >= 0
+            counts = np.bincount(ii[ok] * npix + pixel[ok], minlength=ni * npix)
+            hist[idur, :, y0:y1] = counts.reshape(ni, y1 - y0, nx)
+
+    return hist
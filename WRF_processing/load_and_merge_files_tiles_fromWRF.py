@@ -18,17 +18,17 @@
 #####################################################################
 """
 
-import xarray as xr
-import numpy as np
+import os
 from glob import glob
+import mosaic
 
+import EPICC_post_config as cfg
 
-pathin = '/vg5/dargueso/postprocessed/EPICC/temp/EPICC_2km_ERA5'
-nproc_x = 12
-nproc_y = 48
+
+wrun = 'EPICC_2km_ERA5'
+pathin = f'/vg5/dargueso/postprocessed/EPICC/temp/{wrun}'
 var = 'HGT'
-dim_x = "west_east"
-dim_y = "south_north"
+njobs = 4
 
 
 ###########################################################
@@ -38,19 +38,22 @@ def main():
 
     """  Split files into tiles """
 
-    filespath = f'{pathin}/UIB_HGT_2010-12-22'
-
-    latlongrid = []
-    for ytile in range(nproc_y):
-        print(ytile,ytile*nproc_x)
-        latlongrid.append([f'{filespath}_{(ytile*nproc_x+xtile):04d}.nc' for xtile in range(nproc_x)])
+    sdate = '2010-12-22'
+    filespath = f'{pathin}/UIB_HGT_{sdate}'
 
-    # latlongrid = []
-    # latlongrid.append([f'{filespath}_{ntile:04d}.nc' for ntile in range(nproc_x*nproc_y)])
-
-    fin_all = xr.open_mfdataset(latlongrid,combine='nested',concat_dim=["y", "x"]).load()
+    # Patch positions from the WRF patch metadata (in the patch files or in
+    # the original WRF patch files of the same day and patch number)
+    filesin = sorted(glob(f'{filespath}_????.nc'))
+    reffiles = [ref_patch_file(wrun, sdate, int(os.path.basename(filein)[-7:-3])) for filein in filesin]
+    placements, shape = mosaic.wrf_patch_placements(filesin,reffiles)
     print(f'Output file: {filespath}.nc')
-    fin_all.to_netcdf(f'{filespath}.nc')
+    mosaic.write_mosaic(placements,f'{filespath}.nc',shape,njobs=njobs)
+
+def ref_patch_file(wrun, sdate, ntile):
+    """First WRF patch file ({path_wrfo}/{wrun}/*_{dom}_{sdate}*_{ntile:04d})
+    of a given day and patch number, None if there is none"""
+    reffiles = sorted(glob(f"{cfg.path_wrfo}/{wrun}/*_{cfg.dom}_{sdate}*_{ntile:04d}"))
+    return reffiles[0] if reffiles else None
 
 ###############################################################################
 ##### __main__  scope
@@ -18,14 +18,14 @@
 #####################################################################
 """
 
-import xarray as xr
-import numpy as np
 import epicc_config as cfg
-from glob import glob
+import tile_store as tstore
+import mosaic
 
 # wrun = cfg.wrf_runs[0]
 wrun = 'EPICC_2km_ERA5_CMIP6anom_HVC_GWD'
 tile_size = 50
+njobs = 4
 
 # #filespath = f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_RAIN_2013-2020'
 # filespath = f'{cfg.path_in}/{wrun}/ptiles_tiles_50/UIB_10MIN_RAIN_2013-2020'
@@ -42,20 +42,13 @@ def main():
     filespath = f'{cfg.path_in}/{wrun}/hist2d_spell_sumevents_IFD_2013-2020'
 
     filessuffix = f''
-    filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_10MIN_RAIN_20??-??.nc'))
-    files_ref = xr.open_dataset(filesin[0])
-    nlats = files_ref.sizes['y']
-    nlons = files_ref.sizes['x']
-
-    latlongrid = []
-    for nnlat in range(nlats//tile_size+1):
-      print(nnlat)
-      latlongrid.append([f'{filespath}_{nnlat:03d}y-{nnlon:03d}x{filessuffix}.nc' for nnlon in range(nlons//tile_size+1)])
-    fin_all = xr.open_mfdataset(latlongrid,combine='nested',concat_dim=["y", "x"]).load()
-    print(f'Ej: {filespath}_000y-000x{filessuffix}.nc')
-    fout = latlongrid[0][0].replace("_000y-000x",f'')
+    # Tile layout from the tile store the tiles were computed from
+    storefile = tstore.tile_store_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,'10MIN','RAIN',tile_size)
+    placements, shape = mosaic.latlon_tile_placements(filespath,filessuffix,storefile)
+    print(f'Ej: {placements[0][0]}')
+    fout = f'{filespath}{filessuffix}.nc'
     print(f'Output file: {fout}')
-    fin_all.to_netcdf(fout)
+    mosaic.write_mosaic(placements,fout,shape,njobs=njobs)
 
 ###############################################################################
 ##### __main__  scope
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T15:31:52+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T15:31:55+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Manifest of postprocessed outputs for incremental runs.
+# Each output file is recorded in an SQLite database together with the
+# modification times and sizes of the input files it was computed from and
+# the version of the variable definition. An output is up to date if it
+# still exists unchanged, its inputs have not changed and the variable
+# definition is the same, so drivers can skip it when re-run.
+# SQLite relies on POSIX file locks to serialize the writes of the worker
+# processes: manifest_file must sit on a filesystem where they work (a local
+# disk, not a parallel filesystem such as Lustre or NFS without lockd).
+#
+# Dependencies: sqlite3
+#
+# Files:
+#
+#####################################################################
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+###########################################################
+###########################################################
+
+
+def file_signature(filenames):
+    """Path, modification time (ns) and size of a list of files"""
+    signature = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        signature.append([os.path.abspath(filename), stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+class Manifest:
+    """SQLite manifest of the outputs of a postprocessing driver.
+    A connection is opened for each query, so the same manifest can be used
+    from several worker processes. The table is created once with create(),
+    before the workers start."""
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+
+    def create(self):
+        """Create the table of outputs if it does not exist yet"""
+        con = self._connect()
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            "output TEXT PRIMARY KEY, "
+            "output_mtime INTEGER, "
+            "output_size INTEGER, "
+            "inputs TEXT, "
+            "version TEXT, "
+            "created REAL)"
+        )
+        con.commit()
+        con.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.dbfile, timeout=300)
+
+    def is_current(self, output, inputs, version):
+        """Whether output exists, is unchanged since it was recorded and was
+        computed from the same inputs (mtime and size) and variable version"""
+        if not os.path.isfile(output):
+            return False
+        con = self._connect()
+        row = con.execute(
+            "SELECT output_mtime, output_size, inputs, version FROM outputs WHERE output=?",
+            (os.path.abspath(output),),
+        ).fetchone()
+        con.close()
+        if row is None:
+            return False
+        stat = os.stat(output)
+        return row == (
+            stat.st_mtime_ns,
+            stat.st_size,
+            json.dumps(file_signature(inputs)),
+            version,
+        )
+
+    def record(self, output, inputs, version):
+        """Record an output that has just been written"""
+        stat = os.stat(output)
+        con = self._connect()
+        con.execute(
+            "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(output),
+                stat.st_mtime_ns,
+                stat.st_size,
+                json.dumps(file_signature(inputs)),
+                version,
+                time.time(),
+            ),
+        )
+        con.commit()
+        con.close()
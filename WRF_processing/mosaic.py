@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T14:22:08+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T14:22:11+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Merge of tile files (lat-lon tiles of a tile store or WRF
+# processor patches) into a single full-domain file.
+# The output variables are created on disk first and each tile is copied
+# into its hyperslab, so only a few tiles are in memory at any time. Tiles
+# can be read by several worker processes while the main process writes.
+# The position of each tile is taken from metadata (tile store attributes
+# or WRF patch start indices), not from the file names.
+#
+# Dependencies: joblib, netCDF4
+#
+# Files:
+#
+#####################################################################
+"""
+
+import datetime as dt
+import math
+import netCDF4 as nc
+import os
+from joblib import Parallel, delayed
+
+import tile_store as tstore
+
+
+###########################################################
+###########################################################
+
+
+def latlon_tile_placements(filespath, filessuffix, storefile):
+    """Position of the files of each lat-lon tile ({filespath}_{ny}y-{nx}x{filessuffix}.nc)
+    from the layout of the tile store they were computed from.
+    Output: list of (filename, y0, x0) and shape of the full domain"""
+    store = tstore.TileStore(storefile)
+    placements = []
+    for ny, nx in store.tile_ids():
+        ys, xs = store.tile_bounds(ny, nx)
+        placements.append((f"{filespath}_{ny}y-{nx}x{filessuffix}.nc", ys.start, xs.start))
+    shape = (store.ny, store.nx)
+    store.close()
+    return placements, shape
+
+
+def wrf_patch_placements(filesin, reffiles=None):
+    """Position of WRF processor patch files (io_form=102) from their
+    SOUTH-NORTH/WEST-EAST_PATCH_START_UNSTAG attributes. If a file does not
+    have them, they are read from the corresponding file in reffiles (e.g.
+    the original wrfout patch; None where there is no reference file).
+    Output: list of (filename, y0, x0) and shape of the full domain"""
+    placements = []
+    shape = None
+    for n, filename in enumerate(filesin):
+        fin = nc.Dataset(filename)
+        attrs = fin.ncattrs()
+        if (
+            "SOUTH-NORTH_PATCH_START_UNSTAG" not in attrs
+            and reffiles is not None
+            and reffiles[n] is not None
+        ):
+            fin.close()
+            fin = nc.Dataset(reffiles[n])
+            attrs = fin.ncattrs()
+        if "SOUTH-NORTH_PATCH_START_UNSTAG" not in attrs:
+            fin.close()
+            raise ValueError(f"No patch metadata found for {filename}")
+        y0 = int(fin.getncattr("SOUTH-NORTH_PATCH_START_UNSTAG")) - 1
+        x0 = int(fin.getncattr("WEST-EAST_PATCH_START_UNSTAG")) - 1
+        shape = (
+            int(fin.getncattr("SOUTH-NORTH_GRID_DIMENSION")) - 1,
+            int(fin.getncattr("WEST-EAST_GRID_DIMENSION")) - 1,
+        )
+        fin.close()
+        placements.append((filename, y0, x0))
+    return placements, shape
+
+
+###########################################################
+###########################################################
+
+
+def read_tile(filename, ydim="y", xdim="x"):
+    """Values of all the variables of a tile that have both spatial dims
+    (None if the file does not exist)"""
+    if not os.path.isfile(filename):
+        return None
+    fin = nc.Dataset(filename)
+    fin.set_auto_mask(False)
+    tile = {
+        varname: var[:]
+        for varname, var in fin.variables.items()
+        if ydim in var.dimensions and xdim in var.dimensions
+    }
+    fin.close()
+    return tile
+
+
+def hyperslab(dims, ys, xs, ydim="y", xdim="x"):
+    """Index of a tile block in a variable with dimensions dims"""
+    return tuple(
+        ys if dim == ydim else xs if dim == xdim else slice(None) for dim in dims
+    )
+
+
+def tile_chunks(placements, shape):
+    """Spatial chunk shape (cy, cx) aligned with the tile boundaries, so each
+    tile is written to whole chunks and no compressed chunk is read back and
+    rewritten by the next tile. Along each axis this is the greatest common
+    divisor of the tile starts. When tiles are uneven (e.g. WRF patches of 104
+    and 105 columns) the divisor is too small to be useful, and the smallest
+    tile is used instead, so that a tile spans two chunks at most."""
+    chunks = []
+    for n, size in zip((1, 2), shape):
+        starts = sorted(set(placement[n] for placement in placements))
+        extents = [e - s for s, e in zip(starts[:-1], starts[1:])]
+        if not extents:
+            chunks.append(size)
+            continue
+        divisor = 0
+        for start in starts:
+            divisor = math.gcd(divisor, start)
+        smallest = min(extents)
+        chunks.append(min(size, divisor if 4 * divisor >= smallest else smallest))
+    return tuple(chunks)
+
+
+def write_mosaic(
+    placements, fout, shape, njobs=1, ydim="y", xdim="x", complevel=5, chunks=None
+):
+    """Merge tile files into fout
+    placements: list of (filename, y0, x0)
+    shape: (ny, nx) of the full domain
+    chunks: spatial chunk shape (cy, cx) of the output [default: tile_chunks]
+    Tiles are read by njobs workers in batches and copied into the output
+    hyperslabs by the main process, so memory use is 2*njobs tiles at most.
+    Tiles that are not found are left as missing values."""
+    ny, nx = shape
+    if chunks is None:
+        chunks = tile_chunks(placements, shape)
+    cy, cx = chunks
+    fref = next((f for f, y0, x0 in placements if os.path.isfile(f)), None)
+    if fref is None:
+        raise FileNotFoundError(
+            "None of the tiles exist: " + ", ".join(f for f, y0, x0 in placements)
+        )
+    fref = nc.Dataset(fref)
+
+    outfile = nc.Dataset(fout, "w", format="NETCDF4")
+    for dim in fref.dimensions.values():
+        if dim.name == ydim:
+            outfile.createDimension(ydim, ny)
+        elif dim.name == xdim:
+            outfile.createDimension(xdim, nx)
+        else:
+            outfile.createDimension(dim.name, None if dim.isunlimited() else len(dim))
+
+    spatial = []
+    for varname, var in fref.variables.items():
+        is_spatial = ydim in var.dimensions and xdim in var.dimensions
+        varchunks = None
+        if is_spatial:
+            varchunks = [
+                min(cy, ny) if dim == ydim
+                else min(cx, nx) if dim == xdim
+                else max(1, len(fref.dimensions[dim]))
+                for dim in var.dimensions
+            ]
+        outvar = outfile.createVariable(
+            varname,
+            var.dtype,
+            var.dimensions,
+            zlib=is_spatial,
+            complevel=complevel,
+            chunksizes=varchunks,
+            fill_value=getattr(var, "_FillValue", None),
+        )
+        for att in var.ncattrs():
+            if att != "_FillValue":
+                setattr(outvar, att, var.getncattr(att))
+        if is_spatial:
+            # Room for three rows of chunks over the full width, so chunks
+            # shared by uneven tiles stay in memory until the neighbouring
+            # tiles are written and are compressed only once
+            chunkbytes = var.dtype.itemsize * math.prod(varchunks)
+            outvar.set_var_chunk_cache(size=3 * -(-nx // cx) * chunkbytes)
+            spatial.append(varname)
+        else:
+            outvar[:] = var[:]
+
+    for att in fref.ncattrs():
+        if not att.endswith("_PATCH_START_UNSTAG") and not att.endswith("_PATCH_END_UNSTAG"):
+            setattr(outfile, att, fref.getncattr(att))
+    setattr(outfile, "creation_date", dt.datetime.today().strftime("%Y-%m-%d"))
+    fref.close()
+
+    nbatch = max(1, njobs) * 2
+    for nb in range(0, len(placements), nbatch):
+        batch = placements[nb : nb + nbatch]
+        tiles = Parallel(n_jobs=njobs)(
+            delayed(read_tile)(filename, ydim, xdim) for filename, y0, x0 in batch
+        )
+        for (filename, y0, x0), tile in zip(batch, tiles):
+            if tile is None:
+                print(f"Missing tile: {filename}")
+                continue
+            print(f"{filename} -> y: {y0} x: {x0}")
+            for varname in spatial:
+                values = tile[varname]
+                var = outfile.variables[varname]
+                tys = slice(y0, y0 + values.shape[var.dimensions.index(ydim)])
+                txs = slice(x0, x0 + values.shape[var.dimensions.index(xdim)])
+                var[hyperslab(var.dimensions, tys, txs, ydim, xdim)] = values
+
+    outfile.close()
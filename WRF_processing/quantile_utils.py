@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T12:20:41+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T12:20:45+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Exact percentiles of long, zero-inflated rainfall records
+# computed in a single streaming pass (e.g. over monthly files or chunks of
+# a tile store). Each pixel keeps a count of its zeros and the list of its
+# non-zero (or wet) values, so memory scales with the number of wet records
+# instead of the length of the record. Quantiles follow the linear
+# interpolation of numpy/xarray .quantile, skipping missing values.
+#
+# Dependencies: numpy
+#
+# Files:
+#
+#####################################################################
+"""
+
+import numpy as np
+
+
+###########################################################
+###########################################################
+
+
+class WetValueStore:
+    """Streaming store of the values of a field for exact quantiles
+
+    shape: spatial shape of the field (e.g. (ny, nx))
+    wet_value: if None, all values are considered: zeros are only counted
+      and the rest are stored. Otherwise only values > wet_value are stored
+      (wet-only quantiles) and the rest are discarded.
+    nlabels: number of partitions of the records (e.g. seasons, or
+      frequency x season). All partitions share a single array sorted by
+      pixel and value, and the quantiles of any group of partitions are
+      taken from it without sorting again.
+    """
+
+    def __init__(self, shape, wet_value=None, nlabels=1):
+        self.shape = tuple(shape)
+        self.npix = int(np.prod(self.shape))
+        self.wet_value = wet_value
+        self.nlabels = nlabels
+        self.nzero = np.zeros((nlabels, self.npix), dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.uint8)
+        self.offsets = np.zeros(self.npix + 1, dtype=np.int64)
+        self._pixels = []
+        self._values = []
+        self._labels = []
+
+    def update(self, data, label=0):
+        """Add records of the field to a partition. data: array (time, *shape)"""
+        data = np.ma.filled(data, np.nan).reshape(-1, self.npix)
+        if self.wet_value is None:
+            self.nzero[label] += np.count_nonzero(data == 0, axis=0)
+            wet = (data != 0) & ~np.isnan(data)
+        else:
+            wet = data > self.wet_value
+
+        tidx, pixel = np.nonzero(wet)
+        self._pixels.append(pixel.astype(np.int32))
+        self._values.append(data[tidx, pixel].astype(np.float32))
+        self._labels.append(np.full(len(pixel), label, dtype=np.uint8))
+
+    def merge(self, other):
+        """Add all the records of another store of the same field"""
+        other.compact()
+        self.nzero += other.nzero
+        self._pixels.append(
+            np.repeat(np.arange(self.npix, dtype=np.int32), np.diff(other.offsets))
+        )
+        self._values.append(other.values)
+        self._labels.append(other.labels)
+
+    def compact(self):
+        """Sort the stored values by pixel and value"""
+        if not self._values:
+            return
+        counts = np.diff(self.offsets)
+        pixels = np.concatenate(
+            [np.repeat(np.arange(self.npix, dtype=np.int32), counts)] + self._pixels
+        )
+        values = np.concatenate([self.values] + self._values)
+        labels = np.concatenate([self.labels] + self._labels)
+        self._pixels = []
+        self._values = []
+        self._labels = []
+
+        order = np.lexsort((values, pixels))
+        self.values = values[order]
+        self.labels = labels[order]
+        self.offsets[1:] = np.cumsum(np.bincount(pixels, minlength=self.npix))
+
+    def subset(self, labels=None):
+        """Sorted values, pixel offsets and zero counts of a group of
+        partitions (all partitions if labels is None)"""
+        self.compact()
+        if labels is None:
+            return self.values, self.offsets, self.nzero.sum(axis=0)
+        labels = np.atleast_1d(labels)
+        # Selecting keeps the order, so the subset is still sorted
+        mask = np.isin(self.labels, labels)
+        inmask = np.concatenate([[0], np.cumsum(mask)])
+        return (
+            self.values[mask],
+            inmask[self.offsets],
+            self.nzero[labels].sum(axis=0),
+        )
+
+    def count(self, labels=None):
+        """Number of values per pixel used for the quantiles"""
+        values, offsets, nzero = self.subset(labels)
+        return (np.diff(offsets) + nzero).reshape(self.shape)
+
+    def quantile(self, qtiles, labels=None):
+        """Quantiles of each pixel over a group of partitions (all if labels
+        is None). Output: array (len(qtiles), *shape) (NaN where there are
+        no values)"""
+        values, offsets, nzero = self.subset(labels)
+        ptiles = sorted_quantiles(values, offsets, nzero, qtiles)
+        return ptiles.reshape((len(ptiles),) + self.shape)
+
+
+###########################################################
+###########################################################
+
+
+def sorted_quantiles(values, offsets, nzero, qtiles):
+    """Quantiles from values sorted by pixel and value
+    values[offsets[i]:offsets[i+1]] are the sorted non-zero values of pixel i
+    and nzero[i] its number of zeros.
+    Output: array (len(qtiles), npix), NaN where there are no values
+    """
+    qtiles = np.atleast_1d(qtiles)
+    npix = len(offsets) - 1
+    counts = np.diff(offsets)
+    nvalues = counts + nzero
+
+    negative = np.concatenate([[0], np.cumsum(values < 0)])
+    nneg = negative[offsets[1:]] - negative[offsets[:-1]]
+
+    def value_at(idx):
+        """idx-th smallest value of each pixel (zeros included)"""
+        iwet = np.where(idx < nneg, idx, idx - nzero)
+        iwet = offsets[:-1] + np.clip(iwet, 0, np.maximum(counts - 1, 0))
+        if values.size == 0:
+            value = np.zeros(npix)
+        else:
+            value = np.take(values, iwet, mode="clip").astype(np.float64)
+        return np.where((idx >= nneg) & (idx < nneg + nzero), 0.0, value)
+
+    ptiles = np.full((len(qtiles), npix), np.nan)
+    valid = nvalues > 0
+    for iq, q in enumerate(qtiles):
+        h = (nvalues - 1) * q
+        lo = np.floor(h).astype(np.int64)
+        hi = np.minimum(lo + 1, nvalues - 1)
+        t = h - lo
+        a = value_at(lo)
+        b = value_at(hi)
+        # Same interpolation as numpy.quantile (method='linear')
+        diff_b_a = b - a
+        lerp = np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+        ptiles[iq, valid] = lerp[valid]
+
+    return ptiles
@@ -26,28 +26,30 @@ from glob import glob
 import time
 import subprocess as subprocess
 from joblib import Parallel, delayed
+import tile_store as tstore
 
 
 wrun = cfg.wrf_runs[0]
 tile_size = 50
 freq = '01H'
+varname = 'RAIN'
+chunk_days = 30
 ###########################################################
 ###########################################################
 
 def main():
 
-    """  Split files into tiles """
+    """  Write all monthly files into a single tile store """
 
-    filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_RAIN_20??-??.nc'))
-    files_ref = xr.open_dataset(filesin[0])
-    nlats = files_ref.sizes['y']
-    nlons = files_ref.sizes['x']
-    files_ref.close()
+    filesin = sorted(glob(f'{cfg.path_in}/{wrun}/{cfg.patt_in}_{freq}_{varname}_20??-??.nc'))
+    fout = tstore.tile_store_name(f'{cfg.path_in}/{wrun}',cfg.patt_in,freq,varname,tile_size)
 
-    Parallel(n_jobs=20)(delayed(iotiles.split_files)(fin,nlons,nlats,tile_size) for fin in filesin)
+    tstore.create_tile_store(filesin,fout,varname,tile_size,chunk_days)
 
-
-    #Then concatenate using:
+    # Tiles are then read with tile_store.TileStore(fout).read_tile(varname,ny,nx)
+    # The former one-file-per-tile-per-month splitting is still available
+    # through split_files:
+    # Parallel(n_jobs=20)(delayed(split_files)(fin,nlons,nlats,tile_size) for fin in filesin)
     # for ny in $(seq -s " " -f %03g 0 10); do for nx in $(seq -s " " -f %03g 0 10); do ncrcat UIB_10MIN_RAIN_*_${ny}y-${nx}x.nc UIB_10MIN_RAIN_2011-2020_${ny}y-${nx}x.nc ;done done
 
 
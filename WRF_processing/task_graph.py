@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T16:02:37+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T16:02:40+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Shared process pool for the postprocessing drivers.
+# All the tasks of a request (runs x variables x days/months) are submitted
+# to a single pool, so there is no barrier after each variable or year.
+# Workers take the next task as soon as they are free, and tasks are
+# submitted from the most to the least expensive, so cheap tasks fill the
+# gaps left by expensive ones at the end. Only 2*njobs tasks are dispatched
+# ahead of the workers (joblib default), so the parent does not hold a
+# future for every task of long requests. Tasks of equal cost keep their
+# order (e.g. the one-task-per-day multivar mode, where the cost ordering
+# has no effect).
+#
+# Dependencies: joblib
+#
+# Files:
+#
+#####################################################################
+"""
+
+from joblib import Parallel, delayed
+
+
+###########################################################
+###########################################################
+
+
+def run_task_graph(tasks, njobs):
+    """Run independent tasks on a shared process pool
+    tasks: list of (cost, function, args)
+    njobs: number of worker processes
+    Returns the results in the order of tasks.
+    """
+    order = sorted(range(len(tasks)), key=lambda n: tasks[n][0], reverse=True)
+    results = Parallel(n_jobs=njobs, batch_size=1)(
+        delayed(tasks[n][1])(*tasks[n][2]) for n in order
+    )
+    ordered = [None] * len(tasks)
+    for n, result in zip(order, results):
+        ordered[n] = result
+    return ordered
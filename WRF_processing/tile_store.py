@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T10:12:31+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T10:12:35+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Tile-native storage of full-period postprocessed files.
+# All months of a variable are written to a single netCDF4 (HDF5) file
+# chunked in (time, tile_size, tile_size) blocks, so that per-pixel
+# time-series jobs read a whole tile with one hyperslab request instead of
+# opening one split file per month.
+#
+# Dependencies: netCDF4, numpy, xarray
+#
+# Files: {patt_in}_{freq}_{var}_YYYY-MM.nc -> {patt_in}_{freq}_{var}_tiles_{tile_size}.nc
+#
+#####################################################################
+"""
+
+import datetime as dt
+import netCDF4 as nc
+import numpy as np
+import xarray as xr
+
+
+###########################################################
+###########################################################
+
+
+def tile_store_name(path, patt, freq, varname, tile_size):
+    """Name of the tile store of a variable"""
+    return f"{path}/{patt}_{freq}_{varname}_tiles_{tile_size}.nc"
+
+
+def create_tile_store(filesin, fout, varname, tile_size=50, chunk_days=30):
+    """Write all records of varname in filesin (sorted in time) to a single
+    file chunked in (time, tile_size, tile_size).
+    Records are buffered until a complete time chunk (chunk_days) is filled,
+    so each chunk is compressed and written only once. Memory use is one
+    time chunk over the full domain.
+    """
+    fref = nc.Dataset(filesin[0])
+    varref = fref.variables[varname]
+    ny, nx = varref.shape[-2:]
+
+    ntimes = 0
+    for fin_name in filesin:
+        fin = nc.Dataset(fin_name)
+        ntimes += len(fin.dimensions["time"])
+        fin.close()
+
+    ttime = fref.variables["time"]
+    step = 86400.0
+    if len(ttime) > 1:
+        # Record step in seconds, whatever the units of the time axis
+        t01 = nc.num2date(
+            ttime[:2],
+            units=ttime.units,
+            calendar=getattr(ttime, "calendar", "standard"),
+        )
+        step = (t01[1] - t01[0]).total_seconds()
+    tchunk = max(1, min(ntimes, int(round(chunk_days * 86400.0 / step))))
+
+    print(f"Creating tile store {fout}")
+    print(f"{ntimes} records, chunks of ({tchunk},{tile_size},{tile_size})")
+
+    outfile = nc.Dataset(fout, "w", format="NETCDF4")
+    outfile.createDimension("time", ntimes)
+    outfile.createDimension("y", ny)
+    outfile.createDimension("x", nx)
+
+    outtime = outfile.createVariable("time", "f8", ("time",))
+    for att in ttime.ncattrs():
+        if att != "_FillValue":
+            setattr(outtime, att, ttime.getncattr(att))
+
+    for coord in ["lat", "lon"]:
+        outcoord = outfile.createVariable(
+            coord, "f", ("y", "x"), zlib=True, complevel=5
+        )
+        for att in fref.variables[coord].ncattrs():
+            if att != "_FillValue":
+                setattr(outcoord, att, fref.variables[coord].getncattr(att))
+        outcoord[:] = fref.variables[coord][:]
+
+    outvar = outfile.createVariable(
+        varname,
+        "f",
+        ("time", "y", "x"),
+        zlib=True,
+        complevel=5,
+        shuffle=True,
+        chunksizes=(tchunk, min(tile_size, ny), min(tile_size, nx)),
+        fill_value=getattr(varref, "_FillValue", None),
+    )
+    for att in varref.ncattrs():
+        if att != "_FillValue":
+            setattr(outvar, att, varref.getncattr(att))
+    fref.close()
+
+    setattr(outfile, "tile_size", tile_size)
+    setattr(outfile, "ntiles_y", -(-ny // tile_size))
+    setattr(outfile, "ntiles_x", -(-nx // tile_size))
+    setattr(outfile, "creation_date", dt.datetime.today().strftime("%Y-%m-%d"))
+    setattr(outfile, "author", "Daniel Argueso @UIB")
+    setattr(outfile, "contact", "d.argueso@uib.es")
+
+    buffer = np.empty((tchunk, ny, nx), dtype=np.float32)
+    nbuf = 0
+    t0 = 0
+    for fin_name in filesin:
+        print(fin_name)
+        fin = nc.Dataset(fin_name)
+        fin.set_auto_mask(False)
+        nt = len(fin.dimensions["time"])
+        outtime[t0 + nbuf : t0 + nbuf + nt] = fin.variables["time"][:]
+        it = 0
+        while it < nt:
+            nread = min(nt - it, tchunk - nbuf)
+            buffer[nbuf : nbuf + nread] = np.squeeze(
+                fin.variables[varname][it : it + nread]
+            ).reshape(nread, ny, nx)
+            nbuf += nread
+            it += nread
+            if nbuf == tchunk:
+                outvar[t0 : t0 + tchunk] = buffer
+                t0 += tchunk
+                nbuf = 0
+        fin.close()
+
+    if nbuf > 0:
+        outvar[t0 : t0 + nbuf] = buffer[:nbuf]
+
+    outfile.close()
+
+
+###########################################################
+###########################################################
+
+
+class TileStore:
+    """Reader of a tile store created with create_tile_store"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ncfile = nc.Dataset(filename)
+        self.tile_size = int(self.ncfile.tile_size)
+        self.ntiles_y = int(self.ncfile.ntiles_y)
+        self.ntiles_x = int(self.ncfile.ntiles_x)
+        self.ny = len(self.ncfile.dimensions["y"])
+        self.nx = len(self.ncfile.dimensions["x"])
+        ttime = self.ncfile.variables["time"]
+        self.times = np.asarray(
+            nc.num2date(
+                ttime[:],
+                units=ttime.units,
+                calendar=getattr(ttime, "calendar", "standard"),
+                only_use_cftime_datetimes=False,
+            ),
+            dtype="datetime64[ns]",
+        )
+
+    def tile_ids(self):
+        """List of (ny, nx) tile labels with the naming of split files"""
+        return [
+            (f"{ty:03d}", f"{tx:03d}")
+            for ty in range(self.ntiles_y)
+            for tx in range(self.ntiles_x)
+        ]
+
+    def tile_bounds(self, ny, nx):
+        """y and x slices of a tile"""
+        ty, tx = int(ny), int(nx)
+        ys = slice(ty * self.tile_size, min((ty + 1) * self.tile_size, self.ny))
+        xs = slice(tx * self.tile_size, min((tx + 1) * self.tile_size, self.nx))
+        return ys, xs
+
+    def time_slice(self, sdate=None, edate=None):
+        """Index slice of the records between two dates (strings as in
+        xarray .sel, e.g. '2013' or '2020-12'; both ends included).
+        Raises ValueError if there are no records between the two dates"""
+        tindex = slice(None)
+        if sdate is not None or edate is not None:
+            tindex = xr.DataArray(
+                np.arange(len(self.times)), coords={"time": self.times}, dims="time"
+            ).sel(time=slice(sdate, edate))
+            if tindex.size == 0:
+                raise ValueError(
+                    f"No records between {sdate} and {edate} in {self.filename}"
+                )
+            tindex = slice(int(tindex[0]), int(tindex[-1]) + 1)
+        return tindex
+
+    def read_tile(self, varname, ny, nx, sdate=None, edate=None, tindex=None):
+        """Read all records of a tile (optionally between two dates, or an
+        index slice tindex) with a single hyperslab request. Returns an
+        xarray Dataset with the same layout as the former split files
+        (varname, lat, lon)"""
+        ys, xs = self.tile_bounds(ny, nx)
+        if tindex is None:
+            tindex = self.time_slice(sdate, edate)
+
+        values = self.ncfile.variables[varname][tindex, ys, xs]
+        var = self.ncfile.variables[varname]
+        fin = xr.Dataset(
+            {
+                varname: (
+                    ["time", "y", "x"],
+                    np.ma.filled(values, np.nan),
+                    {
+                        att: var.getncattr(att)
+                        for att in var.ncattrs()
+                        if att != "_FillValue"
+                    },
+                ),
+                "lat": (["y", "x"], self.ncfile.variables["lat"][ys, xs]),
+                "lon": (["y", "x"], self.ncfile.variables["lon"][ys, xs]),
+            },
+            coords={"time": self.times[tindex]},
+        )
+        return fin
+
+    def iter_tile(self, varname, ny, nx, sdate=None, edate=None):
+        """Read a tile month by month (optionally between two dates).
+        Yields xarray Datasets as read_tile, so long records can be processed
+        in a streaming pass with bounded memory"""
+        tindex = self.time_slice(sdate, edate)
+        t0 = tindex.start or 0
+        months = self.times[tindex].astype("datetime64[M]")
+        bounds = np.concatenate(
+            [[0], np.flatnonzero(np.diff(months)) + 1, [len(months)]]
+        )
+        for tb, te in zip(bounds[:-1], bounds[1:]):
+            yield self.read_tile(
+                varname, ny, nx, tindex=slice(t0 + int(tb), t0 + int(te))
+            )
+
+    def close(self):
+        self.ncfile.close()
+
+
+def load_tile(storefile, varname, ny, nx, sdate=None, edate=None):
+    """Open a tile store, read a tile and close it"""
+    store = TileStore(storefile)
+    fin = store.read_tile(varname, ny, nx, sdate, edate)
+    store.close()
+    return fin
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel> @ UIB
+# Date:   2026-10-17T16:40:12+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T16:40:15+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Vertical interpolation of WRF model-level fields to pressure
+# or height levels. The model levels bracketing each target level are found
+# once per column and time step and the same brackets and weights are
+# applied to all the variables of a file (TC, Z, UA, VA, RV...). The domain
+# is split in y-blocks processed by threads, and only the range of model
+# levels that brackets the target levels somewhere in the domain is needed
+# to compute the variables. Brackets and weights can be cached by (run,
+# time stamp, levels) in memory and in sidecar files, so later variables or
+# later runs of the same day only pay for the interpolation itself.
+#
+# Dependencies: numpy, joblib
+#
+# Files:
+#
+#####################################################################
+"""
+
+import json
+import os
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from manifest import file_signature
+
+
+###########################################################
+###########################################################
+
+
+def level_brackets(coord, levels):
+    """Lower model level bracketing each target level and its weight
+    coord: vertical coordinate (time, lev, y, x), increasing with lev
+    levels: target levels in the same units as coord
+    Returns k (time, level, y, x), -1 where the level is outside the column,
+    and w, weight of level k+1
+    """
+    nz = coord.shape[1]
+    k = np.empty((coord.shape[0], len(levels)) + coord.shape[2:], np.int16)
+    w = np.empty(k.shape, np.float32)
+
+    for n, level in enumerate(levels):
+        kn = np.sum(coord <= level, axis=1) - 1
+        kc = np.clip(kn, 0, nz - 2)[:, None]
+        c0 = np.take_along_axis(coord, kc, axis=1)[:, 0]
+        c1 = np.take_along_axis(coord, kc + 1, axis=1)[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w[:, n] = (level - c0) / (c1 - c0)
+        k[:, n] = np.where((kn >= 0) & (kn < nz - 1), kc[:, 0], -1)
+
+    return k, w
+
+
+def apply_brackets(field, k, w, missing=1e20):
+    """Interpolate field (time, lev, y, x) with the brackets of level_brackets"""
+    kc = np.maximum(k, 0)
+    f0 = np.take_along_axis(field, kc, axis=1)
+    f1 = np.take_along_axis(field, kc + 1, axis=1)
+    return np.where(k >= 0, f0 + w * (f1 - f0), missing).astype(np.float32)
+
+
+class VerticalInterpolator:
+    """Interpolation of model-level fields to pressure or height levels with
+    brackets computed once from the vertical coordinate of a file and reused
+    for all variables.
+    coord: pressure [hPa] or height [m] (time, lev, y, x)
+    levels: target levels [hPa or m]
+    vert_coord: "pressure" (linear in log(p)) or "height" (linear in z)
+    njobs: threads, each working on a block of yblock rows
+    missing: value where a level is below ground or above the top
+    """
+
+    def __init__(
+        self,
+        coord,
+        levels,
+        vert_coord="pressure",
+        njobs=4,
+        yblock=32,
+        missing=1e20,
+    ):
+        self.levels_out = list(levels)
+        self.vert_coord = vert_coord
+        self.njobs = njobs
+        self.missing = missing
+        if coord is None:
+            return
+
+        coord = np.asarray(coord)
+        targets = np.asarray(self.levels_out, np.float64)
+        if vert_coord == "pressure":
+            coord, targets = -np.log(coord), -np.log(targets)
+        ny = coord.shape[2]
+        self.nlevs = coord.shape[1]
+        self.yblocks = [slice(j, min(j + yblock, ny)) for j in range(0, ny, yblock)]
+
+        brackets = Parallel(n_jobs=njobs, prefer="threads")(
+            delayed(level_brackets)(coord[:, :, ys], targets) for ys in self.yblocks
+        )
+        k = np.concatenate([b[0] for b in brackets], axis=2)
+        self.w = np.concatenate([b[1] for b in brackets], axis=2)
+
+        # Model levels needed by any column: fields are only computed there
+        valid = k >= 0
+        if valid.any():
+            k0, k1 = int(k[valid].min()), int(k[valid].max()) + 1
+        else:
+            k0, k1 = 0, 1
+        self.levels = slice(k0, k1 + 1)
+        self.k = np.where(valid, k - k0, -1).astype(np.int16)
+
+    def interp(self, field):
+        """Interpolate field (time, lev, y, x), given on all model levels or
+        only on self.levels, to the target levels (time, level, y, x)"""
+        field = np.asarray(field)
+        if field.shape[1] == self.nlevs:
+            field = field[:, self.levels]
+
+        blocks = Parallel(n_jobs=self.njobs, prefer="threads")(
+            delayed(apply_brackets)(
+                field[:, :, ys], self.k[:, :, ys], self.w[:, :, ys], self.missing
+            )
+            for ys in self.yblocks
+        )
+        return np.concatenate(blocks, axis=2)
+
+    def save(self, filename, signature=None):
+        """Write the brackets and weights to a sidecar .npz file"""
+        np.savez(
+            filename,
+            k=self.k,
+            w=self.w,
+            levels=[self.levels.start, self.levels.stop],
+            nlevs=self.nlevs,
+            yblocks=[[ys.start, ys.stop] for ys in self.yblocks],
+            signature=json.dumps(signature),
+        )
+
+    @classmethod
+    def load(cls, filename, levels, vert_coord="pressure", njobs=4, missing=1e20):
+        """Interpolator with the brackets and weights of a sidecar file"""
+        self = cls(None, levels, vert_coord, njobs=njobs, missing=missing)
+        with np.load(filename) as data:
+            self.k = data["k"]
+            self.w = data["w"]
+            self.levels = slice(*[int(n) for n in data["levels"]])
+            self.nlevs = int(data["nlevs"])
+            self.yblocks = [slice(int(j0), int(j1)) for j0, j1 in data["yblocks"]]
+            self.signature = json.loads(str(data["signature"]))
+        return self
+
+
+###########################################################
+###########################################################
+
+# Interpolators of the current process, by (wrun, timestamp, vert_coord, levels)
+_interpolators = {}
+
+
+def cache_name(cachepath, wrun, timestamp, vert_coord, levels):
+    """Sidecar file of the brackets of a WRF file (see cached_interpolator)"""
+    return "%s/%s/vinterp_%s_%s_%s.npz" % (
+        cachepath,
+        wrun,
+        vert_coord,
+        "-".join("%g" % (level) for level in levels),
+        timestamp,
+    )
+
+
+def cached_interpolator(
+    wrun,
+    timestamp,
+    levels,
+    read_coord,
+    vert_coord="pressure",
+    cachepath=None,
+    inputs=None,
+    njobs=4,
+):
+    """VerticalInterpolator of a WRF file, cached by (wrun, timestamp,
+    vert_coord, levels) in memory and, if cachepath is given, in a sidecar
+    file. The vertical coordinate is only read, with read_coord(), when
+    there is no cached interpolator. inputs are the files the coordinate is
+    read from; the sidecar is discarded if they changed since it was written.
+    """
+    key = (wrun, timestamp, vert_coord, tuple(levels))
+    if key in _interpolators:
+        return _interpolators[key]
+
+    signature = file_signature(inputs) if inputs else None
+    filename = None
+    vinterp = None
+    if cachepath is not None:
+        filename = cache_name(cachepath, wrun, timestamp, vert_coord, levels)
+        if os.path.isfile(filename):
+            vinterp = VerticalInterpolator.load(filename, levels, vert_coord, njobs)
+            if vinterp.signature != signature:
+                vinterp = None
+
+    if vinterp is None:
+        vinterp = VerticalInterpolator(read_coord(), levels, vert_coord, njobs)
+        if filename is not None:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            vinterp.save(filename, signature)
+
+    # Only the last file is kept in memory: files are processed one after
+    # the other, with all their variables
+    _interpolators.clear()
+    _interpolators[key] = vinterp
+    return vinterp
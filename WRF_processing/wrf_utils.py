@@ -27,6 +27,7 @@ from glob import glob
 from dateutil.relativedelta import relativedelta
 import wrf as wrf
 import compute_vars as cvars
+from vert_interp import cached_interpolator
 import calendar
 import subprocess
 
@@ -71,40 +72,47 @@ def wrftime2date(files):
     Conversion of dates from a wrf file or a list of wrf files
     format: [Y] [Y] [Y] [Y] '-' [M] [M] '-' [D] [D] '_' [H] [H] ':' [M] [M] ':' [S] [S]
     to a datetime object.
+    Only the Times variable is read from each file.
     """
 
-    if len(files) == 1:
-        fin = nc.Dataset(str(files[0]), "r")
-        times = fin.variables["Times"]
-    else:
-        fin = nc.MFDataset(files[:])
-        times = fin.variables["Times"]
-
-    year = np.zeros(len(times), dtype=np.int64)
-    month = year.copy()
-    day = year.copy()
-    hour = year.copy()
-    minute = year.copy()
-    second = year.copy()
-
-    for i in range(len(times)):
-        listdate = times[i]
-        year[i] = (
-            int(listdate[0]) * 1000
-            + int(listdate[1]) * 100
-            + int(listdate[2]) * 10
-            + int(listdate[3])
-        )
-        month[i] = int(listdate[5]) * 10 + int(listdate[6])
-        day[i] = int(listdate[8]) * 10 + int(listdate[9])
-        hour[i] = int(listdate[11]) * 10 + int(listdate[12])
-        minute[i] = int(listdate[14]) * 10 + int(listdate[15])
-        second[i] = int(listdate[17]) * 10 + int(listdate[18])
-
-    dates = [
-        dt.datetime(year[i], month[i], day[i], hour[i], minute[i], second[i])
-        for i in range(len(times))
-    ]
+    times = []
+    for filename in files:
+        fin = nc.Dataset(str(filename), "r")
+        times.append(fin.variables["Times"][:])
+        fin.close()
+
+    dates = wrftimes2datetime64(np.concatenate(times, axis=0))
+
+    return list(dates.astype(dt.datetime))
+
+
+def wrftimes2datetime64(times):
+    """
+    Vectorized conversion of a WRF Times char array (ntimes, 19)
+    to datetime64[s]. Digits are decoded from the raw bytes at once.
+    """
+
+    times = np.ma.getdata(np.asarray(times))
+    if times.dtype.kind == "U":
+        times = times.astype("S")
+    digits = (
+        np.ascontiguousarray(times).view(np.uint8).reshape(-1, 19).astype(np.int64)
+        - ord("0")
+    )
+
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    hour = digits[:, 11] * 10 + digits[:, 12]
+    minute = digits[:, 14] * 10 + digits[:, 15]
+    second = digits[:, 17] * 10 + digits[:, 18]
+
+    dates = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (
+        month - 1
+    )
+    dates = dates.astype("datetime64[D]") + (day - 1)
+    dates = dates.astype("datetime64[s]") + (hour * 3600 + minute * 60 + second)
+
     return dates
 
 
@@ -112,6 +120,272 @@ def wrftime2date(files):
 ###########################################################
 
 
+class TimeSliceVariable:
+    """netCDF4-like view of a variable restricted to a subset of its records,
+    e.g. the 3-hourly records of an hourly wrfout. Data are only read from
+    disk when the view is indexed, and only for the selected records.
+    """
+
+    def __init__(self, var, tslice):
+        self._var = var
+        self._tindex = range(var.shape[0])[tslice]
+        self.dimensions = var.dimensions
+        self.dtype = var.dtype
+        self.ndim = var.ndim
+        self.shape = (len(self._tindex),) + tuple(var.shape[1:])
+        self.size = int(np.prod(self.shape))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._var, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def ncattrs(self):
+        return self._var.ncattrs()
+
+    def getncattr(self, name):
+        return self._var.getncattr(name)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            return self[:][key]
+
+        tkey = key[0]
+        if isinstance(tkey, slice):
+            tsel = self._tindex[tkey]
+            if len(tsel) > 0 and tsel.step > 0:
+                tsel = slice(tsel.start, tsel.stop, tsel.step)
+            else:
+                tsel = list(tsel)
+        elif isinstance(tkey, (int, np.integer)):
+            tsel = self._tindex[tkey]
+        else:
+            tsel = np.asarray(self._tindex)[tkey]
+
+        return self._var[(tsel,) + key[1:]]
+
+
+class BroadcastTimeVariable:
+    """netCDF4-like view of a single-record variable (e.g. geo_em fields)
+    repeated along Time to match the number of records of a WRF file.
+    """
+
+    def __init__(self, var, ntimes):
+        self._var = var
+        self._data = None
+        self.dimensions = var.dimensions
+        self.dtype = var.dtype
+        self.ndim = var.ndim
+        self.shape = (ntimes,) + tuple(var.shape[1:])
+        self.size = int(np.prod(self.shape))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._var, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def ncattrs(self):
+        return self._var.ncattrs()
+
+    def getncattr(self, name):
+        return self._var.getncattr(name)
+
+    def __getitem__(self, key):
+        if self._data is None:
+            self._data = np.broadcast_to(self._var[:1], self.shape)
+        return self._data[key]
+
+
+class PatchSliceVariable:
+    """netCDF4-like view of a full-domain variable (e.g. geo_em fields)
+    restricted to a WRF processor patch. ys and xs are the unstaggered
+    south_north and west_east slices of the patch; staggered dimensions
+    get one more point.
+    """
+
+    def __init__(self, var, ys, xs):
+        self._var = var
+        self._index = tuple(
+            slice(ys.start, ys.stop + (dim == "south_north_stag"))
+            if dim.startswith("south_north")
+            else slice(xs.start, xs.stop + (dim == "west_east_stag"))
+            if dim.startswith("west_east")
+            else slice(None)
+            for dim in var.dimensions
+        )
+        self.dimensions = var.dimensions
+        self.dtype = var.dtype
+        self.ndim = var.ndim
+        self.shape = tuple(
+            len(range(n)[sl]) for n, sl in zip(var.shape, self._index)
+        )
+        self.size = int(np.prod(self.shape))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._var, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def ncattrs(self):
+        return self._var.ncattrs()
+
+    def getncattr(self, name):
+        return self._var.getncattr(name)
+
+    def __getitem__(self, key):
+        return self._var[self._index][key]
+
+
+def wrf_patch_bounds(ncfile):
+    """Unstaggered south_north and west_east slices of a WRF processor patch
+    (io_form=102 split file) within the full domain"""
+    ys = slice(
+        int(ncfile.getncattr("SOUTH-NORTH_PATCH_START_UNSTAG")) - 1,
+        int(ncfile.getncattr("SOUTH-NORTH_PATCH_END_UNSTAG")),
+    )
+    xs = slice(
+        int(ncfile.getncattr("WEST-EAST_PATCH_START_UNSTAG")) - 1,
+        int(ncfile.getncattr("WEST-EAST_PATCH_END_UNSTAG")),
+    )
+    return ys, xs
+
+
+class PatchFile:
+    """Variables of a full-domain file restricted to a WRF patch, with the
+    same .variables interface as a netCDF4 Dataset"""
+
+    def __init__(self, ncfile, ys, xs):
+        self.variables = {
+            varname: PatchSliceVariable(var, ys, xs)
+            for varname, var in ncfile.variables.items()
+        }
+
+
+class LevelSliceVariable:
+    """netCDF4-like view of a WRF variable restricted to a range of model
+    levels. ks is the slice of mass levels (bottom_top); the staggered
+    bottom_top_stag dimension gets one more level. Only the selected levels
+    are read from disk.
+    """
+
+    def __init__(self, var, ks):
+        self._var = var
+        self._index = tuple(
+            slice(ks.start, ks.stop + (dim == "bottom_top_stag"))
+            if dim.startswith("bottom_top")
+            else slice(None)
+            for dim in var.dimensions
+        )
+        self.dimensions = var.dimensions
+        self.dtype = var.dtype
+        self.ndim = var.ndim
+        self.shape = tuple(
+            len(range(n)[sl]) for n, sl in zip(var.shape, self._index)
+        )
+        self.size = int(np.prod(self.shape))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._var, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def ncattrs(self):
+        return self._var.ncattrs()
+
+    def getncattr(self, name):
+        return self._var.getncattr(name)
+
+    def __getitem__(self, key):
+        return self._var[self._index][key]
+
+
+class LevelDimension:
+    """netCDF4-like dimension with a given size"""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def isunlimited(self):
+        return False
+
+
+class LevelSubsetFile:
+    """WRF file with its 3D variables restricted to a range of model levels
+    (see LevelSliceVariable) and the vertical dimensions resized. Global
+    attributes are those of ncfile, so it can be used as input of the
+    compute_vars diagnostics that work level by level (TC, Z, UA, VA, RV...)
+    """
+
+    def __init__(self, ncfile, ks):
+        self._ncfile = ncfile
+        self.variables = {
+            varname: LevelSliceVariable(var, ks)
+            if any(dim.startswith("bottom_top") for dim in var.dimensions)
+            else var
+            for varname, var in ncfile.variables.items()
+        }
+        nk = len(range(ncfile.dimensions["bottom_top"].size)[ks])
+        self.dimensions = dict(ncfile.dimensions)
+        self.dimensions["bottom_top"] = LevelDimension("bottom_top", nk)
+        self.dimensions["bottom_top_stag"] = LevelDimension("bottom_top_stag", nk + 1)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._ncfile, name)
+
+    def ncattrs(self):
+        return self._ncfile.ncattrs()
+
+    def getncattr(self, name):
+        return self._ncfile.getncattr(name)
+
+
+def merge_wrf3hrly_inputs(ncfile, fwrf2d, fwrfgeo, tslice=slice(0, 24, 3)):
+    """Attach to a wrf3hrly ncfile the variables of the hourly wrfout at the
+    3-hourly records (same as ncks -d Time,0,23,3) and the geo_em fields
+    broadcast to all records. Nothing is written to disk and variables
+    already present in ncfile are kept.
+    """
+    ntimes = ncfile.dimensions["Time"].size
+
+    for varname, var in fwrf2d.variables.items():
+        if varname not in ncfile.variables.keys():
+            if var.dimensions[:1] == ("Time",):
+                ncfile.variables[varname] = TimeSliceVariable(var, tslice)
+            else:
+                ncfile.variables[varname] = var
+
+    for varname, var in fwrfgeo.variables.items():
+        if varname not in ncfile.variables.keys():
+            if var.dimensions[:1] == ("Time",):
+                ncfile.variables[varname] = BroadcastTimeVariable(var, ntimes)
+            else:
+                ncfile.variables[varname] = var
+
+
+###########################################################
+###########################################################
+
+
 def plevs_interp(
     path_in,
     path_out,
@@ -195,10 +469,31 @@ def plevs_interp(
 
 
 def plevs_interp_byday(
-    fullpathin, fullpathout, geofile_ref, date, plevs, patt, patt_wrf, dom, wrun, varn
+    fullpathin,
+    fullpathout,
+    geofile_ref,
+    date,
+    plevs,
+    patt,
+    patt_wrf,
+    dom,
+    wrun,
+    varnames,
+    njobs=4,
+    cachepath=None,
 ):
-    inputinf = {}
-    inputinf["geofile"] = geofile_ref
+    """Interpolate to pressure levels the variables of a day (one output file
+    per variable). The model levels bracketing plevs are found once and
+    shared by all variables, which are only computed on the model levels
+    needed (see vert_interp.VerticalInterpolator). Variables must be
+    computed level by level (no vertical integrals).
+    njobs: threads used for the interpolation
+    cachepath: directory of the sidecar files of the brackets, reused by
+    later calls for the same day and levels (None: cache in memory only)
+    """
+    if isinstance(varnames, str):
+        varnames = [varnames]
+
     geofile = nc.Dataset(geofile_ref)
 
     y = date.year
@@ -210,57 +505,60 @@ def plevs_interp_byday(
 
     filein_wrf3d = "%s/%s_%s_%s_00:00:00" % (fullpathin, patt_wrf, dom, sdate)
     filein_wrf2d = filein_wrf3d.replace(patt_wrf, "wrfout")
-    filein_aux = f"./aux_{sdate}.nc"
-
-    os.system(f"ncks -d Time,0,23,3 {filein_wrf2d} {filein_aux}")
-
-    # try:
-    #     print(f"ncks -d Time,0,23,3 {filein_wrf2d} {filein_aux}")
-    #     subprocess.check_output(f"ncks -d Time,0,23,3 {filein_wrf2d} {filein_aux}")
-    # except Exception:
-    #     raise SystemExit(f"ERROR: Could not select times for {filein_wrf2d}")
 
     fwrf3d = nc.Dataset(filein_wrf3d)
-    fwrf2d = nc.Dataset(filein_aux)
+    fwrf2d = nc.Dataset(filein_wrf2d)
     otimes = wrftime2date(filein_wrf3d.split())[:]
 
-    # fwrf3d.variables["F"] = geofile.variables["F"]
-    ntimes = fwrf3d.dimensions['Time'].size
-    fwrf3d.variables['F'] = np.broadcast_to(geofile.variables['F'][:],(ntimes,) + geofile.variables['F'][:].squeeze().shape)
+    # 3-hourly records of the wrfout and geo_em fields (F, MAPFAC_*) are
+    # attached in memory, without writing an intermediate file
+    merge_wrf3hrly_inputs(fwrf3d, fwrf2d, geofile)
+
+    def read_pressure():
+        return (fwrf3d.variables["P"][:] + fwrf3d.variables["PB"][:]) / 100.0
+
+    vinterp = cached_interpolator(
+        wrun,
+        sdate,
+        plevs,
+        read_pressure,
+        "pressure",
+        cachepath,
+        [filein_wrf3d],
+        njobs,
+    )
+    flevs = LevelSubsetFile(fwrf3d, vinterp.levels)
+
+    nlevs = vinterp.levels.stop - vinterp.levels.start
+    for varn in varnames:
+        # Diagnostics with an interp_ function are only evaluated on the two
+        # model levels bracketing each column (e.g. RV at 850 hPa), which is
+        # cheaper than computing them on all the levels of the subset
+        interp_diag = getattr(cvars, "interp_%s" % (varn), None)
+        if interp_diag is not None and 2 * len(plevs) < nlevs:
+            field, atts = interp_diag(flevs, vinterp.k, vinterp.w)
+            fieldint = np.where(vinterp.k >= 0, field, vinterp.missing)
+        else:
+            field, atts = cvars.compute_WRFvar(flevs, varn)
+            fieldint = vinterp.interp(field)
+
+        varinfo = {
+            "values": fieldint,
+            "varname": varn,
+            "plevs": plevs,
+            "atts": atts,
+            "lat": fwrf2d.variables["XLAT"][0, :],
+            "lon": fwrf2d.variables["XLONG"][0, :],
+            "times": otimes,
+        }
 
-    for varname in fwrf2d.variables.keys():
-        fwrf3d.variables[varname] = fwrf2d.variables[varname]
+        fileout = "%s/%s_PLEVS_%s_%s.nc" % (fullpathout, patt, varn, sdate)
+        create_plevs_netcdf(varinfo, fileout)
 
-    field, atts = cvars.compute_WRFvar(fwrf3d, varn)
-    fieldint = wrf.vinterp(
-        fwrf3d,
-        np.squeeze(field),
-        vert_coord="pressure",
-        interp_levels=plevs,
-        timeidx=wrf.ALL_TIMES,
-    )
-    # zFragment = np.expand_dims(zFragment, axis=0)
-    # z.append(zFragment)
-    # t.append(tFragment)
-
-    # fieldint = np.concatenate(z, axis=0)
-    # otimes = np.concatenate(t, axis=0)
-
-    varinfo = {
-        "values": fieldint,
-        "varname": varn,
-        "plevs": plevs,
-        "atts": atts,
-        "lat": fwrf2d.variables["XLAT"][0, :],
-        "lon": fwrf2d.variables["XLONG"][0, :],
-        "times": otimes,
-    }
-
-    fileout = "%s/%s_PLEVS_%s_%s.nc" % (fullpathout, patt, varn, sdate)
-    create_plevs_netcdf(varinfo, fileout)
+    cvars.release_diag_context(flevs)
     fwrf3d.close()
     fwrf2d.close()
-    os.remove(filein_aux)
+    geofile.close()
 
 
 ###########################################################
@@ -711,12 +1009,29 @@ def zlevs_interp(
 
 
 def zlevs_interp_byday(
-    fullpathin, fullpathout, geofile_ref, date, zlevs, patt, patt_wrf, dom, wrun, varn
+    fullpathin,
+    fullpathout,
+    geofile_ref,
+    date,
+    zlevs,
+    patt,
+    patt_wrf,
+    dom,
+    wrun,
+    varnames,
+    njobs=4,
+    cachepath=None,
 ):
+    """Interpolate to heights above ground the variables of a day (one output
+    file per variable), with the brackets of each input file shared by all
+    variables as in plevs_interp_byday.
+    zlevs: heights above ground [km], as in wrf.vinterp
+    """
     # fullpathin = path_in + "/" + wrun + "/out"
     # fullpathout = path_out + "/" + wrun + "/" + str(syear) + "-" + str(eyear)
-    inputinf = {}
-    inputinf["geofile"] = geofile_ref
+    if isinstance(varnames, str):
+        varnames = [varnames]
+
     geofile = nc.Dataset(geofile_ref)
 
     y = date.year
@@ -727,37 +1042,59 @@ def zlevs_interp_byday(
 
     filesin_wrf = sorted(glob("%s/%s_%s_%s*" % (fullpathin, patt_wrf, dom, sdate)))
 
-    z = []
+    z = {varn: [] for varn in varnames}
+    atts = {}
     t = []
 
-    for thour in range(len(filesin_wrf)):
-        fwrf = nc.Dataset(filesin_wrf[thour])
+    for filein in filesin_wrf:
+        fwrf = nc.Dataset(filein)
         fwrf.variables["F"] = geofile.variables["F"]
-        tFragment = wrftime2date(filesin_wrf[thour].split())[:]
-        field, atts = cvars.compute_WRFvar(filesin_wrf[thour], varn)
-        zFragment = wrf.vinterp(
-            fwrf, np.squeeze(field), vert_coord="ght_agl", interp_levels=zlevs
+        tFragment = wrftime2date(filein.split())[:]
+
+        def read_height():
+            hgt = fwrf.variables["HGT"][:][:, None]
+            return (cvars.get_diag_context(fwrf).z() - hgt) / 1000.0
+
+        vinterp = cached_interpolator(
+            wrun,
+            tFragment[0].strftime("%Y-%m-%dT%H%M%S"),
+            zlevs,
+            read_height,
+            "height",
+            cachepath,
+            [filein],
+            njobs,
         )
+        flevs = LevelSubsetFile(fwrf, vinterp.levels)
 
-        zFragment = np.expand_dims(zFragment, axis=0)
-        z.append(zFragment)
+        for varn in varnames:
+            field, atts[varn] = cvars.compute_WRFvar(flevs, varn)
+            z[varn].append(vinterp.interp(field))
         t.append(tFragment)
 
-    fieldint = np.concatenate(z, axis=0)
+        lat = fwrf.variables["XLAT"][0, :]
+        lon = fwrf.variables["XLONG"][0, :]
+        cvars.release_diag_context(flevs)
+        cvars.release_diag_context(fwrf)
+        fwrf.close()
+
     otimes = np.concatenate(t, axis=0)
 
-    varinfo = {
-        "values": fieldint,
-        "varname": varn,
-        "zlevs": zlevs,
-        "atts": atts,
-        "lat": fwrf.variables["XLAT"][0, :],
-        "lon": fwrf.variables["XLONG"][0, :],
-        "times": otimes,
-    }
-
-    fileout = "%s/%s_ZLEVS_%s_%s.nc" % (fullpathout, patt, varn, sdate)
-    create_zlevs_netcdf(varinfo, fileout)
+    for varn in varnames:
+        varinfo = {
+            "values": np.concatenate(z[varn], axis=0),
+            "varname": varn,
+            "zlevs": zlevs,
+            "atts": atts[varn],
+            "lat": lat,
+            "lon": lon,
+            "times": otimes,
+        }
+
+        fileout = "%s/%s_ZLEVS_%s_%s.nc" % (fullpathout, patt, varn, sdate)
+        create_zlevs_netcdf(varinfo, fileout)
+
+    geofile.close()
 
 
 ###########################################################
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+#####################################################################
+# Author: Daniel Argueso <daniel>
+# Date:   2026-10-17T18:05:21+02:00
+# Email:  d.argueso@uib.es
+# Last modified by:   daniel
+# Last modified time: 2026-10-17T18:05:24+02:00
+#
+# @Project@ EPICC
+# Version: 1.0
+# Description: Horizontal regridding with precomputed sparse weights.
+# The weights between a source grid and a destination grid (bilinear or
+# first-order conservative) are computed once, stored as a sparse matrix
+# (dst points x src points) in a .npz file, and applied to blocks of
+# records (time, lev, lat, lon) as a sparse matrix product. Sources are
+# regular lat-lon grids (GCMs, ERA5, CMORPH, EOBS); destinations are
+# lat-lon grids or, for bilinear, curvilinear grids (WRF XLAT/XLONG).
+# The same sparse machinery interpolates along a single axis (e.g.
+# pressure levels) with linear_matrix and apply_axis.
+#
+# Dependencies: numpy, scipy
+#
+# Files:
+#
+#####################################################################
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import scipy.sparse as sparse
+
+
+###########################################################
+###########################################################
+
+
+def read_griddes(filename):
+    """Latitudes and longitudes of a regular lonlat grid description
+    (cdo griddes)"""
+
+    griddes = {}
+    with open(filename) as f:
+        for line in f:
+            if "=" in line and not line.startswith("#"):
+                key, value = line.split("=", 1)
+                griddes[key.strip()] = value.strip()
+
+    lat = float(griddes["yfirst"]) + float(griddes["yinc"]) * np.arange(
+        int(griddes["ysize"])
+    )
+    lon = float(griddes["xfirst"]) + float(griddes["xinc"]) * np.arange(
+        int(griddes["xsize"])
+    )
+    return lat, lon
+
+
+def is_global(lon):
+    """True if the longitudes (regularly spaced) go around the globe"""
+    lon = np.sort(np.mod(np.asarray(lon, np.float64), 360.0))
+    if len(lon) < 2:
+        return False
+    dlon = np.median(np.diff(lon))
+    return abs(dlon * len(lon) - 360.0) < 0.5 * dlon
+
+
+def linear_brackets(src, dst, period=None, outside="missing"):
+    """Source points bracketing each destination point (i0, i1), weight of
+    i1 and whether the point has weights (see linear_matrix)"""
+    src = np.asarray(src, np.float64)
+    dst = np.asarray(dst, np.float64).ravel()
+    if period is not None:
+        src = np.mod(src, period)
+        dst = np.mod(dst, period)
+    order = np.argsort(src)
+    coord = src[order]
+    if period is not None:
+        coord = np.concatenate(([coord[-1] - period], coord, [coord[0] + period]))
+        order = np.concatenate(([order[-1]], order, [order[0]]))
+        inside = np.ones(len(dst), bool)
+    else:
+        inside = (dst >= coord[0]) & (dst <= coord[-1])
+        if outside == "nearest":
+            dst = np.clip(dst, coord[0], coord[-1])
+            inside[:] = True
+        elif outside == "extrapolate":
+            inside[:] = True
+
+    j = np.clip(np.searchsorted(coord, dst, side="right") - 1, 0, len(coord) - 2)
+    w = (dst - coord[j]) / (coord[j + 1] - coord[j])
+    return order[j], order[j + 1], w, inside
+
+
+def linear_matrix(src, dst, period=None, outside="missing"):
+    """Sparse matrix (len(dst), len(src)) of the linear interpolation
+    between two 1-D coordinates. With a period (longitudes) the coordinate
+    wraps around. Points beyond the source range are left without weights
+    (outside="missing"), take the nearest source value ("nearest") or are
+    linearly extrapolated from the two end points ("extrapolate")
+    """
+    i0, i1, w, inside = linear_brackets(src, dst, period, outside)
+    rows = np.nonzero(inside)[0]
+    matrix = sparse.csr_matrix(
+        (
+            np.concatenate((1 - w[rows], w[rows])),
+            (np.concatenate((rows, rows)), np.concatenate((i0[rows], i1[rows]))),
+        ),
+        shape=(len(w), len(src)),
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def cell_bounds(coord, limits=None):
+    """Bounds of the cells centred at coord (midpoints between neighbours,
+    the end cells as wide as their neighbour), clipped to limits"""
+    coord = np.asarray(coord, np.float64)
+    mid = 0.5 * (coord[1:] + coord[:-1])
+    bounds = np.concatenate(
+        ([coord[0] - (mid[0] - coord[0])], mid, [coord[-1] + (coord[-1] - mid[-1])])
+    )
+    if limits is not None:
+        bounds = np.clip(bounds, *limits)
+    return np.stack((bounds[:-1], bounds[1:]), axis=1)
+
+
+def overlap_matrix(src_bounds, dst_bounds, period=None, measure=None):
+    """Sparse matrix (ndst, nsrc) of the fraction of each destination cell
+    covered by each source cell along one axis. measure maps coordinates to
+    the measure of the axis (sin(lat) for areas on the sphere)"""
+    src = np.sort(np.asarray(src_bounds, np.float64), axis=1)
+    dst = np.sort(np.asarray(dst_bounds, np.float64), axis=1)
+    if measure is None:
+        measure = lambda x: x  # noqa: E731
+    shifts = [0.0] if period is None else [-period, 0.0, period]
+
+    rows, cols, vals = [], [], []
+    dsize = measure(dst[:, 1]) - measure(dst[:, 0])
+    for shift in shifts:
+        lo = np.maximum(dst[:, None, 0], src[None, :, 0] + shift)
+        hi = np.minimum(dst[:, None, 1], src[None, :, 1] + shift)
+        r, c = np.nonzero(hi > lo)
+        rows.append(r)
+        cols.append(c)
+        vals.append((measure(hi[r, c]) - measure(lo[r, c])) / dsize[r])
+
+    return sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(dst), len(src)),
+    )
+
+
+def bilinear_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """Sparse bilinear weights from a regular lat-lon grid to a lat-lon
+    (1-D dst_lat, dst_lon) or curvilinear (2-D dst_lat, dst_lon) grid.
+    Global sources wrap around in longitude and latitudes beyond their
+    outermost rows take the edge value; destination points outside
+    regional sources have no weights (missing)."""
+
+    periodic = is_global(src_lon)
+    period = 360.0 if periodic else None
+    outside = "nearest" if periodic else "missing"
+    nlon = len(src_lon)
+    dst_lat = np.asarray(dst_lat, np.float64)
+    dst_lon = np.asarray(dst_lon, np.float64)
+
+    if dst_lat.ndim == 1:
+        # Separable on rectilinear grids: latitude x longitude weights
+        return sparse.kron(
+            linear_matrix(src_lat, dst_lat, None, outside),
+            linear_matrix(src_lon, dst_lon, period, "missing"),
+            format="csr",
+        )
+
+    # Curvilinear: the four corners of the source cell of each point
+    j0, j1, wy, yin = linear_brackets(src_lat, dst_lat, None, outside)
+    i0, i1, wx, xin = linear_brackets(src_lon, dst_lon, period, "missing")
+    rows = np.nonzero(yin & xin)[0]
+    cols = [j * nlon + i for j in (j0, j1) for i in (i0, i1)]
+    vals = [a * b for a in (1 - wy, wy) for b in (1 - wx, wx)]
+    matrix = sparse.csr_matrix(
+        (
+            np.concatenate([v[rows] for v in vals]),
+            (np.tile(rows, 4), np.concatenate([c[rows] for c in cols])),
+        ),
+        shape=(dst_lat.size, len(src_lat) * nlon),
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def conservative_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """Sparse first-order conservative weights between two regular lat-lon
+    grids: the area fraction of each destination cell covered by each
+    source cell (areas on the sphere, separable in latitude and longitude)"""
+
+    if np.ndim(dst_lat) != 1:
+        raise ValueError("Conservative weights need a lat-lon destination grid")
+
+    periodic = is_global(src_lon)
+    period = 360.0 if periodic else None
+    sinlat = lambda lat: np.sin(np.deg2rad(lat))  # noqa: E731
+
+    wlat = overlap_matrix(
+        cell_bounds(src_lat, limits=(-90, 90)),
+        cell_bounds(dst_lat, limits=(-90, 90)),
+        measure=sinlat,
+    )
+    wlon = overlap_matrix(
+        lon_bounds(src_lon, period), lon_bounds(dst_lon, period), period=period
+    )
+
+    return sparse.kron(wlat, wlon, format="csr")
+
+
+def lon_bounds(lon, period=None):
+    """Cell bounds of longitudes, in [0, period) and in the original order
+    of the longitudes if periodic"""
+    lon = np.asarray(lon, np.float64)
+    if period is None:
+        return cell_bounds(lon)
+    lon = np.mod(lon, period)
+    order = np.argsort(lon)
+    bounds = np.empty((len(lon), 2))
+    bounds[order] = cell_bounds(lon[order])
+    return bounds
+
+
+###########################################################
+###########################################################
+
+
+def grid_id(src_lat, src_lon, dst_lat, dst_lon, method):
+    """Hash of the grids and method, stored with the weights to check that
+    a weights file matches the grids it is used for"""
+    sha = hashlib.sha1(method.encode())
+    for coord in (src_lat, src_lon, dst_lat, dst_lon):
+        coord = np.ascontiguousarray(coord, np.float64)
+        sha.update(str(coord.shape).encode())
+        sha.update(np.round(coord, 6).tobytes())
+    return sha.hexdigest()
+
+
+class Regridder:
+    """Sparse regridding weights from a regular lat-lon source grid to a
+    destination grid.
+    method: "bilinear" or "conservative"
+    min_weight: destination points where the valid source points add up to
+    less than this weight are missing (NaN). By default, bilinear points
+    with any missing neighbour are missing and conservative points are
+    normalized by the valid area (as cdo remapbil/remapcon)
+    """
+
+    default_min_weight = {"bilinear": 1 - 1e-6, "conservative": 1e-6}
+
+    def __init__(
+        self, src_lat, src_lon, dst_lat, dst_lon, method="bilinear", min_weight=None
+    ):
+        self.method = method
+        self.min_weight = (
+            self.default_min_weight[method] if min_weight is None else min_weight
+        )
+        if src_lat is None:
+            return
+
+        self.src_shape = (len(src_lat), len(src_lon))
+        if np.ndim(dst_lat) == 1:
+            self.dst_shape = (len(dst_lat), len(dst_lon))
+        else:
+            self.dst_shape = np.shape(dst_lat)
+        self.grid_id = grid_id(src_lat, src_lon, dst_lat, dst_lon, method)
+
+        if method == "bilinear":
+            self.weights = bilinear_weights(src_lat, src_lon, dst_lat, dst_lon)
+        elif method == "conservative":
+            self.weights = conservative_weights(src_lat, src_lon, dst_lat, dst_lon)
+        else:
+            raise ValueError(f"Unknown regridding method {method}")
+
+    def apply(self, field, block=None):
+        """Regrid field (..., src lat, src lon) to (..., dst shape),
+        block records (leading dimensions) at a time. Masked or NaN
+        values are missing"""
+
+        field = np.ma.filled(np.ma.masked_invalid(field).astype(np.float64), np.nan)
+        lead = field.shape[:-2]
+        records = field.reshape((-1,) + (self.src_shape[0] * self.src_shape[1],))
+        nrec = records.shape[0]
+        block = nrec if block is None else block
+
+        out = np.empty((nrec, self.weights.shape[0]), np.float32)
+        for r0 in range(0, nrec, block):
+            values = records[r0 : r0 + block].T
+            valid = np.isfinite(values)
+            total = self.weights @ np.where(valid, values, 0.0)
+            weight = self.weights @ valid.astype(np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[r0 : r0 + block] = np.where(
+                    weight >= self.min_weight, total / weight, np.nan
+                ).T
+
+        return out.reshape(lead + tuple(self.dst_shape))
+
+    def save(self, filename):
+        """Write the weights to a .npz file"""
+        weights = self.weights.tocsr()
+        np.savez(
+            filename,
+            data=weights.data,
+            indices=weights.indices,
+            indptr=weights.indptr,
+            shape=weights.shape,
+            src_shape=self.src_shape,
+            dst_shape=self.dst_shape,
+            method=self.method,
+            min_weight=self.min_weight,
+            grid_id=self.grid_id,
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """Regridder with the weights of a .npz file"""
+        with np.load(filename) as data:
+            self = cls(
+                None, None, None, None, str(data["method"]), float(data["min_weight"])
+            )
+            self.weights = sparse.csr_matrix(
+                (data["data"], data["indices"], data["indptr"]),
+                shape=tuple(data["shape"]),
+            )
+            self.src_shape = tuple(int(n) for n in data["src_shape"])
+            self.dst_shape = tuple(int(n) for n in data["dst_shape"])
+            self.grid_id = str(data["grid_id"])
+        return self
+
+
+def cached_regridder(
+    filename, src_lat, src_lon, dst_lat, dst_lon, method="bilinear", min_weight=None
+):
+    """Regridder whose weights are read from filename if it exists and was
+    computed for the same grids and method, otherwise computed and written
+    to filename"""
+
+    gid = grid_id(src_lat, src_lon, dst_lat, dst_lon, method)
+    if os.path.isfile(filename):
+        regridder = Regridder.load(filename)
+        if regridder.grid_id == gid:
+            if min_weight is not None:
+                regridder.min_weight = min_weight
+            return regridder
+
+    regridder = Regridder(src_lat, src_lon, dst_lat, dst_lon, method, min_weight)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    regridder.save(filename)
+    return regridder
+
+
+###########################################################
+###########################################################
+
+
+def apply_axis(matrix, field, axis):
+    """Apply a sparse matrix (e.g. linear_matrix between two sets of
+    levels) along one axis of field"""
+    field = np.moveaxis(np.asarray(field), axis, 0)
+    shape = field.shape
+    out = matrix @ field.reshape(shape[0], -1)
+    return np.moveaxis(out.reshape((matrix.shape[0],) + shape[1:]), 0, axis)